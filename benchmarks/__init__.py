@@ -0,0 +1,16 @@
+"""End-to-end benchmarks for photonpump.
+
+Each workload runs a real client against an in-memory EventStoreServer on
+the loopback interface, so results measure the client and not the server.
+Run them all and write the results as JSON with
+
+    python -m benchmarks --output results.json
+
+or pick workloads by name with `--only`. Latencies are reported as p50,
+p99 and p999 in seconds, alongside throughput in operations per second.
+
+The failover scenarios put a FaultyProxy between the client and the
+server, and measure how long the client takes to notice a partition, to
+move to another node when one dies, and to complete the requests that were
+in flight when a fault struck.
+"""
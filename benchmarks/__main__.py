@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from . import failover  # noqa: F401, registers the failover scenarios
+from .harness import report
+from .workloads import WORKLOADS
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Run photonpump's benchmarks."
+    )
+    parser.add_argument(
+        "--output", "-o", help="Write the results as JSON to this file."
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=sorted(WORKLOADS),
+        help="Run these workloads instead of all of them.",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiply the size of each workload, eg. 0.1 for a quick run.",
+    )
+    parser.add_argument("--label", help="A label for the run, eg. a version.")
+
+    return parser.parse_args(argv)
+
+
+async def run(names, scale):
+    results = []
+
+    for name in names:
+        for result in await WORKLOADS[name](scale):
+            print(result, flush=True)
+            results.append(result)
+
+    return results
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run(args.only or list(WORKLOADS), args.scale))
+    document = report(results, label=args.label, scale=args.scale)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(document, output, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
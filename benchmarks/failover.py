@@ -0,0 +1,237 @@
+"""Failover scenarios, run through FaultyProxy so that the client sees real
+network faults: partitions, resets and dead nodes.
+
+Importing this module registers the scenarios as workloads, so they run
+with the rest of the suite, or alone with
+
+    python -m benchmarks --only heartbeat_detection rediscovery in_flight_recovery
+"""
+
+import asyncio
+import time
+from typing import Callable, List, Optional
+
+from photonpump.connection import Client, Connector, MessageDispatcher
+from photonpump.discovery import DiscoveryFailed, DiscoveryRetryPolicy, NodeService
+from photonpump.testing import EventStoreServer, FaultyProxy
+from photonpump.transport import TransportConfig
+
+from .harness import Result
+from .workloads import seed, workload
+
+#: Heartbeats fast enough that a partition is detected in well under a
+#: second, rather than the default two minutes.
+FAST_HEARTBEATS = TransportConfig(heartbeat_period=0.1, heartbeat_timeout=0.1)
+
+
+def fast_retries() -> DiscoveryRetryPolicy:
+    """Retry a node almost at once, so that scenarios measuring something
+    else don't spend their time backing off."""
+
+    return DiscoveryRetryPolicy(retries_per_node=100, retry_interval=0.01, jitter=0)
+
+
+class Failover:
+    """Discovers the first node that hasn't failed, as cluster discovery
+    would once gossip showed that the old master had gone."""
+
+    def __init__(self, *nodes: NodeService) -> None:
+        self.nodes = list(nodes)
+        self.failed = set()
+
+    def mark_failed(self, node: NodeService) -> None:
+        self.failed.add(node)
+
+    async def discover(self) -> NodeService:
+        for node in self.nodes:
+            if node not in self.failed:
+                return node
+        raise DiscoveryFailed()
+
+
+def when(event, predicate: Optional[Callable[..., bool]] = None) -> asyncio.Future:
+    """A future that resolves the next time a Connector event fires, with
+    the event's arguments."""
+
+    future = asyncio.get_event_loop().create_future()
+
+    def fire(*args):
+        if not future.done() and (predicate is None or predicate(*args)):
+            future.set_result(args)
+
+    event.append(fire)
+    # Events are lists of callbacks; don't remove one while it's being run.
+    future.add_done_callback(lambda _: event.remove(fire))
+
+    return future
+
+
+class Proxied:
+    """In-memory EventStoreServers, each behind a FaultyProxy, and a client
+    whose Connector reaches them through the proxies, failing over from
+    one node to the next.
+
+    Examples:
+        >>> async with Proxied(nodes=2) as cluster:
+        >>>     cluster.proxies[0].blackhole()
+        >>>     await cluster.client.ping()
+    """
+
+    def __init__(
+        self,
+        nodes: int = 1,
+        retry_policy: Optional[DiscoveryRetryPolicy] = None,
+        transport_config: TransportConfig = FAST_HEARTBEATS,
+    ) -> None:
+        self.servers = [EventStoreServer() for _ in range(nodes)]
+        self.proxies: List[FaultyProxy] = []
+        self.retry_policy = retry_policy or fast_retries()
+        self.transport_config = transport_config
+        self.connector = None
+        self.client = None
+
+    async def __aenter__(self):
+        for server in self.servers:
+            await server.start()
+            proxy = FaultyProxy(server.node)
+            await proxy.start()
+            self.proxies.append(proxy)
+
+        dispatcher = MessageDispatcher()
+        self.connector = Connector(
+            Failover(*(p.node for p in self.proxies)),
+            dispatcher,
+            retry_policy=self.retry_policy,
+            transport_config=self.transport_config,
+        )
+        self.client = Client(self.connector, dispatcher)
+        await self.client.connect()
+        await self.client.ping()
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.client.close()
+
+        for proxy in self.proxies:
+            await proxy.stop()
+
+        for server in self.servers:
+            await server.stop()
+
+
+@workload
+async def heartbeat_detection(scale: float) -> List[Result]:
+    """The time from a network partition until heartbeats drop the
+    connection. Three heartbeats must time out in a row, so expect about
+    three times the heartbeat period plus timeout."""
+
+    result = Result(
+        "heartbeat_detection",
+        heartbeat_period=FAST_HEARTBEATS.heartbeat_period,
+        heartbeat_timeout=FAST_HEARTBEATS.heartbeat_timeout,
+    )
+    attempts = max(int(10 * scale), 3)
+
+    async with Proxied() as cluster:
+        [proxy] = cluster.proxies
+
+        for _ in range(attempts):
+            await cluster.client.ping()
+            disconnected = when(cluster.connector.disconnected)
+            partitioned = time.perf_counter()
+            proxy.blackhole()
+
+            await disconnected
+            result.record(time.perf_counter() - partitioned)
+
+            connected = when(cluster.connector.connected)
+            proxy.heal()
+            await connected
+            cluster.retry_policy.record_success(cluster.connector.target_node)
+
+    return [result]
+
+
+@workload
+async def rediscovery(scale: float) -> List[Result]:
+    """The time from a node dying until the connector is connected to the
+    next one, by the number of times the default retry policy retries a
+    node before asking discovery for another."""
+
+    results = []
+    attempts = max(int(5 * scale), 2)
+
+    for retries_per_node in (1, 3):
+        result = Result("rediscovery", retries_per_node=retries_per_node)
+
+        for _ in range(attempts):
+            policy = DiscoveryRetryPolicy(retries_per_node=retries_per_node)
+
+            async with Proxied(nodes=2, retry_policy=policy) as cluster:
+                dying, survivor = cluster.proxies
+                connected = when(
+                    cluster.connector.connected, lambda node: node == survivor.node
+                )
+                died = time.perf_counter()
+                # Stopping the proxy resets its connections and refuses
+                # new ones, as if the node's host had gone.
+                await dying.stop()
+
+                await connected
+                result.record(time.perf_counter() - died)
+                await cluster.client.ping()
+
+        results.append(result)
+
+    return results
+
+
+@workload
+async def in_flight_recovery(scale: float) -> List[Result]:
+    """The time from a fault until every read that was in flight when it
+    struck has completed on a new connection. A reset is noticed at once,
+    while a partition has to wait for heartbeats."""
+
+    results = []
+    in_flight = max(int(1000 * scale), 10)
+    attempts = max(int(5 * scale), 2)
+
+    for fault in ("reset", "blackhole"):
+        result = Result("in_flight_recovery", fault=fault, in_flight=in_flight)
+
+        async with Proxied() as cluster:
+            [proxy] = cluster.proxies
+            seed(cluster.servers[0], "in-flight", 100)
+
+            for _ in range(attempts):
+                await cluster.client.ping()
+                # Hold the replies in the proxy, so that the reads are still
+                # in flight when the fault strikes.
+                proxy.delay(0.05)
+                reads = [
+                    asyncio.ensure_future(
+                        cluster.client.get_event("in-flight", i % 100)
+                    )
+                    for i in range(in_flight)
+                ]
+                await asyncio.sleep(0.01)
+
+                failed = time.perf_counter()
+
+                if fault == "reset":
+                    proxy.reset()
+                    proxy.heal()
+                else:
+                    disconnected = when(cluster.connector.disconnected)
+                    proxy.blackhole()
+                    await disconnected
+                    proxy.heal()
+
+                await asyncio.gather(*reads)
+                result.record(time.perf_counter() - failed)
+                cluster.retry_policy.record_success(cluster.connector.target_node)
+
+        results.append(result)
+
+    return results
@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+import math
+import platform
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from photonpump import connect
+from photonpump.testing import EventStoreServer
+
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """The nearest-rank percentile of some sorted samples."""
+
+    if not ordered:
+        return 0.0
+
+    rank = math.ceil(fraction * len(ordered))
+
+    return ordered[max(rank - 1, 0)]
+
+
+class Result:
+    """The samples and totals measured by one run of a workload.
+
+    Samples are latencies in seconds unless `unit` says otherwise. If
+    `operations` and `elapsed` are set, the result also reports a
+    throughput, in operations per second.
+
+    Args:
+        name: The name of the workload.
+        unit (optional): The unit of the samples, defaults to seconds.
+        **params: The parameters that distinguish this run, eg. batch size.
+    """
+
+    def __init__(self, name: str, unit: str = "seconds", **params) -> None:
+        self.name = name
+        self.unit = unit
+        self.params = params
+        self.samples: List[float] = []
+        self.operations = 0
+        self.elapsed = 0.0
+
+    def record(self, sample: float) -> None:
+        self.samples.append(sample)
+
+    def as_dict(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        result = {
+            "name": self.name,
+            "params": self.params,
+            "unit": self.unit,
+            "count": len(ordered),
+            "min": ordered[0] if ordered else 0.0,
+            "max": ordered[-1] if ordered else 0.0,
+            "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+            "p50": percentile(ordered, 0.5),
+            "p99": percentile(ordered, 0.99),
+            "p999": percentile(ordered, 0.999),
+        }
+
+        if self.operations and self.elapsed:
+            result["operations"] = self.operations
+            result["elapsed"] = self.elapsed
+            result["throughput"] = self.operations / self.elapsed
+
+        return result
+
+    def __str__(self):
+        summary = self.as_dict()
+        params = " ".join("%s=%s" % p for p in sorted(self.params.items()))
+        line = "%-24s %-28s" % (self.name, params)
+
+        if self.unit == "seconds":
+            line += " p50=%8.1fus p99=%8.1fus p999=%8.1fus" % (
+                summary["p50"] * 1e6,
+                summary["p99"] * 1e6,
+                summary["p999"] * 1e6,
+            )
+        else:
+            line += " mean=%.1f %s" % (summary["mean"], self.unit)
+
+        if "throughput" in summary:
+            line += " %10.0f/s" % summary["throughput"]
+
+        return line
+
+
+class Timer:
+    """Records the time taken by a block, eg. one request, into a Result.
+
+    Examples:
+        >>> with Timer(result):
+        >>>     await client.ping()
+    """
+
+    __slots__ = ("result", "started")
+
+    def __init__(self, result: Result) -> None:
+        self.result = result
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.result.record(time.perf_counter() - self.started)
+
+
+class StandIn:
+    """An in-memory EventStoreServer and a client connected to it.
+
+    Each workload gets a fresh pair, so that one workload's streams and
+    connections can't affect the next.
+
+    Examples:
+        >>> async with StandIn() as (server, client):
+        >>>     await client.ping()
+    """
+
+    def __init__(self, **connect_args) -> None:
+        self.connect_args = connect_args
+        self.server = EventStoreServer()
+        self.client = None
+
+    async def __aenter__(self):
+        await self.server.start()
+        self.client = connect(
+            host=self.server.host, port=self.server.port, **self.connect_args
+        )
+        await self.client.connect()
+        await self.client.ping()
+
+        return (self.server, self.client)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.client.close()
+        await self.server.stop()
+
+
+def report(
+    results: Sequence[Result], label: Optional[str] = None, scale: float = 1.0
+) -> Dict[str, Any]:
+    """Build the JSON document for a benchmark run."""
+
+    return {
+        "label": label,
+        "finished": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "event_loop": type(asyncio.get_event_loop()).__module__,
+        "scale": scale,
+        "results": [r.as_dict() for r in results],
+    }
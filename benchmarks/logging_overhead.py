@@ -0,0 +1,103 @@
+"""Measure what logging costs the read path.
+
+Frames are pushed through MessageReader.process and ReadEvent.respond_to,
+first with logging at its default configuration and then with logging
+disabled outright. The default configuration should be as fast as no
+logging at all; the script exits with an error if it is measurably slower.
+
+Run it from the root of the repository with
+
+    python -m benchmarks.logging_overhead
+"""
+
+import asyncio
+import gc
+import logging
+import sys
+import time
+import uuid
+
+from photonpump import messages as msg
+from photonpump import messages_pb2 as proto
+from photonpump.connection import MessageReader
+from photonpump.conversations import ReadEvent
+
+FRAMES = 2000
+REPEATS = 51
+#: Run to run, the fastest time of each configuration still varies by a few
+#: percent on a quiet machine, so we only fail well above that.
+TOLERANCE = 1.10
+
+
+class Sink:
+    def __init__(self):
+        self.items = []
+
+    async def put(self, item):
+        self.items.append(item)
+
+
+def read_event_frame() -> bytes:
+    response = proto.ReadEventCompleted()
+    response.result = msg.ReadEventResult.Success
+    event = response.event.event
+    event.event_stream_id = "benchmark"
+    event.event_number = 1
+    event.event_id = uuid.uuid4().bytes_le
+    event.event_type = "thing_happened"
+    event.data_content_type = msg.ContentType.Json
+    event.metadata_content_type = msg.ContentType.Binary
+    event.data = b'{"thing": 1, "happening": true}'
+
+    message = msg.OutboundMessage(
+        uuid.uuid4(), msg.TcpCommand.ReadEventCompleted, response.SerializeToString()
+    )
+
+    return bytes(message.header_bytes) + message.payload
+
+
+async def run_once(chunk: bytes) -> float:
+    sink = Sink()
+    reader = MessageReader(asyncio.StreamReader(), 1, sink, None)
+    gc.collect()
+
+    started = time.perf_counter()
+    await reader.process(chunk)
+
+    for message in sink.items:
+        await ReadEvent("benchmark", 1).respond_to(message, None)
+
+    return (time.perf_counter() - started) / FRAMES
+
+
+async def main() -> int:
+    chunk = read_event_frame() * FRAMES
+    await run_once(chunk)
+
+    # Interleave the two configurations, swapping which goes first, so that
+    # both see the same noise and drift. The fastest run of each is the one
+    # least disturbed by the rest of the machine.
+    default, disabled = [], []
+
+    for repeat in range(REPEATS):
+        for log in (True, False) if repeat % 2 else (False, True):
+            logging.disable(logging.NOTSET if log else logging.CRITICAL)
+            (default if log else disabled).append(await run_once(chunk))
+    logging.disable(logging.NOTSET)
+
+    default = min(default)
+    disabled = min(disabled)
+
+    print("default logging:  %.2fus per message" % (default * 1e6))
+    print("logging disabled: %.2fus per message" % (disabled * 1e6))
+
+    if default > disabled * TOLERANCE:
+        print("Default logging adds more than %d%%" % ((TOLERANCE - 1) * 100))
+
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.get_event_loop().run_until_complete(main()))
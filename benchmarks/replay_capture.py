@@ -0,0 +1,78 @@
+"""Replay a capture through the client's read and dispatch path.
+
+Record traffic with `connect(capture=CaptureFile(path))`, then replay it
+offline as fast as possible, or at the recorded pace with `--speed`. Pass
+`--profile` to see where parsing and dispatching the traffic spends its
+time.
+
+    python -m benchmarks.replay_capture /tmp/traffic.ppcap --profile
+"""
+
+import argparse
+import asyncio
+import cProfile
+import logging
+import pstats
+import sys
+
+from photonpump.capture import capture_files, read_capture
+from photonpump.replay import replay
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="The capture file, without a rotation suffix.")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="Keep to the recorded timing, sped up by this factor.",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="Profile the replay with cProfile."
+    )
+    parser.add_argument(
+        "--top", type=int, default=30, help="The number of functions to profile."
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    files = capture_files(args.path)
+
+    if not files:
+        print("No capture found at %s" % args.path)
+
+        return 1
+
+    # Read the capture up front so that file IO isn't part of the replay.
+    chunks = list(read_capture(*files))
+    loop = asyncio.get_event_loop()
+    profile = cProfile.Profile() if args.profile else None
+
+    if profile:
+        profile.enable()
+    stats = loop.run_until_complete(replay(chunks, speed=args.speed))
+
+    if profile:
+        profile.disable()
+
+    print(
+        "%d chunks, %d bytes, %d frames, %d requests in %.3fs"
+        % (stats.chunks, stats.bytes, stats.frames, stats.requests, stats.elapsed)
+    )
+
+    if stats.elapsed:
+        print("%.0f frames/s" % (stats.frames / stats.elapsed))
+
+    if profile:
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(args.top)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
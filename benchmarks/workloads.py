@@ -0,0 +1,259 @@
+import asyncio
+import time
+import tracemalloc
+from typing import List
+
+from photonpump import messages as msg
+from photonpump.discovery import DiscoveryRetryPolicy
+
+from .harness import Result, StandIn, Timer
+
+#: Workloads are registered here by name, in the order they run.
+WORKLOADS = {}
+
+
+def workload(fn):
+    WORKLOADS[fn.__name__] = fn
+
+    return fn
+
+
+def new_events(count: int, size: int = 100) -> List[msg.NewEventData]:
+    body = {"payload": "x" * size}
+
+    return [msg.NewEvent("benchmark_event", data=body) for _ in range(count)]
+
+
+def seed(server, stream: str, count: int, batch: int = 1000) -> None:
+    """Write events straight into the server, so that read benchmarks don't
+    pay for writing their data."""
+
+    for start in range(0, count, batch):
+        server.append(stream, new_events(min(batch, count - start)))
+
+
+@workload
+async def publish(scale: float) -> List[Result]:
+    """Events per second written with `Client.publish`, by batch size and
+    number of concurrent writers, with the latency of each call."""
+
+    results = []
+    total = max(int(20000 * scale), 100)
+
+    for batch_size in (1, 10, 100):
+        for concurrency in (1, 10, 100):
+            result = Result("publish", batch_size=batch_size, concurrency=concurrency)
+            calls = max(total // batch_size // concurrency, 1)
+            batch = new_events(batch_size)
+
+            async with StandIn() as (_, client):
+
+                async def writer(stream):
+                    for _ in range(calls):
+                        with Timer(result):
+                            await client.publish(stream, batch)
+
+                started = time.perf_counter()
+                await asyncio.gather(
+                    *(writer("publish-%d" % i) for i in range(concurrency))
+                )
+                result.elapsed = time.perf_counter() - started
+                result.operations = calls * concurrency * batch_size
+
+            results.append(result)
+
+    return results
+
+
+@workload
+async def publish_event(scale: float) -> List[Result]:
+    """The latency of writing one event at a time."""
+
+    result = Result("publish_event")
+    count = max(int(5000 * scale), 100)
+
+    async with StandIn() as (_, client):
+        started = time.perf_counter()
+
+        for i in range(count):
+            with Timer(result):
+                await client.publish_event("publish-event", "benchmark_event", {"n": i})
+
+        result.elapsed = time.perf_counter() - started
+        result.operations = count
+
+    return [result]
+
+
+@workload
+async def reads(scale: float) -> List[Result]:
+    """The latency of `Client.get_event` and of `Client.get` by page size."""
+
+    count = max(int(5000 * scale), 100)
+    results = []
+
+    async with StandIn() as (server, client):
+        seed(server, "reads", 1000)
+
+        result = Result("get_event")
+        started = time.perf_counter()
+
+        for _ in range(count):
+            with Timer(result):
+                await client.get_event("reads", 500)
+
+        result.elapsed = time.perf_counter() - started
+        result.operations = count
+        results.append(result)
+
+        for max_count in (1, 100, 1000):
+            result = Result("get", max_count=max_count)
+            started = time.perf_counter()
+
+            for _ in range(max(count // max_count * 10, 10)):
+                with Timer(result):
+                    await client.get("reads", max_count=max_count)
+
+            result.elapsed = time.perf_counter() - started
+            result.operations = len(result.samples) * max_count
+            results.append(result)
+
+    return results
+
+
+@workload
+async def iterate(scale: float) -> List[Result]:
+    """Events per second read with `Client.iter` over a large stream. The
+    samples are the time taken by each page."""
+
+    count = max(int(200000 * scale), 1000)
+    results = []
+
+    async with StandIn() as (server, client):
+        seed(server, "iterate", count)
+
+        for batch_size in (100, 1000):
+            result = Result("iter", batch_size=batch_size, events=count)
+            read = 0
+            started = mark = time.perf_counter()
+
+            async for _ in client.iter("iterate", batch_size=batch_size):
+                read += 1
+
+                if read % batch_size == 0:
+                    now = time.perf_counter()
+                    result.record(now - mark)
+                    mark = now
+
+            result.elapsed = time.perf_counter() - started
+            result.operations = read
+            results.append(result)
+
+    return results
+
+
+@workload
+async def persistent_subscription(scale: float) -> List[Result]:
+    """Events per second delivered to, and acked by, a persistent
+    subscriber. The samples are the time between deliveries."""
+
+    count = max(int(20000 * scale), 1000)
+    result = Result("persistent_subscription", events=count)
+
+    async with StandIn() as (server, client):
+        seed(server, "persistent", count)
+        await client.create_subscription("benchmark", "persistent", start_from=0)
+        subscription = await client.connect_subscription("benchmark", "persistent")
+
+        received = 0
+        started = mark = time.perf_counter()
+
+        async for event in subscription.events:
+            await subscription.ack(event)
+            now = time.perf_counter()
+            result.record(now - mark)
+            mark = now
+            received += 1
+
+            if received == count:
+                break
+
+        result.elapsed = time.perf_counter() - started
+        result.operations = received
+
+    return [result]
+
+
+@workload
+async def reconnect(scale: float) -> List[Result]:
+    """The time from the server dropping a connection until a ping succeeds
+    on the connection that replaces it.
+
+    A client of a single node gives up on it after the first failure, so
+    this installs the retry policy that cluster discovery uses.
+    """
+
+    result = Result("reconnect")
+    attempts = max(int(20 * scale), 3)
+
+    async with StandIn() as (server, client):
+        policy = client.connector.retry_policy = DiscoveryRetryPolicy()
+
+        for _ in range(attempts):
+            await client.ping()
+
+            dropped = time.perf_counter()
+
+            for connection in list(server.connections):
+                connection.close()
+
+            # The ping is re-sent on the new connection if the old one
+            # swallowed it.
+            await client.ping()
+            result.record(time.perf_counter() - dropped)
+            # A heartbeat would reset the failure count on a longer-lived
+            # connection, and each attempt should start from scratch.
+            policy.record_success(client.connector.target_node)
+
+    return [result]
+
+
+@workload
+async def memory(scale: float) -> List[Result]:
+    """The memory held per conversation in flight, measured with the server
+    not reading, so that requests back up in the client."""
+
+    results = []
+
+    for in_flight in (1000, 10000):
+        in_flight = max(int(in_flight * scale), 100)
+        result = Result("memory_per_conversation", unit="bytes", in_flight=in_flight)
+
+        async with StandIn() as (server, client):
+            for connection in server.connections:
+                connection.transport.pause_reading()
+
+            tracemalloc.start()
+            before, _ = tracemalloc.get_traced_memory()
+
+            writes = [
+                asyncio.ensure_future(
+                    client.publish_event("memory", "benchmark_event", {"n": i})
+                )
+                for i in range(in_flight)
+            ]
+
+            while len(client.dispatcher.active_conversations) < in_flight:
+                await asyncio.sleep(0.001)
+
+            during, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result.record((during - before) / in_flight)
+
+            for connection in server.connections:
+                connection.transport.resume_reading()
+            await asyncio.gather(*writes)
+
+        results.append(result)
+
+    return results
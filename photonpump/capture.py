@@ -0,0 +1,222 @@
+import enum
+import logging
+import os
+import struct
+import time
+from typing import Iterator, List, NamedTuple
+
+LOG = logging.getLogger("photonpump.capture")
+
+MAGIC = b"PPCAP\x01"
+
+#: Each chunk is stored as a record header, then the chunk's bytes. The
+#: header holds the wall clock time, the capture's number for the connection,
+#: the direction and the length of the chunk.
+RECORD = struct.Struct("<dIBI")
+
+# In an outbound frame, the flags byte and, if it has credentials, the length
+# of the login, which is followed by the login, the length of the password
+# and the password.
+FLAGS_OFFSET = 5
+LOGIN_OFFSET = 22
+AUTHENTICATED = 0x01
+
+
+class Direction(enum.IntEnum):
+    Inbound = 0
+    Outbound = 1
+
+
+class CapturedChunk(NamedTuple):
+    """Some bytes that crossed a connection.
+
+    Inbound chunks are the bytes as the transport delivered them, so they
+    split and join frames just as the network did. Outbound chunks are
+    whole frames.
+
+    Attributes:
+        timestamp: When the chunk was captured, in seconds since the epoch.
+        connection: The capture's number for the connection.
+        direction: Whether the chunk was received or sent.
+        data: The bytes.
+    """
+
+    timestamp: float
+    connection: int
+    direction: Direction
+    data: bytes
+
+
+class Capture:
+    """Discards traffic. Used unless a CaptureFile is given."""
+
+    enabled = False
+
+    def connection_opened(self) -> int:
+        return 0
+
+    def record(self, connection: int, direction: Direction, data: bytes) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+NULL_CAPTURE = Capture()
+
+
+class CaptureFile(Capture):
+    """Writes every chunk of traffic on a client's connections to a compact
+    binary file, for replay with `photonpump.replay`.
+
+    When the file grows beyond `max_bytes` it is rotated, as by
+    `logging.handlers.RotatingFileHandler`: `path` becomes `path.1`,
+    `path.1` becomes `path.2` and so on, keeping at most `backups` old
+    files. `capture_files` lists them oldest first.
+
+    Writes are buffered, so call `close` once the client has stopped to be
+    sure that the file is complete.
+
+    Examples:
+        >>> capture = CaptureFile("/tmp/traffic.ppcap")
+        >>> async with connect(capture=capture) as client:
+        >>>     await client.get("my-stream")
+        >>> capture.close()
+
+    Args:
+        path: The file to write.
+        max_bytes (optional): The size at which to rotate the file,
+            defaults to 64MiB.
+        backups (optional): The number of rotated files to keep.
+        redact_credentials (optional): If True, the default, passwords in
+            outbound frames are overwritten with zeros.
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        backups: int = 5,
+        redact_credentials: bool = True,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.redact_credentials = redact_credentials
+        self.connections = 0
+        self._file = None
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "ab", buffering=64 * 1024)
+
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def _rotate(self) -> None:
+        self._file.close()
+
+        for index in range(self.backups - 1, 0, -1):
+            source = "%s.%d" % (self.path, index)
+
+            if os.path.exists(source):
+                os.replace(source, "%s.%d" % (self.path, index + 1))
+
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def connection_opened(self) -> int:
+        self.connections += 1
+
+        return self.connections
+
+    def record(self, connection: int, direction: Direction, data: bytes) -> None:
+        if (
+            self.redact_credentials
+            and direction == Direction.Outbound
+            and len(data) > LOGIN_OFFSET
+            and data[FLAGS_OFFSET] & AUTHENTICATED
+        ):
+            data = _redact(data)
+
+        self._file.write(RECORD.pack(time.time(), connection, direction, len(data)))
+        self._file.write(data)
+
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+
+def _redact(frame: bytes) -> bytes:
+    frame = bytearray(frame)
+    password_offset = LOGIN_OFFSET + 1 + frame[LOGIN_OFFSET]
+    length = frame[password_offset]
+    frame[password_offset + 1 : password_offset + 1 + length] = bytes(length)
+
+    return bytes(frame)
+
+
+def capture_files(path: str) -> List[str]:
+    """The files written by a CaptureFile at `path`, oldest first."""
+
+    rotated = []
+    index = 1
+
+    while os.path.exists("%s.%d" % (path, index)):
+        rotated.append("%s.%d" % (path, index))
+        index += 1
+
+    rotated.reverse()
+
+    if os.path.exists(path):
+        rotated.append(path)
+
+    return rotated
+
+
+def read_capture(*paths: str) -> Iterator[CapturedChunk]:
+    """Read the chunks from one or more capture files, in order.
+
+    A record cut short at the end of a file, eg. because the process was
+    killed while capturing, is skipped with a warning.
+
+    Raises:
+        ValueError: If a file isn't a photonpump capture.
+    """
+
+    for path in paths:
+        with open(path, "rb") as capture:
+            if capture.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a photonpump capture" % path)
+
+            while True:
+                header = capture.read(RECORD.size)
+
+                if not header:
+                    break
+
+                if len(header) < RECORD.size:
+                    LOG.warning("Skipping a truncated record at the end of %s", path)
+
+                    break
+
+                timestamp, connection, direction, length = RECORD.unpack(header)
+                data = capture.read(length)
+
+                if len(data) < length:
+                    LOG.warning("Skipping a truncated record at the end of %s", path)
+
+                    break
+
+                yield CapturedChunk(timestamp, connection, Direction(direction), data)
@@ -1,15 +1,37 @@
 import array
 import asyncio
+import collections
 import enum
 import logging
+import socket
 import struct
+import time
 import uuid
 from typing import Any, NamedTuple, Optional, Sequence
 
+from google.protobuf.message import DecodeError
+
 from . import conversations as convo
 from . import messages as msg
 from . import messages_pb2 as proto
-from .discovery import DiscoveryRetryPolicy, NodeService, get_discoverer
+from . import writers
+from .capture import NULL_CAPTURE, Capture, Direction
+from .instrumentation import Dump, LogLevels
+from .metrics import NULL_METRICS, Histogram, Metrics
+from .retry import AimdLimiter, RetryPolicy
+from .discovery import (
+    DiscoveryRetryPolicy,
+    GossipMonitor,
+    HealthTracker,
+    NodeService,
+    get_discoverer,
+    select_candidates,
+)
+from .routing import ClusterRouter, ConnectionPool, PooledConnection, ReadPreference
+from .tracing import NULL_TRACER, Stage, Tracer
+from .transport import DEFAULT, TransportConfig, apply_transport_config
+
+LOG = logging.getLogger("photonpump.connection")
 
 HEADER_LENGTH = 1 + 1 + 16
 SIZE_UINT_32 = 4
@@ -31,6 +53,9 @@ class ConnectorCommand(enum.IntEnum):
     HandleHeartbeatFailed = 5
     HandleHeartbeatSuccess = 6
 
+    HandleRedirect = 7
+    HandleMasterChanged = 8
+
     HandleConnectorFailed = -2
 
     Stop = -1
@@ -50,6 +75,130 @@ class ConnectorInstruction(NamedTuple):
     data: Optional[Any]
 
 
+async def _open_socket(node: NodeService, loop) -> socket.socket:
+    [(family, type_, proto, _, address), *_] = await loop.getaddrinfo(
+        node.address, node.port, type=socket.SOCK_STREAM
+    )
+    sock = socket.socket(family, type_, proto)
+
+    try:
+        sock.setblocking(False)
+        await loop.sock_connect(sock, address)
+    except BaseException:
+        sock.close()
+        raise
+
+    return sock
+
+
+def _close_socket(attempt: asyncio.Future) -> None:
+    if not attempt.cancelled() and not attempt.exception():
+        attempt.result().close()
+
+
+async def staggered_connect(
+    nodes: Sequence[NodeService],
+    delay: float,
+    loop=None,
+    timeout: Optional[float] = None,
+    prefer_first: bool = False,
+):
+    """Open a TCP connection to whichever of several nodes answers first.
+
+    This is "happy eyeballs" across the nodes of a cluster: we start
+    connecting to the first node, and start on the next one every `delay`
+    seconds, or as soon as an attempt fails. The first node to complete
+    the handshake wins and the other attempts are abandoned.
+
+    With `prefer_first`, a later node only wins once the attempt on the
+    first node has failed, or `timeout` has passed. Until then, the first
+    later node to connect is held in reserve, and the first node wins if
+    it connects in the meantime. We use this when the first node is the
+    master, so that a slow master doesn't lose to a follower.
+
+    An abandoned attempt may still finish connecting, after the winner was
+    chosen or after we gave up, so its socket is closed whenever it does.
+
+    Returns:
+        The node we connected to, and the connected socket.
+
+    Raises:
+        ConnectionError: if we couldn't connect to any node.
+        asyncio.TimeoutError: if no node answered within `timeout` seconds.
+    """
+    loop = loop or asyncio.get_event_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    remaining = list(nodes)
+    attempts = {}
+    first = None
+    reserve = None
+    result = None
+    error = None
+
+    try:
+        while remaining or attempts:
+            if remaining and not reserve:
+                node = remaining.pop(0)
+                attempt = asyncio.ensure_future(_open_socket(node, loop))
+                attempts[attempt] = node
+                first = first or attempt
+
+            wait = delay if remaining and not reserve else None
+
+            if deadline is not None:
+                left = deadline - loop.time()
+
+                if left <= 0 and not reserve:
+                    raise asyncio.TimeoutError()
+                elif left <= 0:
+                    result = reserve
+
+                    return result
+                wait = left if wait is None else min(wait, left)
+
+            done, _ = await asyncio.wait(
+                attempts, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+            )
+            winner = None
+
+            # Look at the first node before the others, in case they
+            # connected together.
+            for attempt in sorted(done, key=lambda a: a is not first):
+                node = attempts.pop(attempt)
+
+                if attempt.exception():
+                    error = attempt.exception()
+                    LOG.debug("Failed to connect to %s: %s", node, error)
+                elif winner:
+                    attempt.result().close()
+                else:
+                    winner = (node, attempt.result())
+
+            if winner and prefer_first and first in attempts:
+                LOG.debug("Holding %s until %s fails", winner[0], nodes[0])
+                (reserve, winner) = (winner, None)
+
+                # Only the first node can beat the reserve now.
+                for attempt in [a for a in attempts if a is not first]:
+                    del attempts[attempt]
+                    attempt.cancel()
+                    attempt.add_done_callback(_close_socket)
+
+            result = winner or (reserve if first not in attempts else None)
+
+            if result:
+                return result
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+            attempt.add_done_callback(_close_socket)
+
+        if reserve and reserve is not result:
+            reserve[1].close()
+
+    raise ConnectionError(f"Failed to connect to any of {nodes}") from error
+
+
 class Connector:
     def __init__(
         self,
@@ -59,6 +208,13 @@ class Connector:
         ctrl_queue=None,
         connect_timeout=5,
         loop=None,
+        gossip_monitor=None,
+        happy_eyeballs_delay=None,
+        health=None,
+        transport_config: Optional[TransportConfig] = None,
+        metrics: Optional[Metrics] = None,
+        tracer: Optional[Tracer] = None,
+        capture: Optional[Capture] = None,
     ):
         self.connection_counter = 0
         self.dispatcher = dispatcher
@@ -73,7 +229,22 @@ class Connector:
         self.heartbeat_failures = 0
         self.connect_timeout = connect_timeout
         self.active_protocol = None
+        self.target_node = None
+        self.redirect_target = None
+        self.standby = None
+        self.gossip_monitor = gossip_monitor
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.transport_config = transport_config or DEFAULT
+        self.metrics = metrics or NULL_METRICS
+        self.tracer = tracer or NULL_TRACER
+        self.capture = capture or NULL_CAPTURE
+
+        if health is None:
+            health = getattr(discovery, "health", None)
+        self.health = HealthTracker() if health is None else health
         self.retry_policy = retry_policy or DiscoveryRetryPolicy(retries_per_node=0)
+        self.dispatcher.redirect = self.redirect
+        self.dispatcher.observe_latency = self.latency_observed
 
     def _put_msg(self, msg):
         asyncio.ensure_future(self.ctrl_queue.put(msg))
@@ -85,17 +256,33 @@ class Connector:
             )
         )
 
-    def heartbeat_received(self, conversation_id):
+    def heartbeat_received(self, conversation_id, rtt=None):
         self.retry_policy.record_success(self.target_node)
+
+        if rtt is not None and self.target_node:
+            self.health.record_heartbeat(self.target_node, rtt)
         self._put_msg(
             ConnectorInstruction(
                 ConnectorCommand.HandleHeartbeatSuccess, None, conversation_id
             )
         )
 
-    def connection_lost(self, exn=None):
+    def connection_lost(self, exn=None, protocol=None):
+        if protocol is not None and protocol is not self.active_protocol:
+            self.log.info("Lost inactive connection %s: %s", protocol, exn)
+
+            if protocol is self.standby:
+                self.standby = None
+
+            return
+
         self.log.info("connection_lost {}".format(exn))
-        self.retry_policy.record_failure(self.target_node)
+
+        if not self.redirect_target:
+            self.retry_policy.record_failure(self.target_node)
+
+        if exn and self.target_node:
+            self.health.record_failure(self.target_node)
 
         if exn:
             self._put_msg(
@@ -113,7 +300,43 @@ class Connector:
             ConnectorInstruction(ConnectorCommand.HandleHeartbeatFailed, None, exn)
         )
 
+    def latency_observed(self, seconds):
+        if self.target_node:
+            self.health.record_latency(self.target_node, seconds)
+
+    def redirect(self, node: NodeService) -> bool:
+        """Move to a new master, re-sending every active conversation.
+
+        This is called from the dispatch loop, which stopping the protocol
+        would cancel, so the work happens on the control queue.
+
+        Returns:
+            False if we're already connected to the node, in which case
+            there's no reconnect for the caller to wait for. If a move to
+            the node is already pending, the caller's conversation will be
+            re-sent once it's made.
+        """
+
+        if node == self.target_node and not self.redirect_target:
+            return False
+
+        if node != self.redirect_target:
+            self._put_msg(
+                ConnectorInstruction(ConnectorCommand.HandleRedirect, None, node)
+            )
+
+        return True
+
+    def master_changed(self, node: NodeService):
+        """Open a standby connection to a newly elected master, and swap to
+        it once it's open."""
+        self._put_msg(
+            ConnectorInstruction(ConnectorCommand.HandleMasterChanged, None, node)
+        )
+
     async def start(self, target: Optional[NodeService] = None):
+        if self.gossip_monitor:
+            self.gossip_monitor.start()
         self.state = ConnectorState.Connecting
         await self.ctrl_queue.put(
             ConnectorInstruction(ConnectorCommand.Connect, None, target)
@@ -124,6 +347,13 @@ class Connector:
         self.state = ConnectorState.Stopping
         self.log.info("In ur stop stopping ur procool")
 
+        if self.gossip_monitor:
+            self.gossip_monitor.stop()
+
+        if self.standby:
+            await self.standby.stop()
+        self.standby = None
+
         if self.active_protocol:
             await self.active_protocol.stop()
         self.active_protocol = None
@@ -136,7 +366,19 @@ class Connector:
         else:
             await self.start()
 
+    def _candidates(self, node):
+        # Only a node chosen by discovery can be swapped for another; a
+        # node we were sent to is the one we want.
+        if self.happy_eyeballs_delay is None:
+            return [node]
+
+        gossip = getattr(self.discovery, "last_gossip", [])
+
+        return [node] + [c for c in select_candidates(gossip) if c != node]
+
     async def _attempt_connect(self, node):
+        candidates = [node]
+
         if not node:
             try:
                 self.log.debug("Performing node discovery")
@@ -149,16 +391,42 @@ class Connector:
                 )
 
                 return
-        self.log.info("Connecting to %s:%s", node.address, node.port)
+            candidates = self._candidates(node)
+        self.target_node = node
+        started = self.loop.time()
         try:
             self.connection_counter += 1
+
+            if len(candidates) > 1:
+                self.log.info("Racing connections to %s", candidates)
+                (node, sock) = await staggered_connect(
+                    candidates,
+                    self.happy_eyeballs_delay,
+                    self.loop,
+                    timeout=self.connect_timeout,
+                    prefer_first=True,
+                )
+                self.target_node = node
+                endpoint = {"sock": sock}
+            else:
+                endpoint = {"host": node.address, "port": node.port}
+            self.log.info("Connecting to %s:%s", node.address, node.port)
             protocol = PhotonPumpProtocol(
-                node, self.connection_counter, self.dispatcher, self, self.loop
+                node,
+                self.connection_counter,
+                self.dispatcher,
+                self,
+                self.loop,
+                transport_config=self.transport_config,
+                metrics=self.metrics,
+                tracer=self.tracer,
+                capture=self.capture,
             )
             await asyncio.wait_for(
-                self.loop.create_connection(lambda: protocol, node.address, node.port),
+                self.loop.create_connection(lambda: protocol, **endpoint),
                 self.connect_timeout,
             )
+            self.health.record_connect(node, self.loop.time() - started)
         except Exception as e:
             await self.ctrl_queue.put(
                 ConnectorInstruction(ConnectorCommand.HandleConnectFailure, None, e)
@@ -175,6 +443,19 @@ class Connector:
         self.connected(address)
 
     async def _reconnect(self, node):
+        self.metrics.inc("reconnects_total")
+
+        if self.standby:
+            await self._promote_standby()
+
+            return
+
+        if self.redirect_target:
+            node, self.redirect_target = self.redirect_target, None
+            await self.start(target=node)
+
+            return
+
         if not node:
             await self.start()
 
@@ -205,11 +486,19 @@ class Connector:
             exn,
         )
         self.retry_policy.record_failure(self.target_node)
+        self.metrics.inc("connect_failures_total")
+
+        if self.target_node:
+            self.health.record_failure(self.target_node)
         await self._reconnect(self.target_node)
 
     async def _on_failed_heartbeat(self, exn):
         self.log.warn("Failed to handle a heartbeat")
         self.heartbeat_failures += 1
+        self.metrics.inc("heartbeat_failures_total")
+
+        if self.target_node:
+            self.health.record_failure(self.target_node)
 
         if self.heartbeat_failures >= 3:
             await self.active_protocol.stop()
@@ -219,6 +508,75 @@ class Connector:
         self.log.debug("Received heartbeat from conversation %s", conversation_id)
         self.heartbeat_failures = 0
 
+    async def _on_redirect(self, node):
+        if node in (self.target_node, self.redirect_target):
+            return
+
+        if self.standby and self.standby.node == node:
+            await self._promote_standby()
+
+            return
+
+        self.log.info("Master has moved to %s, reconnecting", node)
+        self.redirect_target = node
+
+        if self.active_protocol:
+            await self.active_protocol.stop()
+        else:
+            await self._reconnect(node)
+
+    async def _on_master_changed(self, node):
+        if node == self.target_node or (self.standby and self.standby.node == node):
+            return
+
+        self.log.info("Master has moved to %s, opening a standby connection", node)
+
+        if self.standby:
+            await self.standby.stop()
+            self.standby = None
+
+        self.connection_counter += 1
+        protocol = PhotonPumpProtocol(
+            node,
+            self.connection_counter,
+            self.dispatcher,
+            self,
+            self.loop,
+            standby=True,
+            transport_config=self.transport_config,
+            metrics=self.metrics,
+            tracer=self.tracer,
+            capture=self.capture,
+        )
+        try:
+            await asyncio.wait_for(
+                self.loop.create_connection(lambda: protocol, node.address, node.port),
+                self.connect_timeout,
+            )
+        except Exception:
+            self.log.warning("Failed to open standby connection to %s", node)
+
+            return
+
+        self.standby = protocol
+        await self._promote_standby()
+
+    async def _promote_standby(self):
+        protocol, self.standby = self.standby, None
+        previous = self.active_protocol
+        self.log.info("Swapping to connection %s", protocol)
+
+        self.target_node = protocol.node
+        self.redirect_target = None
+        self.active_protocol = protocol
+        protocol.activate()
+
+        if previous:
+            await previous.stop()
+
+        await self.dispatcher.write_to(protocol.output_queue)
+        self.connected(protocol.node)
+
     async def _on_connector_failed(self, exn):
         self.log.error("Connector failed to find a connection")
         await self.stop(exn=exn)
@@ -250,6 +608,12 @@ class Connector:
             if msg.command == ConnectorCommand.HandleHeartbeatSuccess:
                 await self._on_successful_heartbeat(msg.data)
 
+            if msg.command == ConnectorCommand.HandleRedirect:
+                await self._on_redirect(msg.data)
+
+            if msg.command == ConnectorCommand.HandleMasterChanged:
+                await self._on_master_changed(msg.data)
+
             if msg.command == ConnectorCommand.HandleConnectorFailed:
                 await self._on_connector_failed(msg.data)
 
@@ -260,6 +624,19 @@ class Connector:
 class PaceMaker:
     """
     Handles heartbeat requests and responses to keep the connection alive.
+
+    Any frame from the server shows that the connection is alive, so we only
+    send our own heartbeat once the connection has been quiet for
+    `heartbeat_period` seconds, and a heartbeat that times out while other
+    frames are arriving isn't counted as a failure.
+
+    Heartbeat round trips are recorded in `rtt_histogram`, and the time we
+    wait for a response adapts to them as TCP's retransmission timeout does:
+    the smoothed round trip plus four times its variation, clamped to
+    between `min_response_timeout` and `response_timeout`. The floor is
+    deliberately generous, since a server that pauses to flush or collect
+    garbage isn't dead, and a response that arrives after we gave up on it
+    is ignored.
     """
 
     def __init__(
@@ -269,13 +646,46 @@ class PaceMaker:
         response_timeout=10,
         heartbeat_period=30,
         heartbeat_id=None,
+        min_response_timeout=5,
+        metrics: Metrics = NULL_METRICS,
     ) -> None:
         self._output = output_queue
         self.heartbeat_id = heartbeat_id or uuid.uuid4()
         self._connector = connector
         self.response_timeout = response_timeout
+        self.min_response_timeout = min_response_timeout
         self.heartbeat_period = heartbeat_period
+        self.rtt_histogram = Histogram()
+        self.metrics = metrics
+        self.srtt = None
+        self.rttvar = None
+        self.last_received = time.monotonic()
         self._fut = None
+        self._sent_at = None
+
+    def record_activity(self):
+        self.last_received = time.monotonic()
+
+    def record_rtt(self, rtt: float):
+        self.rtt_histogram.observe(rtt)
+        self.metrics.observe("heartbeat_rtt_seconds", rtt)
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+    @property
+    def timeout(self) -> float:
+        if self.srtt is None:
+            return self.response_timeout
+
+        return min(
+            self.response_timeout,
+            max(self.min_response_timeout, self.srtt + 4 * self.rttvar),
+        )
 
     async def handle_request(self, message: msg.InboundMessage):
         response = convo.Heartbeat(message.conversation_id)
@@ -285,7 +695,7 @@ class PaceMaker:
 
     async def handle_response(self, message: msg.InboundMessage):
         if message.conversation_id == self.heartbeat_id:
-            if self._fut:
+            if self._fut is not None and not self._fut.done():
                 self._fut.set_result(message.conversation_id)
 
     async def send_heartbeat(self) -> asyncio.Future:
@@ -294,15 +704,25 @@ class PaceMaker:
         hb = convo.Heartbeat(self.heartbeat_id, direction=convo.Heartbeat.OUTBOUND)
         await hb.start(self._output)
         self._fut = fut
+        self._sent_at = time.monotonic()
 
         return fut
 
     async def await_heartbeat_response(self):
         try:
-            await asyncio.wait_for(self._fut, self.response_timeout)
-            logging.debug("Received heartbeat response from server")
-            self._connector.heartbeat_received(self.heartbeat_id)
+            await asyncio.wait_for(self._fut, self.timeout)
+            rtt = time.monotonic() - self._sent_at
+            logging.debug("Received heartbeat response from server in %.3fs", rtt)
+            self.record_rtt(rtt)
+            self._connector.heartbeat_received(self.heartbeat_id, rtt)
         except asyncio.TimeoutError as e:
+            if self.last_received > self._sent_at:
+                logging.debug(
+                    "Heartbeat %s is late, but the server is talking", self.heartbeat_id
+                )
+                self._connector.heartbeat_received(self.heartbeat_id)
+
+                return
             logging.warning("Heartbeat %s timed out", self.heartbeat_id)
             self._connector.heartbeat_failed(e)
         except asyncio.CancelledError:
@@ -315,14 +735,116 @@ class PaceMaker:
     async def send_heartbeats(self):
         while True:
             try:
-                await self.send_heartbeat()
-                await self.await_heartbeat_response()
-                await asyncio.sleep(self.heartbeat_period)
+                idle = time.monotonic() - self.last_received
+
+                if idle >= self.heartbeat_period:
+                    await self.send_heartbeat()
+                    await self.await_heartbeat_response()
+                    idle = 0
+                await asyncio.sleep(self.heartbeat_period - idle)
             except asyncio.CancelledError:
                 logging.debug("Heartbeat loop cancelled")
                 break
 
 
+CONTROL_COMMANDS = (msg.TcpCommand.HeartbeatRequest, msg.TcpCommand.HeartbeatResponse)
+ACK_COMMANDS = (
+    msg.TcpCommand.PersistentSubscriptionAckEvents,
+    msg.TcpCommand.PersistentSubscriptionNakEvents,
+)
+
+
+class OutboundQueue(asyncio.Queue):
+    """The queue of messages waiting to be written to a connection.
+
+    Each message is given a lane by its Priority. Heartbeats and acks
+    always jump ahead, so that a backlog of large writes can neither make
+    the server think we've gone away nor hold up a persistent subscription.
+    Other messages take the lane of their conversation, as registered in
+    `priorities` by the MessageDispatcher, and the interactive and bulk
+    lanes share the connection by deficit round robin: on each turn a lane
+    may send another `quantum` times its weight in bytes.
+
+    Args:
+        maxsize (optional): The most messages to hold, or 0 for no limit.
+        quantum (optional): The number of bytes added to a lane's allowance
+            on each turn, before weighting.
+        weights (optional): The relative share of each of the Interactive
+            and Bulk lanes.
+        metrics (optional): Where to report the depth of the queue.
+    """
+
+    def __init__(
+        self,
+        maxsize=0,
+        quantum=16 * 1024,
+        weights=((msg.Priority.Interactive, 4), (msg.Priority.Bulk, 1)),
+        metrics: Metrics = NULL_METRICS,
+        **kwargs,
+    ):
+        self.metrics = metrics
+        self.quantum = quantum
+        self.weights = dict(weights)
+        self.priorities = {}
+        super().__init__(maxsize, **kwargs)
+
+    def _init(self, maxsize):
+        self._lanes = {priority: collections.deque() for priority in msg.Priority}
+        self._deficits = {priority: 0 for priority in self.weights}
+        self._turn = msg.Priority.Interactive
+
+    def priority(self, message) -> msg.Priority:
+        if message.command in CONTROL_COMMANDS:
+            return msg.Priority.Control
+
+        if message.command in ACK_COMMANDS:
+            return msg.Priority.Ack
+
+        return self.priorities.get(message.conversation_id, msg.Priority.Interactive)
+
+    def _put(self, message):
+        self._lanes[self.priority(message)].append(message)
+
+        if self.metrics.enabled:
+            self.metrics.add("output_queue_depth", 1)
+
+    def _get(self):
+        if self.metrics.enabled:
+            self.metrics.add("output_queue_depth", -1)
+
+        for priority in (msg.Priority.Control, msg.Priority.Ack):
+            if self._lanes[priority]:
+                return self._lanes[priority].popleft()
+
+        while True:
+            lane = self._lanes[self._turn]
+
+            if lane and lane[0].length <= self._deficits[self._turn]:
+                message = lane.popleft()
+                self._deficits[self._turn] -= message.length
+
+                return message
+
+            if not lane:
+                # An idle lane can't save up its share for later.
+                self._deficits[self._turn] = 0
+
+            self._turn = (
+                msg.Priority.Bulk
+                if self._turn == msg.Priority.Interactive
+                else msg.Priority.Interactive
+            )
+
+            if self._lanes[self._turn]:
+                self._deficits[self._turn] += self.quantum * self.weights[self._turn]
+
+    def qsize(self):
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def empty(self):
+        return not any(self._lanes.values())
+
+
 class MessageWriter:
     def __init__(
         self,
@@ -330,10 +852,19 @@ class MessageWriter:
         connection_number: int,
         output_queue: asyncio.Queue,
         loop=None,
+        metrics: Metrics = NULL_METRICS,
+        tracer: Tracer = NULL_TRACER,
+        capture: Capture = NULL_CAPTURE,
+        capture_id: int = 0,
     ):
         self._logger = logging.get_named_logger(MessageWriter, connection_number)
+        self._levels = LogLevels(self._logger)
         self.writer = writer
         self._queue = output_queue
+        self.metrics = metrics
+        self.tracer = tracer
+        self.capture = capture
+        self.capture_id = capture_id
 
     async def enqueue_message(self, message: msg.OutboundMessage):
         await self._queue.put(message)
@@ -342,16 +873,37 @@ class MessageWriter:
 
         while True:
             msg = await self._queue.get()
+
+            if self.tracer.enabled:
+                self.tracer.mark(msg.conversation_id, Stage.Dequeued)
             try:
-                self._logger.debug("Sending message %s", msg)
-                self._logger.trace("Message body is %r", msg)
-                self.writer.write(msg.header_bytes)
+                if self._levels.debug:
+                    self._logger.debug("Sending message %s", msg)
+
+                if self._levels.trace:
+                    self._logger.trace("Message body is %r", msg)
+                header = msg.header_bytes
+                self.writer.write(header)
                 self.writer.write(msg.payload)
+
+                if self.capture.enabled:
+                    self.capture.record(
+                        self.capture_id, Direction.Outbound, header + msg.payload
+                    )
+
+                if self.metrics.enabled:
+                    self.metrics.inc("frames_sent_total")
+                    self.metrics.inc("bytes_sent_total", SIZE_UINT_32 + msg.length)
             except Exception as e:
                 self._logger.error("Failed to send message %s", e, exc_info=True)
             try:
                 await self.writer.drain()
-                self._logger.debug("Finished drain for %s", msg)
+
+                if self._levels.debug:
+                    self._logger.debug("Finished drain for %s", msg)
+
+                if self.tracer.enabled:
+                    self.tracer.mark(msg.conversation_id, Stage.Written)
             except Exception as e:
                 self._logger.error(e)
 
@@ -368,8 +920,12 @@ class MessageReader:
         queue,
         pacemaker: PaceMaker,
         loop=None,
+        chunk_size=8192,
+        metrics: Metrics = NULL_METRICS,
+        tracer: Tracer = NULL_TRACER,
     ):
         self._loop = loop or asyncio.get_event_loop()
+        self.chunk_size = chunk_size
         self.header_bytes = array.array("B", [0] * (self.MESSAGE_MIN_SIZE))
         self.header_bytes_required = self.MESSAGE_MIN_SIZE
         self.queue = queue
@@ -380,7 +936,10 @@ class MessageReader:
         self._logger = logging.get_named_logger(MessageReader, connection_number)
         self.reader = reader
         self.pacemaker = pacemaker
-        self._trace_enabled = self._logger.getEffectiveLevel() <= logging.TRACE
+        self.metrics = metrics
+        self.tracer = tracer
+        self.frame_started_at = None
+        self._levels = LogLevels(self._logger)
 
     def feed_data(self, data):
         self.reader.feed_data(data)
@@ -391,13 +950,17 @@ class MessageReader:
 
         while True:
             try:
-                data = await self.reader.read(8192)
+                data = await self.reader.read(self.chunk_size)
+                self.pacemaker.record_activity()
+
+                if self.metrics.enabled:
+                    self.metrics.inc("bytes_received_total", len(data))
 
-                if self._trace_enabled:
+                if self._levels.trace:
                     self._logger.trace(
                         "Received %d bytes from remote server:\n%s",
                         len(data),
-                        msg.dump(data),
+                        Dump(data),
                     )
                 await self.process(data)
             except asyncio.CancelledError:
@@ -409,20 +972,25 @@ class MessageReader:
     async def process(self, chunk: bytes):
         if chunk is None:
             return
+
+        if self.tracer.enabled:
+            received_at = time.perf_counter()
         chunk_offset = 0
         chunk_len = len(chunk)
 
         while chunk_offset < chunk_len:
             while self.header_bytes_required and chunk_offset < chunk_len:
+                if (
+                    self.header_bytes_required == self.MESSAGE_MIN_SIZE
+                    and self.tracer.enabled
+                ):
+                    self.frame_started_at = received_at
                 offset = self.MESSAGE_MIN_SIZE - self.header_bytes_required
                 self.header_bytes[offset] = chunk[chunk_offset]
                 chunk_offset += 1
                 self.header_bytes_required -= 1
 
                 if not self.header_bytes_required:
-                    self._logger.insane(
-                        "Read %d bytes for header", self.MESSAGE_MIN_SIZE
-                    )
                     (self.length, self.cmd, self.flags) = self.HEAD_PACK.unpack(
                         self.header_bytes[0:6]
                     )
@@ -430,21 +998,21 @@ class MessageReader:
                     self.conversation_id = uuid.UUID(
                         bytes_le=(self.header_bytes[6:22].tobytes())
                     )
-                    self._logger.insane(
-                        "length=%d, command=%d flags=%d conversation_id=%s from header bytes=%a",
-                        self.length,
-                        self.cmd,
-                        self.flags,
-                        self.conversation_id,
-                        self.header_bytes,
-                    )
+
+                    if self._levels.insane:
+                        self._logger.insane(
+                            "length=%d, command=%d flags=%d conversation_id=%s"
+                            " from header bytes=%a",
+                            self.length,
+                            self.cmd,
+                            self.flags,
+                            self.conversation_id,
+                            self.header_bytes,
+                        )
 
                 self.message_offset = HEADER_LENGTH
 
             message_bytes_required = self.length - self.message_offset
-            self._logger.insane(
-                "%d of message remaining before copy", message_bytes_required
-            )
 
             if message_bytes_required > 0:
                 if not self.message_buffer:
@@ -453,20 +1021,30 @@ class MessageReader:
                 end_span = min(chunk_len, message_bytes_required + chunk_offset)
                 bytes_read = end_span - chunk_offset
                 self.message_buffer.extend(chunk[chunk_offset:end_span])
-                self._logger.insane("Message buffer is %s", self.message_buffer)
                 message_bytes_required -= bytes_read
                 self.message_offset += bytes_read
                 chunk_offset = end_span
 
-            self._logger.insane(
-                "%d bytes of message remaining after copy", message_bytes_required
-            )
+            if self._levels.insane:
+                self._logger.insane(
+                    "%d bytes of message remaining after copy", message_bytes_required
+                )
 
             if not message_bytes_required:
                 message = msg.InboundMessage(
                     self.conversation_id, self.cmd, self.message_buffer or b""
                 )
-                self._logger.trace("Received message %r", message)
+                if self._levels.trace:
+                    self._logger.trace("Received message %r", message)
+
+                if self.metrics.enabled:
+                    self.metrics.inc("frames_received_total")
+
+                if self.tracer.enabled:
+                    self.tracer.mark(
+                        self.conversation_id, Stage.FirstByte, self.frame_started_at
+                    )
+                    self.tracer.mark(self.conversation_id, Stage.Parsed)
 
                 if message.command == msg.TcpCommand.HeartbeatRequest:
                     await self.pacemaker.handle_request(message)
@@ -475,6 +1053,9 @@ class MessageReader:
                 else:
                     await self.queue.put(message)
 
+                    if self.metrics.enabled:
+                        self.metrics.add("input_queue_depth", 1)
+
                 self.length = -1
                 self.message_offset = 0
                 self.conversation_id = None
@@ -483,28 +1064,77 @@ class MessageReader:
                 self.message_buffer = None
 
 
+def _conversation_labels(conversation):
+    return (("conversation", type(conversation).__name__),)
+
+
 class MessageDispatcher:
-    def __init__(self, loop=None):
+    def __init__(
+        self,
+        loop=None,
+        max_redirects=3,
+        retry_policy=None,
+        limiter=None,
+        metrics: Optional[Metrics] = None,
+        tracer: Optional[Tracer] = None,
+    ):
         self.active_conversations = {}
         self._logger = logging.get_named_logger(MessageDispatcher)
+        self._levels = LogLevels(self._logger)
         self.output = None
         self._loop = loop or asyncio.get_event_loop()
+        self.redirect = None
+        self.max_redirects = max_redirects
+        self.redirects = {}
+        self.retry_policy = retry_policy
+        self.retries = {}
+        self.limiter = limiter
+        self.observe_latency = None
+        self.sent_at = {}
+        self.metrics = metrics or NULL_METRICS
+        self.tracer = tracer or NULL_TRACER
 
     async def start_conversation(
         self, conversation: convo.Conversation
     ) -> asyncio.futures.Future:
 
         if not conversation.one_way:
+            if self.tracer.enabled:
+                self.tracer.start(conversation)
+
+            if self.limiter:
+                await self.limiter.acquire()
+                conversation.result.add_done_callback(lambda _: self.limiter.release())
+
             self.active_conversations[conversation.conversation_id] = (
                 conversation,
                 None,
             )
+            self.metrics.add(
+                "active_conversations", 1, _conversation_labels(conversation)
+            )
+
+        if self.retry_policy:
+            self.retry_policy.record_request()
 
         if self.output:
-            await conversation.start(self.output)
+            await self._start(conversation)
 
         return conversation.result
 
+    async def _start(self, conversation):
+        if not conversation.one_way:
+            self.sent_at[conversation.conversation_id] = self._loop.time()
+
+            if isinstance(self.output, OutboundQueue):
+                self.output.priorities[
+                    conversation.conversation_id
+                ] = conversation.priority
+        await conversation.start(self.output)
+
+        if self.tracer.enabled:
+            self.tracer.mark(conversation.conversation_id, Stage.Encoded)
+
     async def write_to(self, output: asyncio.Queue):
         self._logger.info(
             "Dispatcher has new message writer. Re-sending %s conversations",
@@ -513,10 +1143,11 @@ class MessageDispatcher:
         self.output = output
 
         for (conversation, _) in self.active_conversations.values():
-            await conversation.start(self.output)
+            await self._start(conversation)
 
     async def dispatch(self, message: msg.InboundMessage, output: asyncio.Queue):
-        self._logger.debug("Received message %s", message)
+        if self._levels.debug:
+            self._logger.debug("Received message %s", message)
 
         conversation, result = self.active_conversations.get(
             message.conversation_id, (None, None)
@@ -527,17 +1158,125 @@ class MessageDispatcher:
 
             return
 
+        if self.tracer.enabled:
+            self.tracer.mark(message.conversation_id, Stage.Dispatched)
+
+        sent_at = self.sent_at.pop(message.conversation_id, None)
+
+        if sent_at is not None:
+            latency = self._loop.time() - sent_at
+
+            if self.observe_latency:
+                self.observe_latency(latency)
+
+            if self.metrics.enabled:
+                # Label by what we asked for, not by how the server replied.
+                self.metrics.observe(
+                    "request_duration_seconds",
+                    latency,
+                    _conversation_labels(conversation),
+                )
+
+        if message.command == msg.TcpCommand.NotHandled:
+            body = proto.NotHandled()
+
+            try:
+                body.ParseFromString(message.payload)
+            except DecodeError:
+                # Let the conversation report the unreadable payload.
+                body = None
+
+            if body and (
+                self._redirect(conversation, body) or self._retry(conversation, body)
+            ):
+                return
+
+        elif self.limiter:
+            self.limiter.record_success()
+
         await conversation.respond_to(message, output)
 
         if conversation.is_complete:
-            del self.active_conversations[conversation.conversation_id]
+            self.remove(conversation.conversation_id)
+
+    def _redirect(self, conversation, body: proto.NotHandled) -> bool:
+        """Keep a conversation that was sent to a node that isn't the master,
+        so that it's re-sent when we reconnect to the master.
+
+        If no reconnect is coming, because we're already talking to the node
+        that was named as master, the conversation fails with NotMaster."""
+
+        if not self.redirect:
+            return False
+
+        master = convo.master_info(body)
+        attempts = self.redirects.get(conversation.conversation_id, 0)
+
+        if not master or attempts >= self.max_redirects:
+            return False
+
+        if not self.redirect(master):
+            return False
+
+        self._logger.info("Redirecting %s to master at %s", conversation, master)
+        self.redirects[conversation.conversation_id] = attempts + 1
+
+        return True
+
+    def _retry(self, conversation, body: proto.NotHandled) -> bool:
+        """Re-send an idempotent conversation after a backoff if the server
+        was too busy, or not ready, to handle it."""
+
+        if body.reason not in (
+            msg.NotHandledReason.TooBusy,
+            msg.NotHandledReason.NotReady,
+        ):
+            return False
+
+        if self.limiter:
+            self.limiter.record_overload()
+
+        if not (self.retry_policy and conversation.idempotent):
+            return False
+
+        attempt = self.retries.get(conversation.conversation_id, 0)
+        delay = self.retry_policy.next_delay(attempt)
+
+        if delay is None:
+            return False
+
+        self._logger.debug(
+            "Server replied %s, retrying %s in %.3fs",
+            msg.NotHandledReason(body.reason).name,
+            conversation,
+            delay,
+        )
+        self.retries[conversation.conversation_id] = attempt + 1
+        self._loop.call_later(delay, self._resend, conversation)
+
+        return True
+
+    def _resend(self, conversation) -> None:
+        # If we've lost the connection in the meantime, write_to will send
+        # the conversation when we reconnect.
+        if self.has_conversation(conversation.conversation_id) and self.output:
+            asyncio.ensure_future(self._start(conversation))
 
     def has_conversation(self, id):
         return id in self.active_conversations
 
     def remove(self, id):
         if id in self.active_conversations:
-            del self.active_conversations[id]
+            (conversation, _) = self.active_conversations.pop(id)
+            self.metrics.add(
+                "active_conversations", -1, _conversation_labels(conversation)
+            )
+        self.redirects.pop(id, None)
+        self.retries.pop(id, None)
+        self.sent_at.pop(id, None)
+
+        if isinstance(self.output, OutboundQueue):
+            self.output.priorities.pop(id, None)
 
 
 class Client:
@@ -549,9 +1288,10 @@ class Client:
     photonpump.conversations.
     """
 
-    def __init__(self, connector, dispatcher, credential=None):
+    def __init__(self, connector, dispatcher, credential=None, write_coalescer=None):
         self.connector = connector
         self.dispatcher = dispatcher
+        self.write_coalescer = write_coalescer
 
         self.credential = credential
         self.outstanding_heartbeat = None
@@ -579,6 +1319,10 @@ class Client:
         require_master=False,
     ):
         event = msg.NewEvent(type, id or uuid.uuid4(), body, metadata)
+
+        if self.write_coalescer and expected_version == msg.ExpectedVersion.Any:
+            return await self._coalesce(stream, [event], require_master)
+
         conversation = convo.WriteEvents(
             stream,
             [event],
@@ -596,6 +1340,9 @@ class Client:
         expected_version=msg.ExpectedVersion.Any,
         require_master=False,
     ):
+        if self.write_coalescer and expected_version == msg.ExpectedVersion.Any:
+            return await self._coalesce(stream, events, require_master)
+
         cmd = convo.WriteEvents(
             stream,
             events,
@@ -606,15 +1353,137 @@ class Client:
 
         return await result
 
+    async def _coalesce(self, stream, events, require_master):
+        result = await self.write_coalescer.write(
+            stream, events, require_master=require_master
+        )
+
+        return await result
+
+    async def publish_stream(
+        self,
+        stream: str,
+        events,
+        expected_version=msg.ExpectedVersion.Any,
+        require_master=False,
+        chunk_events: int = 500,
+        chunk_bytes: int = 1024 * 1024,
+        max_in_flight: int = 4,
+        on_progress=None,
+    ):
+        """Publish events from an iterable or async iterable without
+        materializing them first.
+
+        Events are cut into WriteEvents frames of at most `chunk_events`
+        events or `chunk_bytes` bytes, with up to `max_in_flight` frames
+        awaiting acknowledgement. Each frame's expected version is chained
+        from the frames before it. Unlike
+        :meth:`~photonpump.Client.publish_transaction`, frames become
+        visible to readers as soon as they are written.
+
+        Args:
+            on_progress (optional): A callable that receives a
+                :class:`~photonpump.writers.PublishProgress` as each frame
+                is acknowledged.
+
+        Returns:
+            The final :class:`~photonpump.writers.PublishProgress`.
+        """
+
+        return await writers.publish_stream(
+            self.dispatcher,
+            stream,
+            events,
+            expected_version=expected_version,
+            require_master=require_master,
+            chunk_events=chunk_events,
+            chunk_bytes=chunk_bytes,
+            max_in_flight=max_in_flight,
+            credential=self.credential,
+            on_progress=on_progress,
+        )
+
+    def ordered_writer(
+        self,
+        stream: str,
+        expected_version=msg.ExpectedVersion.Any,
+        max_in_flight: int = 4,
+        require_master=False,
+    ) -> writers.OrderedStreamWriter:
+        """Create a writer that pipelines writes to a single stream.
+
+        Each write is sent with the expected version left by the writes
+        before it, without waiting for them to be acknowledged, so a hot
+        stream isn't limited to one write per round trip. If a write with a
+        specific expected version fails, the writes queued behind it fail
+        with :class:`~photonpump.exceptions.WriteAborted`. With the default
+        of `ExpectedVersion.Any` writes aren't chained, and each gets its
+        own result.
+
+        Args:
+            stream: The name of the stream to write to.
+            expected_version (optional): The expected version of the stream
+                for the first write.
+            max_in_flight (optional): The maximum number of unacknowledged
+                writes.
+            require_master (optional): True if writes must be sent direct to
+                the master node, otherwise False.
+        """
+
+        return writers.OrderedStreamWriter(
+            self.dispatcher,
+            stream,
+            expected_version=expected_version,
+            max_in_flight=max_in_flight,
+            require_master=require_master,
+            credential=self.credential,
+        )
+
+    async def publish_transaction(
+        self,
+        stream: str,
+        events,
+        expected_version=msg.ExpectedVersion.Any,
+        require_master=False,
+        chunk_events: int = 500,
+        chunk_bytes: int = 1024 * 1024,
+        window: int = 4,
+    ):
+        """Write a very large batch of events to a stream atomically.
+
+        Events are read lazily from `events`, which may be an iterable or
+        an async iterable, and are sent in chunks of at most `chunk_events`
+        events or `chunk_bytes` bytes, with up to `window` chunks awaiting
+        acknowledgement at a time. Nothing is visible to readers until the
+        transaction is committed.
+
+        Returns:
+            The TransactionCommitCompleted message from the server.
+        """
+        cmd = convo.WriteTransaction(
+            stream,
+            events,
+            expected_version=expected_version,
+            require_master=require_master,
+            chunk_events=chunk_events,
+            chunk_bytes=chunk_bytes,
+            window=window,
+            credential=self.credential,
+        )
+        result = await self.dispatcher.start_conversation(cmd)
+
+        return await result
+
     async def get_event(
         self,
         stream: str,
+        event_number: int,
         resolve_links=True,
         require_master=False,
         correlation_id: uuid.UUID = None,
     ):
         correlation_id = correlation_id
-        cmd = convo.ReadEvent(stream, resolve_links, require_master)
+        cmd = convo.ReadEvent(stream, event_number, resolve_links, require_master)
 
         result = await self.dispatcher.start_conversation(cmd)
 
@@ -653,15 +1522,178 @@ class Client:
         require_master: bool = False,
         correlation_id: uuid.UUID = None,
     ):
-        correlation_id = correlation_id
         cmd = convo.IterStreamEvents(
-            stream, from_event, batch_size, resolve_links, direction=direction
+            stream,
+            from_event,
+            batch_size,
+            resolve_links,
+            require_master,
+            direction=direction,
+            conversation_id=correlation_id,
+        )
+        result = await self.dispatcher.start_conversation(cmd)
+        iterator = await result
+        async for event in iterator:
+            yield event
+
+    async def get_all(
+        self,
+        direction: msg.StreamDirection = msg.StreamDirection.Forward,
+        from_position: Optional[msg.Position] = None,
+        max_count: int = 100,
+        resolve_links: bool = True,
+        require_master: bool = False,
+        correlation_id: uuid.UUID = None,
+    ):
+        """Read a page of events from the $all stream.
+
+        Args:
+            direction (optional): Controls whether to read forward or
+                backward through $all. Defaults to StreamDirection.Forward.
+            from_position (optional): The position to read from. Defaults
+                to the start of $all when reading forward, and the end when
+                reading backward.
+            max_count (optional): The maximum number of events to read.
+            resolve_links (optional): True if eventstore should
+                automatically resolve Link Events, otherwise False.
+            require_master (optional): True if this command must be
+                sent direct to the master node, otherwise False.
+            correlation_id (optional): A unique identifer for this
+                command.
+
+        Returns:
+            An :class:`~photonpump.messages.AllStreamSlice`. Its
+            `next_position` can be stored and passed as `from_position`
+            to read the following page.
+        """
+        cmd = convo.ReadAllEvents(
+            from_position,
+            max_count,
+            resolve_links,
+            require_master,
+            direction=direction,
+            credentials=self.credential,
+            conversation_id=correlation_id,
+        )
+        result = await self.dispatcher.start_conversation(cmd)
+
+        return await result
+
+    async def iter_all(
+        self,
+        direction: msg.StreamDirection = msg.StreamDirection.Forward,
+        from_position: Optional[msg.Position] = None,
+        batch_size: int = 100,
+        resolve_links: bool = True,
+        require_master: bool = False,
+        correlation_id: uuid.UUID = None,
+    ):
+        """Iterate every event in the $all stream.
+
+        Each event carries its :class:`~photonpump.messages.Position`,
+        which can be persisted and passed back as `from_position` to
+        resume a forward scan with the event after it.
+
+        Args:
+            direction (optional): Controls whether to read forward or
+                backward through $all. Defaults to StreamDirection.Forward.
+            from_position (optional): The position to read from. Defaults
+                to the start of $all when reading forward, and the end when
+                reading backward.
+            batch_size (optional): The number of events to read per page.
+            resolve_links (optional): True if eventstore should
+                automatically resolve Link Events, otherwise False.
+            require_master (optional): True if this command must be
+                sent direct to the master node, otherwise False.
+            correlation_id (optional): A unique identifer for this
+                command.
+        """
+        cmd = convo.IterAllEvents(
+            from_position,
+            batch_size,
+            resolve_links,
+            require_master,
+            direction=direction,
+            credentials=self.credential,
+            conversation_id=correlation_id,
         )
         result = await self.dispatcher.start_conversation(cmd)
         iterator = await result
         async for event in iterator:
             yield event
 
+    async def subscribe_to(
+        self, stream: str, resolve_links: bool = True, conversation_id: uuid.UUID = None
+    ):
+        """Receive new events from a stream as they are written.
+
+        Args:
+            stream: The name of the stream to subscribe to.
+            resolve_links (optional): True if eventstore should
+                automatically resolve Link Events, otherwise False.
+            conversation_id (optional): A unique identifer for this
+                command.
+
+        Returns:
+            A :class:`~photonpump.conversations.VolatileSubscription`.
+        """
+        cmd = convo.SubscribeToStream(
+            stream,
+            resolve_links,
+            credentials=self.credential,
+            conversation_id=conversation_id,
+        )
+        future = await self.dispatcher.start_conversation(cmd)
+
+        return await future
+
+    async def catch_up(
+        self,
+        stream: str,
+        start_from: Optional[int] = None,
+        batch_size: int = 100,
+        resolve_links: bool = True,
+        require_master: bool = False,
+        conversation_id: uuid.UUID = None,
+    ):
+        """Read every event in a stream after a checkpoint and then keep
+        receiving new events as they are written.
+
+        Examples:
+
+            >>> subscription = await client.catch_up("ponies", start_from=99)
+            >>> async for event in subscription.events:
+            >>>     await handle(event)
+            >>>     await save_checkpoint(subscription.checkpoint)
+
+        Args:
+            stream: The name of the stream to subscribe to.
+            start_from (optional): The number of the last event that has
+                already been processed. If None, the whole stream is read.
+            batch_size (optional): The number of events to read per page.
+            resolve_links (optional): True if eventstore should
+                automatically resolve Link Events, otherwise False.
+            require_master (optional): True if historical reads must be
+                sent direct to the master node, otherwise False.
+            conversation_id (optional): A unique identifer for this
+                command.
+
+        Returns:
+            A :class:`~photonpump.conversations.VolatileSubscription`.
+        """
+        cmd = convo.CatchupSubscription(
+            stream,
+            start_from=start_from,
+            batch_size=batch_size,
+            resolve_links=resolve_links,
+            require_master=require_master,
+            credentials=self.credential,
+            conversation_id=conversation_id,
+        )
+        future = await self.dispatcher.start_conversation(cmd)
+
+        return await future
+
     async def create_subscription(
         self,
         name: str,
@@ -751,6 +1783,11 @@ class PhotonPumpProtocol(asyncio.streams.FlowControlMixin):
         dispatcher: MessageDispatcher,
         connector,
         loop=None,
+        standby=False,
+        transport_config: TransportConfig = DEFAULT,
+        metrics: Metrics = NULL_METRICS,
+        tracer: Tracer = NULL_TRACER,
+        capture: Capture = NULL_CAPTURE,
     ):
         self._log = logging.get_named_logger(PhotonPumpProtocol, connection_number)
         self.transport = None
@@ -760,38 +1797,84 @@ class PhotonPumpProtocol(asyncio.streams.FlowControlMixin):
         self.node = addr
         self.dispatcher = dispatcher
         self.connector = connector
+        self.standby = standby
+        self.transport_config = transport_config
+        self.metrics = metrics
+        self.tracer = tracer
+        self.capture = capture
+        self.capture_id = 0
+        self.heartbeat_loop = None
 
     def connection_made(self, transport):
         self._log.debug("Connection made.")
         self.input_queue = asyncio.Queue(loop=self.loop)
-        self.output_queue = asyncio.Queue(loop=self.loop)
+        self.output_queue = OutboundQueue(metrics=self.metrics, loop=self.loop)
         self.transport = transport
+        apply_transport_config(self.transport_config, transport)
+
+        if self.capture.enabled:
+            self.capture_id = self.capture.connection_opened()
 
         stream_reader = asyncio.StreamReader(loop=self.loop)
         stream_reader.set_transport(transport)
         stream_writer = asyncio.StreamWriter(transport, self, stream_reader, self.loop)
-        self.pacemaker = PaceMaker(self.output_queue, self.connector)
+        self.pacemaker = PaceMaker(
+            self.output_queue,
+            self.connector,
+            response_timeout=self.transport_config.heartbeat_timeout,
+            heartbeat_period=self.transport_config.heartbeat_period,
+            metrics=self.metrics,
+        )
 
         self.reader = MessageReader(
-            stream_reader, self.connection_number, self.input_queue, self.pacemaker
+            stream_reader,
+            self.connection_number,
+            self.input_queue,
+            self.pacemaker,
+            chunk_size=self.transport_config.read_chunk_size,
+            metrics=self.metrics,
+            tracer=self.tracer,
         )
         self.writer = MessageWriter(
-            stream_writer, self.connection_number, self.output_queue
+            stream_writer,
+            self.connection_number,
+            self.output_queue,
+            metrics=self.metrics,
+            tracer=self.tracer,
+            capture=self.capture,
+            capture_id=self.capture_id,
         )
 
         self.write_loop = asyncio.ensure_future(self.writer.start())
         self.read_loop = asyncio.ensure_future(self.reader.start())
         self.dispatch_loop = asyncio.ensure_future(self.dispatch())
-        self.heartbeat_loop = asyncio.ensure_future(self.pacemaker.send_heartbeats())
-        self.connector.connection_made(self.node, self)
+
+        # A standby connection answers the server's heartbeats, but doesn't
+        # send its own or tell the connector until it's activated.
+        if not self.standby:
+            self.activate()
+            self.connector.connection_made(self.node, self)
+
+    def activate(self):
+        self.standby = False
+
+        if not self.heartbeat_loop:
+            self.heartbeat_loop = asyncio.ensure_future(
+                self.pacemaker.send_heartbeats()
+            )
 
     def data_received(self, data):
+        if self.capture.enabled:
+            self.capture.record(self.capture_id, Direction.Inbound, data)
         self.reader.feed_data(data)
 
     async def dispatch(self):
         while True:
             try:
                 next_msg = await self.input_queue.get()
+
+                if self.metrics.enabled:
+                    self.metrics.add("input_queue_depth", -1)
                 await self.dispatcher.dispatch(next_msg, self.output_queue)
             except asyncio.CancelledError:
                 break
@@ -804,25 +1887,26 @@ class PhotonPumpProtocol(asyncio.streams.FlowControlMixin):
         self._log.debug("Connection lost")
         super().connection_lost(exn)
         self._connection_lost = True
-        self.connector.connection_lost(exn)
+        self.connector.connection_lost(exn, self)
 
     async def stop(self):
         self._log.debug("Stopping")
         try:
-            self.read_loop.cancel()
-            self.write_loop.cancel()
-            self.dispatch_loop.cancel()
-            self.heartbeat_loop.cancel()
+            loops = [self.read_loop, self.write_loop, self.dispatch_loop]
+
+            if self.heartbeat_loop:
+                loops.append(self.heartbeat_loop)
+
+            for task in loops:
+                task.cancel()
             self._log.debug("Waiting for coroutines to end")
-            await asyncio.gather(
-                self.read_loop,
-                self.write_loop,
-                self.dispatch_loop,
-                self.heartbeat_loop,
-                loop=self.loop,
-                return_exceptions=True,
-            )
+            await asyncio.gather(*loops, loop=self.loop, return_exceptions=True)
             self.transport.close()
+
+            if self.metrics.enabled:
+                # Whatever is still queued will never be read.
+                self.metrics.add("input_queue_depth", -self.input_queue.qsize())
+                self.metrics.add("output_queue_depth", -self.output_queue.qsize())
             self._log.debug("Closed the transport")
         except asyncio.CancelledError:
             pass
@@ -836,6 +1920,20 @@ def connect(
     username=None,
     password=None,
     loop=None,
+    coalesce_writes=False,
+    coalesce_delay=0.001,
+    coalesce_max_events=500,
+    pool_size=1,
+    read_preference=ReadPreference.Master,
+    max_followers=2,
+    retry_busy=False,
+    adaptive_concurrency=False,
+    gossip_interval=None,
+    happy_eyeballs_delay=None,
+    transport_config: Optional[TransportConfig] = None,
+    metrics: Optional[Metrics] = None,
+    tracer: Optional[Tracer] = None,
+    capture: Optional[Capture] = None,
 ) -> Client:
     """ Create a new client.
 
@@ -875,12 +1973,151 @@ def connect(
             username: The username to use when communicating with eventstore.
             password: The password to use when communicating with eventstore.
             loop:An Asyncio event loop.
+            coalesce_writes: If True, concurrent writes to the same stream
+                with `ExpectedVersion.Any` are merged into a single request.
+            coalesce_delay: The longest time, in seconds, that a coalesced
+                write waits for others to join it, defaults to 0.001.
+            coalesce_max_events: The number of waiting events that sends a
+                coalesced write immediately, defaults to 500.
+            pool_size: The number of connections to open to the chosen node,
+                defaults to 1. Writes and subscriptions for a stream always
+                share a connection; reads go to the least busy one.
+            read_preference: Where to send reads that don't require the
+                master when using cluster discovery, defaults to
+                ReadPreference.Master. Any other preference opens a
+                connection to each of up to `max_followers` followers
+                in place of a connection pool.
+            max_followers: The most followers to connect to, defaults to 2.
+            retry_busy: If True, reads that the server is too busy or not
+                ready to handle are retried with jittered exponential
+                backoff, within a retry budget. Defaults to False.
+            adaptive_concurrency: If True, the number of conversations
+                waiting for the server is limited, and the limit shrinks
+                while the server reports it is busy. Defaults to False.
+            gossip_interval: If set, cluster gossip is refreshed every
+                `gossip_interval` seconds. When it shows a new master, we
+                open a connection to that master and swap to it before the
+                old connection fails. With a `read_preference` other than
+                Master, the followers are also chosen again from each
+                refresh. Defaults to None.
+            happy_eyeballs_delay: If set, when connecting to a node found by
+                cluster discovery we also try the other nodes in the gossip,
+                starting one every `happy_eyeballs_delay` seconds. Another
+                node is only used if the chosen one fails or doesn't connect
+                before the connect timeout, so a slow master still wins over
+                a follower. Defaults to None.
+            transport_config: The socket and transport options applied to
+                every connection, eg. `photonpump.transport.LOW_LATENCY` or
+                `photonpump.transport.BULK_THROUGHPUT`. Defaults to asyncio's
+                own settings.
+            metrics: Where to report counters, gauges and histograms, eg. a
+                `photonpump.metrics.Registry`, whose `render` method returns
+                them in the Prometheus text format. Defaults to None, which
+                discards them.
+            tracer: A `photonpump.tracing.Tracer`, which timestamps each
+                conversation at every stage of the pipeline to show where
+                slow requests spend their time. Defaults to None.
+            capture: A `photonpump.capture.CaptureFile`, which records the
+                bytes sent and received on every connection for replay with
+                `photonpump.replay`. Defaults to None.
 
     """
     discovery = get_discoverer(host, port, discovery_host, discovery_port)
-    dispatcher = MessageDispatcher(loop)
-    connector = Connector(discovery, dispatcher)
+    retry_policy = RetryPolicy() if retry_busy else None
+    limiter = AimdLimiter() if adaptive_concurrency else None
+
+    def make_dispatcher():
+        return MessageDispatcher(
+            loop,
+            retry_policy=retry_policy,
+            limiter=limiter,
+            metrics=metrics,
+            tracer=tracer,
+        )
+
+    dispatcher = make_dispatcher()
+    connector = Connector(
+        discovery,
+        dispatcher,
+        happy_eyeballs_delay=happy_eyeballs_delay,
+        transport_config=transport_config,
+        metrics=metrics,
+        tracer=tracer,
+        capture=capture,
+    )
+
+    gossip_monitor = None
+
+    if discovery_host is not None and gossip_interval:
+        gossip_monitor = connector.gossip_monitor = GossipMonitor(
+            discovery, gossip_interval, on_master_changed=connector.master_changed
+        )
+
+    if discovery_host is not None and read_preference != ReadPreference.Master:
+
+        def connection_factory(index, node_discovery):
+            if index == 0:
+                return PooledConnection(index, connector, dispatcher)
+            follower_dispatcher = make_dispatcher()
+
+            return PooledConnection(
+                index,
+                Connector(
+                    node_discovery,
+                    follower_dispatcher,
+                    health=discovery.health,
+                    transport_config=transport_config,
+                    metrics=metrics,
+                    tracer=tracer,
+                    capture=capture,
+                ),
+                follower_dispatcher,
+            )
+
+        connector = dispatcher = ClusterRouter(
+            discovery,
+            connection_factory,
+            read_preference=read_preference,
+            max_followers=max_followers,
+        )
+
+        if gossip_monitor:
+            gossip_monitor.on_gossip = connector.gossip_received
+
+    elif pool_size > 1:
+        connections = [PooledConnection(0, connector, dispatcher)]
+
+        for index in range(1, pool_size):
+            pooled_dispatcher = make_dispatcher()
+            connections.append(
+                PooledConnection(
+                    index,
+                    Connector(
+                        discovery,
+                        pooled_dispatcher,
+                        transport_config=transport_config,
+                        metrics=metrics,
+                        tracer=tracer,
+                        capture=capture,
+                    ),
+                    pooled_dispatcher,
+                )
+            )
+        connector = dispatcher = ConnectionPool(discovery, connections)
 
     credential = msg.Credential(username, password) if username and password else None
 
-    return Client(connector, dispatcher, credential=credential)
+    write_coalescer = (
+        writers.WriteCoalescer(
+            dispatcher,
+            max_delay=coalesce_delay,
+            max_events=coalesce_max_events,
+            loop=loop,
+        )
+        if coalesce_writes
+        else None
+    )
+
+    return Client(
+        connector, dispatcher, credential=credential, write_coalescer=write_coalescer
+    )
@@ -1,9 +1,11 @@
 import json
 import logging
 import time
-from asyncio import Future, Queue, TimeoutError
+from asyncio import Future, Queue, Semaphore, TimeoutError, ensure_future
+from collections import deque
 from enum import IntEnum
-from typing import Any, NamedTuple, Optional, Sequence, Union
+from operator import attrgetter
+from typing import Any, List, NamedTuple, Optional, Sequence, Union
 from uuid import UUID, uuid4
 
 from google.protobuf.text_format import MessageToString
@@ -11,24 +13,51 @@ from google.protobuf.text_format import MessageToString
 from photonpump import exceptions
 from photonpump import messages as messages
 from photonpump import messages_pb2 as proto
+from photonpump.discovery import NodeService
 from photonpump.messages import (
+    AllStreamSlice,
     ContentType,
     Credential,
     ExpectedVersion,
     InboundMessage,
-    NewEvent,
+    NewEventData,
     NotHandledReason,
+    OperationResult,
     OutboundMessage,
+    Position,
+    ReadAllResult,
     ReadEventResult,
     ReadStreamResult,
     StreamDirection,
     StreamSlice,
     SubscriptionResult,
     TcpCommand,
+    _make_all_event,
     _make_event,
 )
 
 
+def master_info(body: proto.NotHandled) -> Optional[NodeService]:
+    """Read the address of the master from a NotHandled message.
+
+    Returns:
+        The master's external TCP address, or None if the reason isn't
+        NotMaster or the server didn't tell us where the master is.
+    """
+
+    if body.reason != NotHandledReason.NotMaster or not body.additional_info:
+        return None
+
+    info = proto.NotHandled.MasterInfo()
+    info.ParseFromString(body.additional_info)
+
+    return NodeService(
+        info.external_tcp_address,
+        info.external_tcp_port,
+        info.external_secure_tcp_port or None,
+    )
+
+
 class StreamingIterator:
     def __init__(self, size=0):
         self.items = Queue(size)
@@ -71,6 +100,21 @@ class StreamingIterator:
 
 
 class Conversation:
+
+    #: Conversations that must be sent in order with other conversations on
+    #: the same stream, eg. writes. A connection pool keeps them together.
+    ordered = False
+
+    #: Conversations that can safely be sent again if the server was too
+    #: busy to handle them, eg. reads.
+    idempotent = False
+
+    #: The outbound lane for the conversation's messages. Bulk traffic, eg.
+    #: transactions, gives way to interactive requests on a shared connection.
+    priority = messages.Priority.Interactive
+
+    _logger = logging.getLogger(__name__ + ".Conversation")
+
     def __init__(
         self,
         conversation_id: Optional[UUID] = None,
@@ -80,7 +124,6 @@ class Conversation:
         self.result: Future = Future()
         self.is_complete = False
         self.credential = credential
-        self._logger = logging.get_named_logger(Conversation)
         self.one_way = False
 
     def __str__(self):
@@ -138,7 +181,7 @@ class Conversation:
         elif body.reason == NotHandledReason.TooBusy:
             exn = exceptions.TooBusy(self.conversation_id)
         elif body.reason == NotHandledReason.NotMaster:
-            exn = exceptions.NotMaster(self.conversation_id)
+            exn = exceptions.NotMaster(self.conversation_id, master_info(body))
         else:
             exn = exceptions.NotHandled(self.conversation_id, body.reason)
 
@@ -201,6 +244,9 @@ class Heartbeat(TimerConversation):
 
 
 class Ping(TimerConversation):
+
+    idempotent = True
+
     def __init__(self, conversation_id: UUID = None, credential=None) -> None:
         super().__init__(conversation_id or uuid4(), credential)
 
@@ -221,13 +267,145 @@ class Ping(TimerConversation):
         await super().reply(message, output)
 
 
+def _fill_new_event(e: proto.NewEvent, event: NewEventData) -> None:
+    e.event_id = event.id.bytes_le
+    e.event_type = event.type
+
+    if isinstance(event.data, str):
+        e.data_content_type = ContentType.Json
+        e.data = event.data.encode("UTF-8")
+    elif event.data:
+        e.data_content_type = ContentType.Json
+        e.data = json.dumps(event.data).encode("UTF-8")
+    else:
+        e.data_content_type = ContentType.Binary
+        e.data = bytes()
+
+    if event.metadata:
+        e.metadata_content_type = ContentType.Json
+        e.metadata = json.dumps(event.metadata).encode("UTF-8")
+    else:
+        e.metadata_content_type = ContentType.Binary
+        e.metadata = bytes()
+
+
+def operation_failed(conversation_id, result, message=None):
+    """Build the exception for a write that failed with `result`.
+
+    Returns:
+        A WrongExpectedVersion for optimistic concurrency failures, and an
+        OperationFailed otherwise.
+    """
+    result = OperationResult(result)
+
+    if result == OperationResult.WrongExpectedVersion:
+        return exceptions.WrongExpectedVersion(conversation_id, result, message)
+
+    return exceptions.OperationFailed(conversation_id, result, message)
+
+
+class EventChunker:
+    """Cuts an iterable of events into batches bounded by both count and
+    encoded size.
+
+    Events are pulled from the source lazily, so only one batch needs to be
+    held in memory at a time.
+
+    Args:
+        events: An iterable or async iterable of NewEventData.
+        max_count (optional): The maximum number of events in a batch.
+        max_bytes (optional): The maximum encoded size of a batch. A batch
+            always contains at least one event, however large.
+    """
+
+    def __init__(self, events, max_count=500, max_bytes=1024 * 1024):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.exhausted = False
+        self.events_read = 0
+        self._pending = None
+
+        if hasattr(events, "__aiter__"):
+            self._aiter = events.__aiter__()
+            self._iter = None
+        else:
+            self._aiter = None
+            self._iter = iter(events)
+
+    async def _next_event(self) -> Optional[proto.NewEvent]:
+        if self._pending is not None:
+            encoded, self._pending = self._pending, None
+
+            return encoded
+
+        try:
+            if self._aiter:
+                event = await self._aiter.__anext__()
+            else:
+                event = next(self._iter)
+        except (StopIteration, StopAsyncIteration):
+            self.exhausted = True
+
+            return None
+
+        encoded = proto.NewEvent()
+        _fill_new_event(encoded, event)
+
+        return encoded
+
+    async def next_batch(self) -> List[proto.NewEvent]:
+        """Read and encode the next batch of events.
+
+        Returns:
+            A list of encoded events, which is empty once the source is
+            exhausted.
+        """
+        batch = []
+        size = 0
+
+        while len(batch) < self.max_count:
+            encoded = await self._next_event()
+
+            if encoded is None:
+                break
+
+            encoded_size = encoded.ByteSize()
+
+            if batch and size + encoded_size > self.max_bytes:
+                self._pending = encoded
+
+                break
+
+            batch.append(encoded)
+            size += encoded_size
+
+        self.events_read += len(batch)
+
+        return batch
+
+    async def fill(self, events) -> int:
+        """Add the next batch to a repeated NewEvent field.
+
+        Returns:
+            The number of events added, which is zero once the source is
+            exhausted.
+        """
+        batch = await self.next_batch()
+
+        for encoded in batch:
+            events.add().CopyFrom(encoded)
+
+        return len(batch)
+
+
 class WriteEvents(Conversation):
     """Command class for writing a sequence of events to a single
         stream.
 
     Args:
         stream: The name of the stream to write to.
-        events: A sequence of events to write.
+        events: A sequence of events to write. Events that have already
+            been encoded, eg. by an EventChunker, are sent as they are.
         expected_version (optional): The expected version of the
             target stream used for concurrency control.
         required_master (optional): True if this command must be
@@ -237,10 +415,14 @@ class WriteEvents(Conversation):
 
     """
 
+    _logger = logging.getLogger(__name__ + ".WriteEvents")
+
+    ordered = True
+
     def __init__(
         self,
         stream: str,
-        events: Sequence[NewEvent],
+        events: Sequence[Union[NewEventData, proto.NewEvent]],
         expected_version: Union[ExpectedVersion, int] = ExpectedVersion.Any,
         require_master: bool = False,
         conversation_id: UUID = None,
@@ -248,7 +430,6 @@ class WriteEvents(Conversation):
         loop=None,
     ):
         super().__init__(conversation_id, credential)
-        self._logger = logging.get_named_logger(WriteEvents)
         self.stream = stream
         self.require_master = require_master
         self.events = events
@@ -261,26 +442,10 @@ class WriteEvents(Conversation):
         msg.expected_version = self.expected_version
 
         for event in self.events:
-            e = msg.events.add()
-            e.event_id = event.id.bytes_le
-            e.event_type = event.type
-
-            if isinstance(event.data, str):
-                e.data_content_type = ContentType.Json
-                e.data = event.data.encode("UTF-8")
-            elif event.data:
-                e.data_content_type = ContentType.Json
-                e.data = json.dumps(event.data).encode("UTF-8")
+            if isinstance(event, proto.NewEvent):
+                msg.events.add().CopyFrom(event)
             else:
-                e.data_content_type = ContentType.Binary
-                e.data = bytes()
-
-            if event.metadata:
-                e.metadata_content_type = ContentType.Json
-                e.metadata = json.dumps(event.metadata).encode("UTF-8")
-            else:
-                e.metadata_content_type = ContentType.Binary
-                e.metadata = bytes()
+                _fill_new_event(msg.events.add(), event)
 
         data = msg.SerializeToString()
 
@@ -295,12 +460,187 @@ class WriteEvents(Conversation):
         result = proto.WriteEventsCompleted()
         result.ParseFromString(message.payload)
 
+        self.is_complete = True
         self.result.set_result(result)
 
     def timeout(self):
         return Reply(ReplyAction.ResubmitMessage, None, self.start())
 
 
+class WriteTransaction(Conversation):
+    """Command class for writing a large number of events to a single
+    stream as one transaction.
+
+    Events are sent in chunks of bounded size. Up to `window` chunks may be
+    awaiting acknowledgement at once. Chunks are read from the source and
+    encoded by a separate task, which only reads the next chunk when there
+    is room in the window, so memory use is independent of the total number
+    of events and a slow source never holds up the dispatcher. Once every
+    chunk has been written the transaction is committed.
+
+    If the connection drops after the transaction has started, any chunks
+    that were not acknowledged are sent again. A chunk that the server had
+    written before the connection dropped may then be written twice. If the
+    connection drops before the server confirms the start of the
+    transaction, the conversation fails with ConnectionClosed; the server
+    may be left holding an open transaction which it will eventually time
+    out.
+
+    Args:
+        stream: The name of the stream to write to.
+        events: An iterable or async iterable of events to write.
+        expected_version (optional): The expected version of the
+            target stream used for concurrency control.
+        required_master (optional): True if this command must be
+            sent direct to the master node, otherwise False.
+        chunk_events (optional): The maximum number of events per chunk.
+        chunk_bytes (optional): The maximum encoded size of each chunk.
+        window (optional): The maximum number of unacknowledged chunks.
+        correlation_id (optional): A unique identifer for this
+            command.
+
+    """
+
+    _logger = logging.getLogger(__name__ + ".WriteTransaction")
+
+    ordered = True
+    priority = messages.Priority.Bulk
+
+    def __init__(
+        self,
+        stream: str,
+        events,
+        expected_version: Union[ExpectedVersion, int] = ExpectedVersion.Any,
+        require_master: bool = False,
+        chunk_events: int = 500,
+        chunk_bytes: int = 1024 * 1024,
+        window: int = 4,
+        conversation_id: UUID = None,
+        credential=None,
+    ) -> None:
+        super().__init__(conversation_id, credential)
+        self.stream = stream
+        self.expected_version = expected_version
+        self.require_master = require_master
+        self.window = window
+        self.chunker = EventChunker(events, chunk_events, chunk_bytes)
+        self.transaction_id = None
+        self.in_flight = deque()
+        self.events_written = 0
+        self.committing = False
+        self.started = False
+        self.output = None
+        self.producer = None
+        self.slots = Semaphore(window)
+
+    async def start(self, output: Queue) -> None:
+        self.output = output
+
+        if self.transaction_id is None and self.started:
+            return await self.error(
+                exceptions.ConnectionClosed(
+                    self.conversation_id,
+                    "Connection closed before transaction on %s started" % self.stream,
+                )
+            )
+
+        if self.transaction_id is None:
+            self.started = True
+            msg = proto.TransactionStart()
+            msg.event_stream_id = self.stream
+            msg.expected_version = self.expected_version
+            msg.require_master = self.require_master
+
+            await self._send(TcpCommand.TransactionStart, msg.SerializeToString())
+
+            return
+
+        for data, _ in self.in_flight:
+            await self._send(TcpCommand.TransactionWrite, data)
+
+        if self.committing:
+            await self._commit()
+
+    async def error(self, exn: Exception) -> None:
+        if self.producer:
+            self.producer.cancel()
+
+        await super().error(exn)
+
+    async def _send(self, command: TcpCommand, data: bytes) -> None:
+        await self.output.put(
+            OutboundMessage(self.conversation_id, command, data, self.credential)
+        )
+
+    async def _commit(self) -> None:
+        self.committing = True
+        msg = proto.TransactionCommit()
+        msg.transaction_id = self.transaction_id
+        msg.require_master = self.require_master
+
+        await self._send(TcpCommand.TransactionCommit, msg.SerializeToString())
+
+    async def _commit_if_done(self) -> None:
+        if self.chunker.exhausted and not self.in_flight and not self.committing:
+            await self._commit()
+
+    async def _produce(self) -> None:
+        try:
+            while True:
+                await self.slots.acquire()
+                msg = proto.TransactionWrite()
+                msg.transaction_id = self.transaction_id
+                msg.require_master = self.require_master
+                count = await self.chunker.fill(msg.events)
+
+                if not count:
+                    break
+
+                data = msg.SerializeToString()
+                self.in_flight.append((data, count))
+                await self._send(TcpCommand.TransactionWrite, data)
+
+            await self._commit_if_done()
+        except Exception as exn:
+            if not self.is_complete:
+                await self.error(exn)
+
+    async def reply(self, message: InboundMessage, output: Queue) -> None:
+        if message.command == TcpCommand.TransactionStartCompleted:
+            result = proto.TransactionStartCompleted()
+        elif message.command == TcpCommand.TransactionWriteCompleted:
+            result = proto.TransactionWriteCompleted()
+        else:
+            self.expect_only(TcpCommand.TransactionCommitCompleted, message)
+            result = proto.TransactionCommitCompleted()
+
+        result.ParseFromString(message.payload)
+
+        if result.result != OperationResult.Success:
+            return await self.error(
+                operation_failed(self.conversation_id, result.result, result.message)
+            )
+
+        if message.command == TcpCommand.TransactionStartCompleted:
+            self.transaction_id = result.transaction_id
+            self._logger.debug(
+                "Started transaction %d on stream %s", self.transaction_id, self.stream
+            )
+            self.producer = ensure_future(self._produce())
+
+        elif message.command == TcpCommand.TransactionWriteCompleted:
+            # Replies on a connection arrive in the order we sent them, so
+            # each completion acknowledges the oldest chunk in flight.
+            _, count = self.in_flight.popleft()
+            self.events_written += count
+            self.slots.release()
+            await self._commit_if_done()
+
+        else:
+            self.is_complete = True
+            self.result.set_result(result)
+
+
 class ReadStreamEventsBehaviour:
     def __init__(self, result_type, response_cls):
         self.result_type = result_type
@@ -310,12 +650,10 @@ class ReadStreamEventsBehaviour:
         pass
 
     async def reply(self, message: InboundMessage, output: Queue):
-        logging.error("HERRO")
         result = self.response_cls()
         result.ParseFromString(message.payload)
 
         if result.result == self.result_type.Success:
-            logging.error(message)
             await self.success(result, output)
         elif result.result == self.result_type.NoStream:
             await self.error(
@@ -364,6 +702,8 @@ class ReadEvent(ReadStreamEventsBehaviour, Conversation):
 
     """
 
+    idempotent = True
+
     def __init__(
         self,
         stream: str,
@@ -417,6 +757,8 @@ class ReadStreamEvents(ReadStreamEventsBehaviour, Conversation):
             command.
     """
 
+    idempotent = True
+
     def __init__(
         self,
         stream: str,
@@ -490,6 +832,8 @@ class IterStreamEvents(ReadStreamEventsBehaviour, Conversation):
 
     """
 
+    _logger = logging.getLogger(__name__ + ".IterStreamEvents")
+
     def __init__(
         self,
         stream: str,
@@ -512,7 +856,6 @@ class IterStreamEvents(ReadStreamEventsBehaviour, Conversation):
         self.resolve_links = resolve_links
         self.require_master = require_master
         self.direction = direction
-        self._logger = logging.get_named_logger(IterStreamEvents)
         self.iterator = StreamingIterator(self.batch_size)
 
         if direction == StreamDirection.Forward:
@@ -573,6 +916,228 @@ class IterStreamEvents(ReadStreamEventsBehaviour, Conversation):
             self.result.set_exception(exn)
 
 
+class ReadAllEventsBehaviour:
+    def _fetch_page_message(self, position: Position):
+        if self.direction == StreamDirection.Forward:
+            command = TcpCommand.ReadAllEventsForward
+        else:
+            command = TcpCommand.ReadAllEventsBackward
+
+        msg = proto.ReadAllEvents()
+        msg.commit_position = position.commit
+        msg.prepare_position = position.prepare
+        msg.max_count = self.max_count
+        msg.resolve_link_tos = self.resolve_links
+        msg.require_master = self.require_master
+
+        data = msg.SerializeToString()
+
+        return OutboundMessage(self.conversation_id, command, data, self.credential)
+
+    async def reply(self, message: InboundMessage, output: Queue):
+        result = proto.ReadAllEventsCompleted()
+        result.ParseFromString(message.payload)
+
+        if result.result == ReadAllResult.Success:
+            await self.success(result, output)
+        elif result.result == ReadAllResult.AccessDenied:
+            await self.error(
+                exceptions.AccessDenied(
+                    self.conversation_id,
+                    type(self).__name__,
+                    result.error,
+                    stream="$all",
+                )
+            )
+        else:
+            await self.error(
+                exceptions.ReadError(self.conversation_id, "$all", result.error)
+            )
+
+    def _is_end_of_stream(
+        self, result: proto.ReadAllEventsCompleted, requested: Position
+    ) -> bool:
+        # The server can return a short page that isn't the last, eg. when
+        # it skips system records, so we only stop on a page that's empty
+        # or that doesn't move us on from the position we asked for.
+        if not result.events:
+            return True
+
+        return (
+            Position(result.next_commit_position, result.next_prepare_position)
+            == requested
+        )
+
+
+def _start_of(direction: StreamDirection) -> Position:
+    if direction == StreamDirection.Forward:
+        return Position.min()
+
+    return Position.max()
+
+
+class ReadAllEvents(ReadAllEventsBehaviour, Conversation):
+    """Command class for reading a page of events from the $all stream.
+
+    Args:
+        from_position (optional): The position to read from. Defaults to
+            the start of $all when reading forward, and the end when
+            reading backward.
+        max_count (optional): The maximum number of events to read.
+        resolve_links (optional): True if eventstore should
+            automatically resolve Link Events, otherwise False.
+        required_master (optional): True if this command must be
+            sent direct to the master node, otherwise False.
+        correlation_id (optional): A unique identifer for this
+            command.
+    """
+
+    idempotent = True
+
+    def __init__(
+        self,
+        from_position: Optional[Position] = None,
+        max_count: int = 100,
+        resolve_links: bool = True,
+        require_master: bool = False,
+        direction: StreamDirection = StreamDirection.Forward,
+        credentials=None,
+        conversation_id: UUID = None,
+    ) -> None:
+        Conversation.__init__(self, conversation_id, credential=credentials)
+        self.direction = direction
+        self.from_position = from_position or _start_of(direction)
+        self.max_count = max_count
+        self.resolve_links = resolve_links
+        self.require_master = require_master
+
+    async def start(self, output: Queue) -> None:
+        await output.put(self._fetch_page_message(self.from_position))
+
+    async def success(self, result: proto.ReadAllEventsCompleted, output: Queue):
+        events = [_make_all_event(x) for x in result.events]
+
+        self.is_complete = True
+        self.result.set_result(
+            AllStreamSlice(
+                events,
+                Position(result.commit_position, result.prepare_position),
+                Position(result.next_commit_position, result.next_prepare_position),
+                self._is_end_of_stream(result, self.from_position),
+            )
+        )
+
+
+class IterAllEvents(ReadAllEventsBehaviour, Conversation):
+    """Command class for iterating every event in the $all stream.
+
+    The next page is requested before the current one is handed to the
+    consumer, so that reads overlap with processing, but we never run more
+    than one page ahead of the consumer.
+
+    Args:
+        from_position (optional): The position to read from. Defaults to
+            the start of $all when reading forward, and the end when
+            reading backward. When reading forward, an event at exactly
+            this position is skipped, so that passing the position of the
+            last event processed resumes with the event after it.
+        batch_size (optional): The number of events to read per page.
+        resolve_links (optional): True if eventstore should
+            automatically resolve Link Events, otherwise False.
+        required_master (optional): True if this command must be
+            sent direct to the master node, otherwise False.
+        correlation_id (optional): A unique identifer for this
+            command.
+    """
+
+    _logger = logging.getLogger(__name__ + ".IterAllEvents")
+
+    idempotent = True
+
+    def __init__(
+        self,
+        from_position: Optional[Position] = None,
+        batch_size: int = 100,
+        resolve_links: bool = True,
+        require_master: bool = False,
+        direction: StreamDirection = StreamDirection.Forward,
+        credentials=None,
+        conversation_id: UUID = None,
+    ) -> None:
+        Conversation.__init__(self, conversation_id, credential=credentials)
+        self.direction = direction
+        self.from_position = from_position or _start_of(direction)
+        self.max_count = batch_size
+        self.resolve_links = resolve_links
+        self.require_master = require_master
+        self.next_position = self.from_position
+        self.skip_position = (
+            from_position if direction == StreamDirection.Forward else None
+        )
+        self.deferred_page = None
+        self.output = None
+        self.iterator = CheckpointingIterator(
+            on_consumed=self._resume_paging, checkpoint_of=attrgetter("position")
+        )
+
+    async def _request_page(self, position: Position, output: Queue) -> None:
+        if self.iterator.items.qsize() < self.max_count:
+            self.deferred_page = None
+            self._logger.debug(
+                "Requesting page of %d events from %s", self.max_count, position
+            )
+            await output.put(self._fetch_page_message(position))
+        else:
+            self.deferred_page = position
+
+    async def _resume_paging(self) -> None:
+        if self.deferred_page is None or self.is_complete:
+            return
+
+        await self._request_page(self.deferred_page, self.output)
+
+    async def start(self, output: Queue) -> None:
+        self.output = output
+        self.deferred_page = None
+        await output.put(self._fetch_page_message(self.next_position))
+
+    async def reply(self, message: InboundMessage, output: Queue):
+        self.output = output
+        await ReadAllEventsBehaviour.reply(self, message, output)
+
+    async def success(self, result: proto.ReadAllEventsCompleted, output: Queue):
+        end_of_stream = self._is_end_of_stream(result, self.next_position)
+        self.next_position = Position(
+            result.next_commit_position, result.next_prepare_position
+        )
+
+        if not end_of_stream:
+            await self._request_page(self.next_position, output)
+
+        events = [_make_all_event(x) for x in result.events]
+
+        if self.skip_position is not None:
+            events = [e for e in events if e.position != self.skip_position]
+            self.skip_position = None
+
+        await self.iterator.enqueue_items(events)
+
+        if not self.result.done():
+            self.result.set_result(self.iterator)
+
+        if end_of_stream:
+            self.is_complete = True
+            await self.iterator.asend(StopAsyncIteration())
+
+    async def error(self, exn: Exception) -> None:
+        self.is_complete = True
+
+        if self.result.done():
+            await self.iterator.asend(exn)
+        else:
+            self.result.set_exception(exn)
+
+
 class PersistentSubscription:
     def __init__(
         self,
@@ -616,6 +1181,9 @@ class PersistentSubscription:
 
 
 class CreatePersistentSubscription(Conversation):
+
+    ordered = True
+
     def __init__(
         self,
         name,
@@ -707,6 +1275,9 @@ class CreatePersistentSubscription(Conversation):
 
 
 class ConnectPersistentSubscription(Conversation):
+
+    ordered = True
+
     class State(IntEnum):
         init = 0
         catch_up = 1
@@ -807,3 +1378,437 @@ class ConnectPersistentSubscription(Conversation):
 
         else:
             self.reply_from_init(message, output)
+
+
+def _event_number(event):
+    return event.original_event.event_number
+
+
+class CheckpointingIterator(StreamingIterator):
+    """A StreamingIterator that remembers the position of the last event
+    handed to the consumer.
+
+    Args:
+        size (optional): The maximum number of buffered events.
+        checkpoint (optional): The initial checkpoint.
+        on_consumed (optional): A coroutine function that is awaited each
+            time the consumer takes an event from the iterator.
+        checkpoint_of (optional): A function returning the checkpoint for
+            an event. Defaults to the event number in the original stream.
+    """
+
+    def __init__(
+        self, size=0, checkpoint=None, on_consumed=None, checkpoint_of=_event_number
+    ):
+        super().__init__(size)
+        self.checkpoint = checkpoint
+        self.on_consumed = on_consumed
+        self.checkpoint_of = checkpoint_of
+
+    async def __anext__(self):
+        event = await super().__anext__()
+        self.checkpoint = self.checkpoint_of(event)
+
+        if self.on_consumed:
+            await self.on_consumed()
+
+        return event
+
+
+class VolatileSubscription:
+    def __init__(
+        self,
+        conversation_id,
+        stream,
+        out_queue,
+        event_number=None,
+        commit_position=None,
+        iterator=None,
+        on_unsubscribe=None,
+    ):
+        self.conversation_id = conversation_id
+        self.stream = stream
+        self.out_queue = out_queue
+        self.first_event_number = event_number
+        self.first_commit_position = commit_position
+        self.events = iterator or CheckpointingIterator()
+        self.on_unsubscribe = on_unsubscribe
+
+    def __str__(self):
+        return "Subscription to %s at checkpoint %s" % (self.stream, self.checkpoint)
+
+    @property
+    def checkpoint(self) -> Optional[int]:
+        """The number of the last event read from this subscription.
+
+        Pass this value as `start_from` to a new catch-up subscription
+        to resume without missing or repeating events.
+        """
+
+        return self.events.checkpoint
+
+    async def unsubscribe(self):
+        if self.on_unsubscribe:
+            return await self.on_unsubscribe()
+
+        await self._send_unsubscribe()
+
+    async def _send_unsubscribe(self):
+        await self.out_queue.put(
+            OutboundMessage(
+                self.conversation_id, TcpCommand.UnsubscribeFromStream, bytes()
+            )
+        )
+
+
+class SubscribeToStream(Conversation):
+    """Command class for receiving new events from a stream as they are
+    written.
+
+    Args:
+        stream: The name of the stream to subscribe to.
+        resolve_links (optional): True if eventstore should
+            automatically resolve Link Events, otherwise False.
+        correlation_id (optional): A unique identifer for this
+            command.
+
+    """
+
+    ordered = True
+
+    def __init__(
+        self, stream, resolve_links=True, credentials=None, conversation_id=None
+    ) -> None:
+        super().__init__(conversation_id, credentials)
+        self.stream = stream
+        self.resolve_links = resolve_links
+        self.subscription = None
+
+    def _subscribe_message(self):
+        msg = proto.SubscribeToStream()
+        msg.event_stream_id = self.stream
+        msg.resolve_link_tos = self.resolve_links
+
+        return OutboundMessage(
+            self.conversation_id,
+            TcpCommand.SubscribeToStream,
+            msg.SerializeToString(),
+            self.credential,
+        )
+
+    async def start(self, output: Queue) -> None:
+        await output.put(self._subscribe_message())
+
+    async def confirm(self, response: InboundMessage, output: Queue) -> None:
+        result = proto.SubscriptionConfirmation()
+        result.ParseFromString(response.payload)
+
+        if self.subscription:
+            self.subscription.out_queue = output
+
+            return
+
+        self.subscription = VolatileSubscription(
+            self.conversation_id,
+            self.stream,
+            output,
+            result.last_event_number,
+            result.last_commit_position,
+        )
+        self.result.set_result(self.subscription)
+
+    async def event_appeared(self, response: InboundMessage) -> None:
+        result = proto.StreamEventAppeared()
+        result.ParseFromString(response.payload)
+
+        await self.subscription.events.enqueue(_make_event(result.event))
+
+    async def drop_subscription(self, response: InboundMessage) -> None:
+        body = proto.SubscriptionDropped()
+        body.ParseFromString(response.payload)
+
+        if (
+            self.result.done()
+            and body.reason == messages.SubscriptionDropReason.Unsubscribed
+        ):
+            self.is_complete = True
+            await self.subscription.events.enqueue(StopAsyncIteration())
+
+            return
+
+        if self.result.done():
+            await self.error(
+                exceptions.SubscriptionFailed(self.conversation_id, body.reason)
+            )
+
+            return
+
+        await self.error(
+            exceptions.SubscriptionCreationFailed(self.conversation_id, body.reason)
+        )
+
+    async def error(self, exn) -> None:
+        self.is_complete = True
+
+        if self.result.done():
+            await self.subscription.events.asend(exn)
+        else:
+            self.result.set_exception(exn)
+
+    async def reply(self, message: InboundMessage, output: Queue) -> None:
+        if message.command == TcpCommand.SubscriptionConfirmation:
+            await self.confirm(message, output)
+
+        elif message.command == TcpCommand.SubscriptionDropped:
+            await self.drop_subscription(message)
+
+        else:
+            self.expect_only(TcpCommand.StreamEventAppeared, message)
+            await self.event_appeared(message)
+
+
+class CatchupSubscription(ReadStreamEventsBehaviour, SubscribeToStream):
+    """Command class for reading a stream from a checkpoint and then
+    following it as new events are written.
+
+    Historical events are read in pages, requesting the next page before
+    the current one is handed over, as IterStreamEvents does. When we reach
+    the end of the stream we subscribe, buffering live events while we
+    read whatever was written in the meantime. The buffer is then drained
+    by event number so that no event is lost or delivered twice.
+
+    Args:
+        stream: The name of the stream to subscribe to.
+        start_from (optional): The number of the last event that was
+            already processed, eg. the `checkpoint` of a previous
+            subscription. If None, the stream is read from the start.
+        batch_size (optional): The number of events to read per page.
+        resolve_links (optional): True if eventstore should
+            automatically resolve Link Events, otherwise False.
+        required_master (optional): True if this command must be
+            sent direct to the master node, otherwise False.
+        correlation_id (optional): A unique identifer for this
+            command.
+
+    """
+
+    _logger = logging.getLogger(__name__ + ".CatchupSubscription")
+
+    class Phase(IntEnum):
+        READ_HISTORICAL = 0
+        SUBSCRIBING = 1
+        CATCHING_UP = 2
+        LIVE = 3
+
+    def __init__(
+        self,
+        stream,
+        start_from: Optional[int] = None,
+        batch_size: int = 100,
+        resolve_links=True,
+        require_master=False,
+        credentials=None,
+        conversation_id=None,
+    ) -> None:
+        SubscribeToStream.__init__(
+            self, stream, resolve_links, credentials, conversation_id
+        )
+        ReadStreamEventsBehaviour.__init__(
+            self, ReadStreamResult, proto.ReadStreamEventsCompleted
+        )
+        self.batch_size = batch_size
+        self.require_master = require_master
+        self.last_event_number = start_from
+        self.subscribed_at = None
+        self.phase = CatchupSubscription.Phase.READ_HISTORICAL
+        self.live_buffer = []
+        self.deferred_page = None
+        self.output = None
+        self.subscription = VolatileSubscription(
+            self.conversation_id,
+            stream,
+            None,
+            iterator=CheckpointingIterator(
+                checkpoint=start_from, on_consumed=self._resume_paging
+            ),
+            on_unsubscribe=self._unsubscribe,
+        )
+
+    def _next_event_number(self):
+        if self.last_event_number is None:
+            return 0
+
+        return self.last_event_number + 1
+
+    def _fetch_page_message(self, from_event):
+        self._logger.debug(
+            "Requesting page of %d events from number %d", self.batch_size, from_event
+        )
+        msg = proto.ReadStreamEvents()
+        msg.event_stream_id = self.stream
+        msg.from_event_number = from_event
+        msg.max_count = self.batch_size
+        msg.require_master = self.require_master
+        msg.resolve_link_tos = self.resolve_links
+
+        return OutboundMessage(
+            self.conversation_id,
+            TcpCommand.ReadStreamEventsForward,
+            msg.SerializeToString(),
+            self.credential,
+        )
+
+    async def _request_page(self, from_event, output: Queue) -> None:
+        # Keep at most one page buffered ahead of the consumer; otherwise
+        # wait for them to catch up before asking for more.
+        if self.subscription.events.items.qsize() < self.batch_size:
+            self.deferred_page = None
+            await output.put(self._fetch_page_message(from_event))
+        else:
+            self.deferred_page = from_event
+
+    async def _resume_paging(self) -> None:
+        if self.deferred_page is None or self.is_complete:
+            return
+
+        await self._request_page(self.deferred_page, self.output)
+
+    async def _deliver(self, event) -> None:
+        event_number = event.original_event.event_number
+
+        if (
+            self.last_event_number is not None
+            and event_number <= self.last_event_number
+        ):
+            return
+
+        self.last_event_number = event_number
+        await self.subscription.events.enqueue(event)
+
+    async def _go_live(self) -> None:
+        self._logger.debug(
+            "Caught up with %s at %s, draining %d buffered events",
+            self.stream,
+            self.last_event_number,
+            len(self.live_buffer),
+        )
+        self.phase = CatchupSubscription.Phase.LIVE
+        buffered, self.live_buffer = self.live_buffer, []
+
+        for event in buffered:
+            await self._deliver(event)
+
+    async def _unsubscribe(self) -> None:
+        if self.is_complete:
+            return
+
+        if self.phase != CatchupSubscription.Phase.READ_HISTORICAL:
+            await self.subscription._send_unsubscribe()
+
+        if self.phase == CatchupSubscription.Phase.LIVE:
+            return
+
+        # Until we're live there may be no subscription on the server to
+        # drop, so we finish here rather than waiting for SubscriptionDropped.
+        self.is_complete = True
+        self.deferred_page = None
+        self.live_buffer = []
+        await self.subscription.events.enqueue(StopAsyncIteration())
+
+    async def start(self, output: Queue) -> None:
+        if self.is_complete:
+            return
+
+        self.output = output
+        self.subscription.out_queue = output
+        self.phase = CatchupSubscription.Phase.READ_HISTORICAL
+        self.live_buffer = []
+        self.subscribed_at = None
+        self.deferred_page = None
+
+        await output.put(self._fetch_page_message(self._next_event_number()))
+
+    async def success(self, result: proto.ReadStreamEventsCompleted, output: Queue):
+        end_of_stream = result.is_end_of_stream
+
+        if self.phase == CatchupSubscription.Phase.CATCHING_UP:
+            # last_event_number is the end of the stream, not of this page.
+            last_read = result.next_event_number - 1 if result.events else None
+            end_of_stream = end_of_stream or (
+                last_read is not None and last_read >= self.subscribed_at
+            )
+
+        if not end_of_stream:
+            await self._request_page(result.next_event_number, output)
+
+        for event in result.events:
+            await self._deliver(_make_event(event))
+
+        if not self.result.done():
+            self.result.set_result(self.subscription)
+
+        if not end_of_stream:
+            return
+
+        if self.phase == CatchupSubscription.Phase.READ_HISTORICAL:
+            self.phase = CatchupSubscription.Phase.SUBSCRIBING
+            await output.put(self._subscribe_message())
+
+        elif self.phase == CatchupSubscription.Phase.CATCHING_UP:
+            await self._go_live()
+
+    async def confirm(self, response: InboundMessage, output: Queue) -> None:
+        result = proto.SubscriptionConfirmation()
+        result.ParseFromString(response.payload)
+
+        self.subscription.out_queue = output
+        self.subscription.first_event_number = result.last_event_number
+        self.subscription.first_commit_position = result.last_commit_position
+
+        last_delivered = (
+            -1 if self.last_event_number is None else self.last_event_number
+        )
+
+        if (
+            result.HasField("last_event_number")
+            and result.last_event_number > last_delivered
+        ):
+            self.phase = CatchupSubscription.Phase.CATCHING_UP
+            self.subscribed_at = result.last_event_number
+            await self._request_page(self._next_event_number(), output)
+        else:
+            await self._go_live()
+
+    async def event_appeared(self, response: InboundMessage) -> None:
+        result = proto.StreamEventAppeared()
+        result.ParseFromString(response.payload)
+        event = _make_event(result.event)
+
+        if self.phase == CatchupSubscription.Phase.LIVE:
+            await self._deliver(event)
+        elif self.phase != CatchupSubscription.Phase.READ_HISTORICAL:
+            self.live_buffer.append(event)
+
+    async def page_received(self, message: InboundMessage, output: Queue) -> None:
+        result = proto.ReadStreamEventsCompleted()
+        result.ParseFromString(message.payload)
+
+        if result.result == ReadStreamResult.Success:
+            await self.success(result, output)
+        elif result.result == ReadStreamResult.NoStream:
+            # A stream that doesn't exist yet is simply an empty history.
+            result.is_end_of_stream = True
+            await self.success(result, output)
+        else:
+            await ReadStreamEventsBehaviour.reply(self, message, output)
+
+    async def reply(self, message: InboundMessage, output: Queue) -> None:
+        if self.is_complete:
+            return
+
+        self.output = output
+
+        if message.command == TcpCommand.ReadStreamEventsForwardCompleted:
+            await self.page_received(message, output)
+        else:
+            await SubscribeToStream.reply(self, message, output)
@@ -2,9 +2,10 @@ import asyncio
 import logging
 import random
 import socket
+import time
 from enum import IntEnum
 from operator import attrgetter
-from typing import Iterable, List, NamedTuple, Optional
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
 
 import aiodns
 import aiohttp
@@ -27,6 +28,7 @@ class NodeState(IntEnum):
 
 
 INELIGIBLE_STATE = [NodeState.Manager, NodeState.ShuttingDown, NodeState.Shutdown]
+FOLLOWER_STATE = [NodeState.Slave, NodeState.Clone]
 
 
 class NodeService(NamedTuple):
@@ -46,6 +48,9 @@ class DiscoveredNode(NamedTuple):
     internal_http: NodeService
     external_http: NodeService
 
+    epoch_number: int = -1
+    writer_checkpoint: int = -1
+
 
 def first(elems: Iterable):
     LOG.info(elems)
@@ -67,6 +72,42 @@ def select(gossip: List[DiscoveredNode]) -> Optional[DiscoveredNode]:
     return max(eligible_nodes, key=attrgetter("state"))
 
 
+def select_candidates(gossip: List[DiscoveredNode]) -> List[NodeService]:
+    """List the TCP addresses of every node we could connect to, in the
+    order that `select` would prefer them."""
+
+    eligible_nodes = [
+        node for node in gossip if node.is_alive and node.state not in INELIGIBLE_STATE
+    ]
+
+    return [
+        node.external_tcp
+        for node in sorted(eligible_nodes, key=attrgetter("state"), reverse=True)
+    ]
+
+
+def select_followers(
+    gossip: List[DiscoveredNode], health: Optional["HealthTracker"] = None
+) -> List[DiscoveredNode]:
+    """Choose the nodes that can serve reads which don't need the master.
+
+    With a HealthTracker, healthy nodes come first, fastest first. Otherwise,
+    and between nodes that perform alike, slaves are preferred to clones,
+    since clones take no part in elections and may lag further behind.
+    """
+    followers = [
+        node for node in gossip if node.is_alive and node.state in FOLLOWER_STATE
+    ]
+
+    LOG.debug("Selecting followers from gossip members: %r" % followers)
+    followers = sorted(followers, key=attrgetter("state"), reverse=True)
+
+    if health is None:
+        return followers
+
+    return sorted(followers, key=lambda node: health.sort_key(node.external_tcp))
+
+
 def read_gossip(data):
     if not data:
         LOG.debug("No gossip returned")
@@ -83,24 +124,151 @@ def read_gossip(data):
             external_tcp=NodeService(m["externalTcpIp"], m["externalTcpPort"], None),
             internal_http=NodeService(m["internalHttpIp"], m["internalHttpPort"], None),
             external_http=NodeService(m["externalHttpIp"], m["externalHttpPort"], None),
+            epoch_number=m.get("epochNumber", -1),
+            writer_checkpoint=m.get("writerCheckpoint", -1),
         )
         for m in data["members"]
     ]
 
 
+def gossip_freshness(gossip: List[DiscoveredNode]) -> Tuple[int, int]:
+    """Rank gossip by the newest epoch and writer checkpoint that it reports.
+
+    A seed that is partitioned from the cluster can go on serving gossip
+    that names an old master, so when several seeds answer we prefer the
+    one that has seen the latest election and the most writes.
+    """
+
+    return max(
+        ((m.epoch_number, m.writer_checkpoint) for m in gossip), default=(-1, -1)
+    )
+
+
 class DiscoveryFailed(Exception):
     pass
 
 
+SICK_FAILURE_RATE = 0.5
+FAILURE_PENALTY = 1.0
+
+
+class NodeHealth(NamedTuple):
+    """Smoothed measurements of how a node has been performing.
+
+    Attributes:
+        node: The endpoint, by address and port.
+        connect_time: The time, in seconds, to open a TCP connection.
+        heartbeat_rtt: The round trip time, in seconds, of a heartbeat.
+        latency: The time, in seconds, from sending a request to its first
+            reply.
+        failure_rate: The share of recent attempts that failed, from 0 to 1.
+    """
+
+    node: NodeService
+    connect_time: Optional[float] = None
+    heartbeat_rtt: Optional[float] = None
+    latency: Optional[float] = None
+    failure_rate: float = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.failure_rate < SICK_FAILURE_RATE
+
+    @property
+    def score(self) -> float:
+        """The expected time, in seconds, to get an answer from the node, plus
+        a penalty for recent failures. Lower is better, and nodes we know
+        nothing about score zero so that they get tried."""
+
+        estimate = next(
+            (
+                t
+                for t in (self.latency, self.heartbeat_rtt, self.connect_time)
+                if t is not None
+            ),
+            0.0,
+        )
+
+        return estimate + self.failure_rate * FAILURE_PENALTY
+
+
+def ewma(average: Optional[float], sample: float, alpha: float) -> float:
+    if average is None:
+        return sample
+
+    return average + alpha * (sample - average)
+
+
+class HealthTracker(dict):
+    """Tracks the NodeHealth of each endpoint by NodeService. The HTTP seed
+    and the TCP endpoint of a node are tracked apart, since a node whose TCP
+    port is unreachable may still serve gossip.
+
+    Every measurement is an exponentially weighted moving average, in which
+    the newest sample has weight `alpha`. A node that fails twice running,
+    or keeps failing now and then, stops being healthy well before the
+    retry policy gives up on it.
+
+    Args:
+        alpha (optional): The weight of the newest sample.
+    """
+
+    def __init__(self, alpha=0.3):
+        super().__init__()
+        self.alpha = alpha
+
+    def __missing__(self, key):
+        value = self[key] = NodeHealth(key)
+
+        return value
+
+    def _record(self, node, field, sample):
+        val = self[node]
+        self[node] = val._replace(
+            **{
+                field: ewma(getattr(val, field), sample, self.alpha),
+                "failure_rate": ewma(val.failure_rate, 0, self.alpha),
+            }
+        )
+
+    def record_connect(self, node, seconds):
+        self._record(node, "connect_time", seconds)
+
+    def record_heartbeat(self, node, seconds):
+        self._record(node, "heartbeat_rtt", seconds)
+
+    def record_latency(self, node, seconds):
+        self._record(node, "latency", seconds)
+
+    def record_failure(self, node):
+        val = self[node]
+        self[node] = val._replace(failure_rate=ewma(val.failure_rate, 1, self.alpha))
+
+    def sort_key(self, node: NodeService):
+        health = self[node]
+
+        return (not health.healthy, health.score)
+
+    def rank(self, nodes: Iterable[NodeService]) -> List[NodeService]:
+        """Sort nodes healthy first, then fastest first."""
+
+        return sorted(nodes, key=self.sort_key)
+
+
 class StaticSeedFinder:
-    def __init__(self, seeds):
+    def __init__(self, seeds, health: Optional[HealthTracker] = None):
         self._seeds = list(seeds)
         self.candidates = []
+        self.health = health
 
     def reset_to_seeds(self):
         self.candidates = list(self._seeds)
         random.shuffle(self.candidates)
 
+        if self.health is not None:
+            # Candidates are taken from the end of the list.
+            self.candidates = self.health.rank(self.candidates)[::-1]
+
     def mark_failed(self, seed):
         self._seeds.remove(seed)
 
@@ -113,19 +281,109 @@ class StaticSeedFinder:
 
         return self.candidates.pop()
 
+    async def sample(self, count):
+        """Take up to `count` distinct seeds, in the order `next` would
+        return them."""
+
+        if not self.candidates:
+            self.reset_to_seeds()
+
+        sample = list(dict.fromkeys(reversed(self.candidates)))[:count]
+        self.candidates = [c for c in self.candidates if c not in sample]
+
+        return sample
+
     def add_node(self, node):
-        self.candidates.append(node)
+        # Gossip names every member each time we refresh it.
+        if node not in self.candidates:
+            self.candidates.append(node)
 
 
 class DnsSeedFinder:
-    def __init__(self, name, resolver, port=2113):
+    """Finds gossip seeds by resolving the A records of a DNS name.
+
+    Answers are cached for their TTL, clamped to between `min_ttl` and
+    `max_ttl` seconds. Once an answer has expired we go on using it while a
+    fresh one is fetched in the background, so a burst of reconnects never
+    waits on, or floods, the resolver. We only wait for DNS when we have
+    never had an answer.
+
+    Each address keeps a failure score, which grows when the address fails
+    and halves whenever a fresh answer arrives. Seeds are offered in order
+    of their score, so failing addresses are tried last rather than never.
+
+    Args:
+        name: The DNS name of the cluster.
+        resolver: The aiodns resolver to query.
+        port (optional): The HTTP port of the seeds.
+        min_ttl (optional): The shortest time, in seconds, to cache an answer.
+        max_ttl (optional): The longest time, in seconds, to cache an answer.
+        health (optional): A HealthTracker used to order seeds with the same
+            failure score, fastest first.
+    """
+
+    def __init__(
+        self,
+        name,
+        resolver,
+        port=2113,
+        min_ttl=1,
+        max_ttl=300,
+        health: Optional[HealthTracker] = None,
+    ):
         self.name = name
         self.resolver = resolver
         self.port = port
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
         self.seeds = []
-        self.failed_node = NodeService("_", 0, None)
+        self.addresses = []
+        self.expires = 0.0
+        self.failures = {}
+        self.health = health
+        self._refresh = None
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
 
     async def reset_to_dns(self):
+        if not self.addresses:
+            await self.resolve()
+        elif self.expired:
+            self.refresh()
+
+        self.seeds = self.rank()
+
+    def rank(self) -> List[NodeService]:
+        seeds = [
+            NodeService(address=address, port=self.port, secure_port=None)
+            for address in self.addresses
+        ]
+        random.shuffle(seeds)
+
+        if self.health is not None:
+            seeds.sort(key=lambda seed: self.health[seed].score)
+        seeds.sort(key=lambda seed: self.failures.get(seed.address, 0))
+
+        return seeds
+
+    def record_answer(self, result):
+        ttl = min(getattr(node, "ttl", self.min_ttl) for node in result)
+        ttl = max(self.min_ttl, min(self.max_ttl, ttl))
+        self.expires = time.monotonic() + ttl
+        self.addresses = list(dict.fromkeys(node.host for node in result))
+        self.failures = {
+            address: score / 2
+            for (address, score) in self.failures.items()
+            if address in self.addresses and score >= 1
+        }
+        LOG.debug(
+            f"Found { len(self.addresses) } hosts for name {self.name}, "
+            f"caching for {ttl}s"
+        )
+
+    async def resolve(self):
         max_attempt = 100
         current_attempt = 0
 
@@ -139,16 +397,9 @@ class DnsSeedFinder:
             )
             try:
                 result = await self.resolver.query(self.name, "A")
-                random.shuffle(result)
 
                 if result:
-                    LOG.debug(f"Found { len(result) } hosts for name {self.name}")
-                    current_attempt = 0
-                    self.seeds = [
-                        NodeService(address=node.host, port=self.port, secure_port=None)
-                        for node in result
-                        if node.host != self.failed_node.address
-                    ]
+                    self.record_answer(result)
 
                     break
             except aiodns.error.DNSError:
@@ -160,10 +411,33 @@ class DnsSeedFinder:
             current_attempt += 1
             await asyncio.sleep(1)
 
+    def refresh(self):
+        """Fetch a fresh answer in the background, unless we already are."""
+
+        if not self._refresh or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._refresh_answer())
+
+    async def _refresh_answer(self):
+        try:
+            result = await self.resolver.query(self.name, "A")
+        except aiodns.error.DNSError:
+            LOG.warning(
+                "Failed to refresh gossip seeds for dns name %s, using cached seeds",
+                self.name,
+                exc_info=True,
+            )
+            result = None
+
+        if result:
+            self.record_answer(result)
+        else:
+            # Keep serving the stale answer, but don't ask again at once.
+            self.expires = time.monotonic() + self.min_ttl
+
     def mark_failed(self, seed):
         if seed in self.seeds:
             self.seeds.remove(seed)
-        self.failed_node = seed
+        self.failures[seed.address] = self.failures.get(seed.address, 0) + 1
 
     async def next(self):
         if not self.seeds:
@@ -174,8 +448,18 @@ class DnsSeedFinder:
 
         return self.seeds[0]
 
+    async def sample(self, count):
+        """Return up to `count` distinct seeds, starting with the one that
+        `next` would return."""
+
+        if not self.seeds:
+            await self.reset_to_dns()
+
+        return list(dict.fromkeys(self.seeds))[:count]
+
     def add_node(self, node):
-        self.seeds.append(node)
+        if node not in self.seeds:
+            self.seeds.append(node)
 
 
 async def fetch_new_gossip(session, seed):
@@ -245,12 +529,41 @@ class Stats(dict):
 
 
 class ClusterDiscovery:
-    def __init__(self, seed_finder, http_session, retry_policy):
+    """Finds the best node in a cluster by asking seed nodes for gossip.
+
+    Up to `fan_out` seeds are queried at once, so that a seed which is down
+    costs us nothing while another one answers. Once the first seed has
+    answered we wait `freshness_window` seconds for the others, then use the
+    freshest gossip received and abandon the remaining requests.
+
+    Args:
+        seed_finder: The StaticSeedFinder or DnsSeedFinder to take seeds from.
+        http_session: The aiohttp session used to fetch gossip.
+        retry_policy: The DiscoveryRetryPolicy that tracks failing seeds.
+        fan_out (optional): The most seeds to query concurrently.
+        freshness_window (optional): How long, in seconds, to wait for
+            fresher gossip after the first answer.
+        health (optional): The HealthTracker that records how quickly each
+            seed answers. Connectors using this discovery share it.
+    """
+
+    def __init__(
+        self,
+        seed_finder,
+        http_session,
+        retry_policy,
+        fan_out: int = 3,
+        freshness_window: float = 0.1,
+        health: Optional[HealthTracker] = None,
+    ):
         self.session = http_session
         self.seeds = seed_finder
         self.last_gossip = []
         self.best_node = None
         self.retry_policy = retry_policy
+        self.fan_out = fan_out
+        self.freshness_window = freshness_window
+        self.health = HealthTracker() if health is None else health
 
     def close(self):
         self.session.close()
@@ -266,27 +579,90 @@ class ClusterDiscovery:
         self.best_node = select(gossip)
         self.retry_policy.record_success(node)
 
+    def record_failure(self, seed):
+        self.health.record_failure(seed)
+        self.retry_policy.record_failure(seed)
+
+        # A sick seed is tried last, but we only drop it once it has used up
+        # its retries, or we could drop every seed we were configured with.
+        if self.retry_policy.exhausted(seed):
+            self.seeds.mark_failed(seed)
+
     async def get_gossip(self):
         while True:
 
-            seed = await self.seeds.next()
-            LOG.info(f"Found gossip seed {seed}")
+            seeds = await self.seeds.sample(self.fan_out)
+            LOG.info(f"Found gossip seeds {seeds}")
 
-            if not seed:
+            if not seeds:
                 raise DiscoveryFailed()
 
-            await self.retry_policy.wait(seed)
-            gossip = await fetch_new_gossip(self.session, seed)
+            answer = await self.query_seeds(seeds)
 
-            if gossip:
+            if answer:
+                seed, gossip = answer
                 self.record_gossip(seed, gossip)
 
                 return gossip
-            else:
-                self.retry_policy.record_failure(seed)
 
-                if not self.retry_policy.should_retry(seed):
-                    self.seeds.mark_failed(seed)
+    async def query_seeds(self, seeds):
+        """Ask several seeds for gossip at once.
+
+        Returns:
+            The seed with the freshest gossip and its gossip, or None if no
+            seed answered.
+        """
+        loop = asyncio.get_event_loop()
+        pending = {asyncio.ensure_future(self._query(seed)): seed for seed in seeds}
+        answers = []
+        deadline = None
+
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0, deadline - loop.time())
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    break
+
+                for task in done:
+                    seed = pending.pop(task)
+                    exn = task.exception()
+
+                    if exn and not isinstance(exn, (asyncio.TimeoutError, OSError)):
+                        raise exn
+
+                    if exn:
+                        LOG.warning("Failed loading gossip from %s: %r", seed, exn)
+                    elif task.result():
+                        answers.append((seed, task.result()))
+
+                        continue
+
+                    self.record_failure(seed)
+
+                if answers and deadline is None:
+                    deadline = loop.time() + self.freshness_window
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if not answers:
+            return None
+
+        return max(answers, key=lambda answer: gossip_freshness(answer[1]))
+
+    async def _query(self, seed):
+        await self.retry_policy.wait(seed)
+        started = time.monotonic()
+        gossip = await fetch_new_gossip(self.session, seed)
+
+        if gossip:
+            self.health.record_latency(seed, time.monotonic() - started)
+
+        return gossip
 
     async def discover(self):
         gossip = await self.get_gossip()
@@ -297,6 +673,74 @@ class ClusterDiscovery:
         raise DiscoveryFailed()
 
 
+class GossipMonitor:
+    """Refreshes cluster gossip in the background, and reports when the
+    master moves.
+
+    This lets us connect to a new master as soon as the cluster elects it,
+    rather than waiting for the old connection to fail.
+
+    Args:
+        discovery: The ClusterDiscovery whose gossip we refresh.
+        interval (optional): The time, in seconds, between refreshes.
+        on_master_changed (optional): Called with the external TCP address
+            of the master whenever it differs from the last one reported.
+        on_gossip (optional): Called with the members of the cluster after
+            every successful refresh.
+    """
+
+    def __init__(
+        self,
+        discovery: ClusterDiscovery,
+        interval: float = 5,
+        on_master_changed: Optional[Callable[[NodeService], None]] = None,
+        on_gossip: Optional[Callable[[List[DiscoveredNode]], None]] = None,
+    ):
+        self.discovery = discovery
+        self.interval = interval
+        self.on_master_changed = on_master_changed
+        self.on_gossip = on_gossip
+        self.master = None
+        self._task = None
+
+    async def refresh(self) -> None:
+        try:
+            gossip = await self.discovery.get_gossip()
+        except Exception:
+            LOG.warning("Failed to refresh gossip", exc_info=True)
+
+            return
+
+        if self.on_gossip:
+            self.on_gossip(gossip)
+
+        node = self.discovery.best_node
+
+        if not node or node.state != NodeState.Master:
+            return
+
+        if node.external_tcp != self.master:
+            LOG.info("Gossip reports master at %s", node.external_tcp)
+            self.master = node.external_tcp
+
+            if self.on_master_changed:
+                self.on_master_changed(node.external_tcp)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    def start(self) -> None:
+        if not self._task:
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
 class DiscoveryRetryPolicy:
     def __init__(
         self,
@@ -305,8 +749,10 @@ class DiscoveryRetryPolicy:
         jitter=0.5,
         multiplier=1.5,
         max_interval=60,
+        health: Optional[HealthTracker] = None,
     ):
         self.stats = Stats()
+        self.health = health
         self.retries_per_node = retries_per_node
         self.retry_interval = retry_interval
         self.jitter = jitter
@@ -314,10 +760,18 @@ class DiscoveryRetryPolicy:
         self.max_interval = max_interval
         self.next_interval = self.retry_interval
 
+    def exhausted(self, node):
+        """True once the node has failed `retries_per_node` times running."""
+
+        return self.stats[node].consecutive_failures >= self.retries_per_node
+
     def should_retry(self, node):
-        stats = self.stats[node]
+        if self.health is not None and not self.health[node].healthy:
+            LOG.info("Node %s is failing too often, giving up on it", node)
+
+            return False
 
-        return stats.consecutive_failures < self.retries_per_node
+        return not self.exhausted(node)
 
     async def wait(self, seed):
         stats = self.stats[seed]
@@ -328,6 +782,10 @@ class DiscoveryRetryPolicy:
         next_interval = (
             self.retry_interval * self.multiplier * stats.consecutive_failures
         )
+
+        if self.health is not None:
+            # Back off further from nodes that have been failing for a while.
+            next_interval *= 1 + self.health[seed].failure_rate
         maxinterval = next_interval + self.jitter
         mininterval = next_interval - self.jitter
         interval = random.uniform(mininterval, maxinterval)
@@ -350,21 +808,26 @@ def get_discoverer(host, port, discovery_host, discovery_port):
         return SingleNodeDiscovery(NodeService(host or "localhost", port, None))
 
     session = aiohttp.ClientSession()
+    health = HealthTracker()
     try:
         socket.inet_aton(discovery_host)
         LOG.info("Using cluster node discovery with a static seed")
 
         return ClusterDiscovery(
-            StaticSeedFinder([NodeService(discovery_host, discovery_port, None)]),
+            StaticSeedFinder(
+                [NodeService(discovery_host, discovery_port, None)], health=health
+            ),
             session,
-            DiscoveryRetryPolicy(),
+            DiscoveryRetryPolicy(health=health),
+            health=health,
         )
     except socket.error:
         LOG.info("Using cluster node discovery with DNS")
         resolver = aiodns.DNSResolver()
 
         return ClusterDiscovery(
-            DnsSeedFinder(discovery_host, resolver, discovery_port),
+            DnsSeedFinder(discovery_host, resolver, discovery_port, health=health),
             session,
-            DiscoveryRetryPolicy(),
+            DiscoveryRetryPolicy(health=health),
+            health=health,
         )
@@ -89,8 +89,9 @@ class TooBusy(ConversationException):
 
 
 class NotMaster(ConversationException):
-    def __init__(self, conversation_id):
+    def __init__(self, conversation_id, master=None):
         super().__init__(conversation_id, "Message not handled: Must be sent to master")
+        self.master = master
 
 
 class NotHandled(ConversationException):
@@ -98,6 +99,30 @@ class NotHandled(ConversationException):
         super().__init__(conversation_id, "Message not handled: Unknown reason code.")
 
 
+class OperationFailed(ConversationException):
+    def __init__(self, conversation_id, result, message=None):
+        super().__init__(
+            conversation_id, "Operation failed with result %s %s" % (result, message)
+        )
+        self.result = result
+
+
+class WrongExpectedVersion(OperationFailed):
+    pass
+
+
+class WriteAborted(ConversationException):
+    def __init__(self, conversation_id, cause):
+        super().__init__(
+            conversation_id, "Aborted after write %s failed" % conversation_id
+        )
+        self.cause = cause
+
+
+class ConnectionClosed(ConversationException):
+    pass
+
+
 class PayloadUnreadable(ConversationException):
     def __init__(self, conversation_id, payload, exn):
         self.payload = payload
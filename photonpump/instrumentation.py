@@ -0,0 +1,38 @@
+import logging
+
+from . import messages as msg
+
+
+class LogLevels:
+    """The levels enabled on a logger, as plain attributes.
+
+    Code that runs once per frame checks these before it logs, so that a
+    disabled log call costs one attribute lookup instead of a method call,
+    a level check and the building of its arguments. Levels are read when
+    the object is created, which for readers and writers is once per
+    connection; call `refresh` to pick up a change sooner.
+    """
+
+    __slots__ = ("logger", "debug", "trace", "insane")
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.logger = logger
+        self.refresh()
+
+    def refresh(self) -> None:
+        self.debug = self.logger.isEnabledFor(logging.DEBUG)
+        self.trace = self.logger.isEnabledFor(logging.TRACE)
+        self.insane = self.logger.isEnabledFor(logging.INSANE)
+
+
+class Dump:
+    """A hex dump of some bytes that is only produced if it's formatted,
+    eg. by a log record that is actually emitted."""
+
+    __slots__ = ("chunks",)
+
+    def __init__(self, *chunks: bytes) -> None:
+        self.chunks = chunks
+
+    def __str__(self):
+        return msg.dump(*self.chunks)
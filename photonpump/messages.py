@@ -4,7 +4,7 @@ import math
 import struct
 from collections import namedtuple
 from enum import IntEnum
-from typing import Any, Dict, Sequence
+from typing import Any, Dict, NamedTuple, Sequence
 from uuid import UUID, uuid4
 
 from . import messages_pb2
@@ -36,6 +36,13 @@ class TcpCommand(IntEnum):
     WriteEvents = 0x82
     WriteEventsCompleted = 0x83
 
+    TransactionStart = 0x84
+    TransactionStartCompleted = 0x85
+    TransactionWrite = 0x86
+    TransactionWriteCompleted = 0x87
+    TransactionCommit = 0x88
+    TransactionCommitCompleted = 0x89
+
     Read = 0xB0
     ReadEventCompleted = 0xB1
     ReadStreamEventsForward = 0xB2
@@ -50,6 +57,7 @@ class TcpCommand(IntEnum):
     SubscribeToStream = 0xC0
     SubscriptionConfirmation = 0xC1
     StreamEventAppeared = 0xC2
+    UnsubscribeFromStream = 0xC3
     SubscriptionDropped = 0xC4
 
     ConnectToPersistentSubscription = 0xC5
@@ -88,6 +96,20 @@ class OperationFlags(IntEnum):
     Authenticated = 0x01
 
 
+class Priority(IntEnum):
+    """The lane a message takes through a connection's outbound queue.
+
+    Control frames, such as heartbeats, and acks are always written first.
+    Interactive and Bulk messages share the rest of the connection, with
+    interactive messages getting the larger share.
+    """
+
+    Control = 0
+    Ack = 1
+    Interactive = 2
+    Bulk = 3
+
+
 OperationResult = make_enum(messages_pb2._OPERATIONRESULT)
 NotHandledReason = make_enum(messages_pb2._NOTHANDLED_NOTHANDLEDREASON)
 SubscriptionDropReason = make_enum(
@@ -284,10 +306,36 @@ def _json(self):
 EventRecord.json = _json
 
 
+class Position(NamedTuple):
+    """A position in the $all stream.
+
+    Positions are plain pairs of integers so they can be persisted and
+    passed back to :meth:`~photonpump.Client.iter_all` to resume a read.
+
+    Attributes:
+        commit: The commit position in the transaction log.
+        prepare: The prepare position in the transaction log.
+    """
+
+    commit: int
+    prepare: int
+
+    @classmethod
+    def min(cls) -> "Position":
+        return cls(0, 0)
+
+    @classmethod
+    def max(cls) -> "Position":
+        return cls(-1, -1)
+
+
 class Event:
-    def __init__(self, event: EventRecord, link: EventRecord) -> None:
+    def __init__(
+        self, event: EventRecord, link: EventRecord, position: Position = None
+    ) -> None:
         self.event = event
         self.link = link
+        self.position = position
 
     @property
     def original_event(self) -> EventRecord:
@@ -317,6 +365,21 @@ class StreamSlice(list):
         self.events = events
 
 
+class AllStreamSlice(list):
+    def __init__(
+        self,
+        events: Sequence[Event],
+        position: Position,
+        next_position: Position,
+        is_end_of_stream: bool = False,
+    ) -> None:
+        super().__init__(events)
+        self.position = position
+        self.next_position = next_position
+        self.is_end_of_stream = is_end_of_stream
+        self.events = events
+
+
 def dump(*chunks: bytearray):
     data = bytearray()
 
@@ -337,7 +400,7 @@ def dump(*chunks: bytearray):
     return "\n" + "\n".join(dump)
 
 
-def _make_event(record: messages_pb2.ResolvedEvent):
+def _make_event(record: messages_pb2.ResolvedEvent, position: Position = None):
 
     link = (
         EventRecord(
@@ -363,7 +426,13 @@ def _make_event(record: messages_pb2.ResolvedEvent):
         datetime.datetime.fromtimestamp(record.event.created_epoch / 1e3),
     )
 
-    return Event(event, link)
+    return Event(event, link, position)
+
+
+def _make_all_event(record: messages_pb2.ResolvedEvent):
+    return _make_event(
+        record, Position(record.commit_position, record.prepare_position)
+    )
 
 
 def NewEvent(
@@ -387,6 +456,8 @@ ReadEventResult = make_enum(messages_pb2._READEVENTCOMPLETED_READEVENTRESULT)
 
 ReadStreamResult = make_enum(messages_pb2._READSTREAMEVENTSCOMPLETED_READSTREAMRESULT)
 
+ReadAllResult = make_enum(messages_pb2._READALLEVENTSCOMPLETED_READALLRESULT)
+
 SubscriptionResult = make_enum(
     messages_pb2._CREATEPERSISTENTSUBSCRIPTIONCOMPLETED_CREATEPERSISTENTSUBSCRIPTIONRESULT
 )
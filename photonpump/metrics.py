@@ -0,0 +1,218 @@
+import bisect
+import math
+from typing import Dict, List, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+class Histogram:
+    """Counts observations in buckets with fixed upper bounds.
+
+    Observing a value is a binary search and an increment, so a histogram
+    is cheap enough to feed from every heartbeat or request. Quantiles are
+    estimated by interpolating within the bucket that holds them.
+
+    Args:
+        buckets (optional): The upper bound of each bucket, in ascending
+            order. A final bucket for everything larger is always added.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.bounds: List[float] = list(buckets) + [math.inf]
+        self.counts: List[int] = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate the value below which a fraction `q` of observations
+        fall, or NaN if nothing has been observed."""
+
+        if not self.count:
+            return math.nan
+
+        rank = q * self.count
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index]
+
+                if upper == math.inf:
+                    return lower
+
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+
+        return self.bounds[-2]
+
+
+class Metrics:
+    """The interface that photonpump reports its counters, gauges and
+    histograms into.
+
+    This base class discards everything, and is what the client uses unless
+    given something else. Code on the hot path checks `enabled` before
+    working out what to report, so disabled metrics cost an attribute
+    lookup.
+
+    Labels are given as a tuple of (name, value) pairs, eg.
+    `(("command", "WriteEvents"),)`.
+    """
+
+    enabled = False
+
+    def inc(self, name: str, value: float = 1, labels: Labels = ()) -> None:
+        """Add `value` to a counter."""
+
+    def add(self, name: str, value: float, labels: Labels = ()) -> None:
+        """Add `value`, which may be negative, to a gauge."""
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        """Record an observation in a histogram."""
+
+
+NULL_METRICS = Metrics()
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+
+    if not pairs:
+        return ""
+
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for (name, value) in pairs
+    )
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry(Metrics):
+    """Keeps metrics in memory and renders them in the Prometheus text
+    exposition format.
+
+    Examples:
+        The rendered text can be served from any HTTP endpoint.
+
+        >>> metrics = Registry()
+        >>> client = connect(metrics=metrics)
+        >>> ...
+        >>> body = metrics.render()
+
+    Args:
+        prefix (optional): Prepended to the name of every metric, defaults
+            to "photonpump_".
+        buckets (optional): The bucket bounds for new histograms.
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        prefix: str = "photonpump_",
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, labels: Labels = ()) -> None:
+        series = self.counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def add(self, name: str, value: float, labels: Labels = ()) -> None:
+        series = self.gauges.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        series = self.histograms.setdefault(name, {})
+        histogram = series.get(labels)
+
+        if histogram is None:
+            histogram = series[labels] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def value(self, name: str, labels: Labels = ()) -> float:
+        """The current value of a counter or gauge, or 0 if it hasn't been
+        reported."""
+
+        for kind in (self.counters, self.gauges):
+            if name in kind:
+                return kind[name].get(labels, 0)
+
+        return 0
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format, version 0.0.4."""
+
+        lines = []
+
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted(metrics):
+                full_name = self.prefix + name
+                lines.append("# TYPE %s %s" % (full_name, kind))
+
+                for labels, value in sorted(metrics[name].items()):
+                    lines.append(
+                        "%s%s %s"
+                        % (full_name, _format_labels(labels), _format_value(value))
+                    )
+
+        for name in sorted(self.histograms):
+            full_name = self.prefix + name
+            lines.append("# TYPE %s histogram" % full_name)
+
+            for labels, histogram in sorted(self.histograms[name].items()):
+                cumulative = 0
+
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        "%s_bucket%s %d"
+                        % (
+                            full_name,
+                            _format_labels(labels, (("le", _format_value(bound)),)),
+                            cumulative,
+                        )
+                    )
+                lines.append(
+                    "%s_sum%s %s"
+                    % (full_name, _format_labels(labels), _format_value(histogram.sum))
+                )
+                lines.append(
+                    "%s_count%s %d"
+                    % (full_name, _format_labels(labels), histogram.count)
+                )
+
+        return "\n".join(lines) + "\n"
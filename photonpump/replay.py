@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import struct
+import time
+import uuid
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from . import conversations as convo
+from . import messages_pb2 as proto
+from .capture import AUTHENTICATED, LOGIN_OFFSET, CapturedChunk, Direction
+from .connection import MessageDispatcher, MessageReader, OutboundQueue, PaceMaker
+from .messages import Position, StreamDirection, TcpCommand
+
+LOG = logging.getLogger("photonpump.replay")
+
+HEAD = struct.Struct("<IBB")
+
+
+class ReplayStats(NamedTuple):
+    """What a replay did.
+
+    Attributes:
+        chunks: The number of inbound chunks read.
+        bytes: The number of inbound bytes read.
+        frames: The number of inbound frames dispatched to conversations.
+        requests: The number of conversations rebuilt from outbound frames.
+        elapsed: The time taken by the replay, in seconds.
+    """
+
+    chunks: int
+    bytes: int
+    frames: int
+    requests: int
+    elapsed: float
+
+
+def _read_event(conversation_id, body):
+    request = proto.ReadEvent()
+    request.ParseFromString(body)
+
+    return convo.ReadEvent(
+        request.event_stream_id,
+        request.event_number,
+        request.resolve_link_tos,
+        conversation_id=conversation_id,
+    )
+
+
+def _read_stream(direction):
+    def build(conversation_id, body):
+        request = proto.ReadStreamEvents()
+        request.ParseFromString(body)
+
+        return convo.ReadStreamEvents(
+            request.event_stream_id,
+            request.from_event_number,
+            request.max_count,
+            request.resolve_link_tos,
+            direction=direction,
+            conversation_id=conversation_id,
+        )
+
+    return build
+
+
+def _read_all(direction):
+    def build(conversation_id, body):
+        request = proto.ReadAllEvents()
+        request.ParseFromString(body)
+
+        return convo.ReadAllEvents(
+            Position(request.commit_position, request.prepare_position),
+            request.max_count,
+            request.resolve_link_tos,
+            direction=direction,
+            conversation_id=conversation_id,
+        )
+
+    return build
+
+
+def _write_events(conversation_id, body):
+    request = proto.WriteEvents()
+    request.ParseFromString(body)
+
+    return convo.WriteEvents(
+        request.event_stream_id,
+        list(request.events),
+        request.expected_version,
+        conversation_id=conversation_id,
+    )
+
+
+def _subscribe(conversation_id, body):
+    request = proto.SubscribeToStream()
+    request.ParseFromString(body)
+
+    return convo.SubscribeToStream(
+        request.event_stream_id,
+        request.resolve_link_tos,
+        conversation_id=conversation_id,
+    )
+
+
+def _connect_persistent(conversation_id, body):
+    request = proto.ConnectToPersistentSubscription()
+    request.ParseFromString(body)
+
+    return convo.ConnectPersistentSubscription(
+        request.subscription_id,
+        request.event_stream_id,
+        request.allowed_in_flight_messages,
+        conversation_id=conversation_id,
+    )
+
+
+#: How to rebuild a conversation from the request that started it. Requests
+#: without an entry, eg. acks, don't start a conversation, and replies to
+#: them are dropped by the dispatcher as they would be in a live client.
+REQUESTS = {
+    TcpCommand.Ping: lambda conversation_id, _: convo.Ping(conversation_id),
+    TcpCommand.Read: _read_event,
+    TcpCommand.ReadStreamEventsForward: _read_stream(StreamDirection.Forward),
+    TcpCommand.ReadStreamEventsBackward: _read_stream(StreamDirection.Backward),
+    TcpCommand.ReadAllEventsForward: _read_all(StreamDirection.Forward),
+    TcpCommand.ReadAllEventsBackward: _read_all(StreamDirection.Backward),
+    TcpCommand.WriteEvents: _write_events,
+    TcpCommand.SubscribeToStream: _subscribe,
+    TcpCommand.ConnectToPersistentSubscription: _connect_persistent,
+}
+
+
+def rebuild_conversation(frame: bytes) -> Optional[convo.Conversation]:
+    """Build the conversation that would have sent an outbound frame, or None
+    if the frame doesn't start a conversation that we know of."""
+
+    _, command, flags = HEAD.unpack_from(frame)
+    build = REQUESTS.get(command)
+
+    if build is None:
+        return None
+
+    conversation_id = uuid.UUID(bytes_le=bytes(frame[6:22]))
+    offset = LOGIN_OFFSET
+
+    if flags & AUTHENTICATED:
+        offset += 1 + frame[offset]
+        offset += 1 + frame[offset]
+
+    return build(conversation_id, bytes(frame[offset:]))
+
+
+async def replay(
+    chunks: Iterable[CapturedChunk],
+    speed: Optional[float] = None,
+    dispatcher: Optional[MessageDispatcher] = None,
+) -> ReplayStats:
+    """Feed captured traffic through the client's read and dispatch path.
+
+    Each outbound frame that starts a conversation is rebuilt as that
+    conversation and started on the dispatcher, and each inbound chunk is
+    parsed by a MessageReader for its connection and dispatched. Nothing
+    touches the network, so a replay can be profiled to see what parsing
+    and dispatching real traffic costs.
+
+    Examples:
+        >>> chunks = read_capture(*capture_files("/tmp/traffic.ppcap"))
+        >>> stats = await replay(chunks)
+        >>> print(stats.frames / stats.elapsed, "frames/s")
+
+    Args:
+        chunks: The captured traffic, eg. from `read_capture`.
+        speed (optional): If None, the default, replay as fast as possible.
+            Otherwise, keep to the recorded timing, sped up by this factor,
+            eg. 1 for real time or 10 for ten times as fast.
+        dispatcher (optional): The MessageDispatcher to replay through,
+            eg. one with a Tracer or metrics.
+    """
+
+    dispatcher = dispatcher or MessageDispatcher()
+    output = OutboundQueue()
+    await dispatcher.write_to(output)
+    pacemaker = PaceMaker(output, None)
+    inbound = asyncio.Queue()
+    readers: Dict[int, MessageReader] = {}
+    count, size, frames, requests = (0, 0, 0, 0)
+    first = None
+    started = time.perf_counter()
+
+    for chunk in chunks:
+        if speed is not None:
+            if first is None:
+                first = chunk.timestamp
+            delay = (chunk.timestamp - first) / speed - (time.perf_counter() - started)
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if chunk.direction == Direction.Outbound:
+            conversation = rebuild_conversation(chunk.data)
+
+            if conversation is not None:
+                requests += 1
+                await dispatcher.start_conversation(conversation)
+        else:
+            reader = readers.get(chunk.connection)
+
+            if reader is None:
+                reader = readers[chunk.connection] = MessageReader(
+                    None, chunk.connection, inbound, pacemaker
+                )
+
+            count += 1
+            size += len(chunk.data)
+            await reader.process(chunk.data)
+
+            while not inbound.empty():
+                frames += 1
+                await dispatcher.dispatch(inbound.get_nowait(), output)
+
+        # Requests and heartbeat responses are discarded.
+        while not output.empty():
+            output.get_nowait()
+
+    return ReplayStats(count, size, frames, requests, time.perf_counter() - started)
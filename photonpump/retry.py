@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+LOG = logging.getLogger("photonpump.retry")
+
+
+def backoff_delay(
+    attempt: int, base: float = 0.05, multiplier: float = 2, maximum: float = 2
+) -> float:
+    """Choose how long to wait before a retry, with "full jitter".
+
+    The delay is drawn uniformly from zero up to an exponentially growing
+    ceiling, so that clients that were refused at the same moment don't
+    all come back at the same moment.
+    """
+
+    return random.uniform(0, min(maximum, base * pow(multiplier, attempt)))
+
+
+class RetryBudget:
+    """Limits retries to a fraction of recent requests.
+
+    Each request deposits `ratio` of a retry, and each retry withdraws a
+    whole one. A trickle of `min_per_second` retries is always allowed, so
+    that a quiet client can still retry. While the server is overloaded
+    this caps the extra load that retries add at `ratio` of the traffic.
+
+    Args:
+        ratio (optional): The number of retries earned by each request.
+        min_per_second (optional): The rate of retries allowed regardless
+            of traffic.
+        max_balance (optional): The most retries that can be saved up.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=10, max_balance=100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = 0.0
+        self.updated = time.monotonic()
+
+    def deposit(self) -> None:
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self.balance = min(
+            self.max_balance, self.balance + (now - self.updated) * self.min_per_second
+        )
+        self.updated = now
+
+        if self.balance < 1:
+            return False
+
+        self.balance -= 1
+
+        return True
+
+
+class RetryPolicy:
+    """Decides whether, and when, to retry a conversation that the server
+    was too busy or not ready to handle.
+
+    Args:
+        max_attempts (optional): The most retries for one conversation.
+        base_delay (optional): The ceiling of the first backoff, in seconds.
+        max_delay (optional): The largest backoff ceiling, in seconds.
+        budget (optional): The RetryBudget shared by all conversations.
+    """
+
+    def __init__(
+        self,
+        max_attempts=5,
+        base_delay=0.05,
+        max_delay=2.0,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+
+    def record_request(self) -> None:
+        self.budget.deposit()
+
+    def next_delay(self, attempt: int) -> Optional[float]:
+        """Returns the delay before retry number `attempt`, counting from
+        zero, or None if we shouldn't retry."""
+
+        if attempt >= self.max_attempts or not self.budget.withdraw():
+            return None
+
+        return backoff_delay(attempt, self.base_delay, maximum=self.max_delay)
+
+
+class AimdLimiter:
+    """An additive-increase, multiplicative-decrease limit on the number of
+    conversations waiting for the server.
+
+    Every successful reply grows the limit by about one per window of
+    replies; every reply saying the server is busy shrinks it by
+    `decrease`, at most once per `cooldown` seconds so that a burst of
+    refusals for one window only counts once.
+
+    Args:
+        initial (optional): The starting limit.
+        minimum (optional): The smallest limit.
+        maximum (optional): The largest limit.
+        decrease (optional): The factor applied to the limit when the
+            server is busy.
+        cooldown (optional): The shortest time between decreases.
+    """
+
+    def __init__(self, initial=64, minimum=1, maximum=1024, decrease=0.5, cooldown=0.1):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._available = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._available:
+            while self.in_flight >= int(self.limit):
+                await self._available.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._available:
+            self._available.notify_all()
+
+    def record_success(self) -> None:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def record_overload(self) -> None:
+        now = time.monotonic()
+
+        if now - self.last_decrease < self.cooldown:
+            return
+
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        LOG.info("Server is busy, limiting to %d conversations", self.limit)
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import zlib
+from enum import IntEnum
+from typing import Callable, List, NamedTuple, Optional, Sequence
+
+from . import conversations as convo
+from .discovery import (
+    DiscoveredNode,
+    NodeService,
+    SingleNodeDiscovery,
+    select_followers,
+)
+
+LOG = logging.getLogger("photonpump.routing")
+
+
+class ConnectionStats(NamedTuple):
+    """A snapshot of one pooled connection.
+
+    Attributes:
+        index: The position of the connection in the pool.
+        connected: True if the connection is currently open.
+        active_conversations: The number of conversations awaiting a reply.
+        queue_depth: The number of messages waiting to be written.
+    """
+
+    index: int
+    connected: bool
+    active_conversations: int
+    queue_depth: int
+
+
+class PooledConnection:
+    """A Connector and the MessageDispatcher that it feeds."""
+
+    def __init__(self, index: int, connector, dispatcher):
+        self.index = index
+        self.connector = connector
+        self.dispatcher = dispatcher
+        self.node: Optional[NodeService] = None
+        self.connected = False
+        connector.connected.append(self._on_connected)
+        connector.disconnected.append(self._on_disconnected)
+
+    def _on_connected(self, *args):
+        self.connected = True
+
+    def _on_disconnected(self, *args):
+        self.connected = False
+
+    @property
+    def queue_depth(self) -> int:
+        output = self.dispatcher.output
+
+        return output.qsize() if output else 0
+
+    @property
+    def load(self) -> int:
+        return len(self.dispatcher.active_conversations) + self.queue_depth
+
+    def stats(self) -> ConnectionStats:
+        return ConnectionStats(
+            self.index,
+            self.connected,
+            len(self.dispatcher.active_conversations),
+            self.queue_depth,
+        )
+
+
+def stream_affinity(stream: str, size: int) -> int:
+    """Choose the connection for a stream.
+
+    We use crc32 rather than `hash` so that the choice is stable across
+    processes, which makes traces from different clients comparable.
+    """
+
+    return zlib.crc32(stream.encode("UTF-8")) % size
+
+
+class ConnectionPool:
+    """Spreads conversations over several connections to the same node.
+
+    Conversations that must stay in order, such as writes and subscriptions,
+    always use the connection chosen by hashing their stream name, so that
+    their relative order is preserved. Everything else goes to the
+    connected connection with the fewest active conversations and queued
+    messages.
+
+    The pool has the same `start`, `stop` and `start_conversation` methods
+    as a Connector and MessageDispatcher, so a Client can use it for both.
+
+    Args:
+        discovery: The discovery used to choose the node for the pool.
+        connections: The connections to pool.
+    """
+
+    def __init__(self, discovery, connections: Sequence[PooledConnection]):
+        self.discovery = discovery
+        self.connections = list(connections)
+        self.node: Optional[NodeService] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.connections)
+
+    @property
+    def active_conversations(self):
+        active = {}
+
+        for connection in self.connections:
+            active.update(connection.dispatcher.active_conversations)
+
+        return active
+
+    def stats(self) -> List[ConnectionStats]:
+        """Report the health and load of each connection."""
+
+        return [connection.stats() for connection in self.connections]
+
+    def route(self, conversation: convo.Conversation) -> PooledConnection:
+        """Choose the connection for a conversation."""
+
+        stream = getattr(conversation, "stream", None)
+
+        if conversation.ordered and stream is not None:
+            return self.connections[stream_affinity(stream, self.size)]
+
+        candidates = [c for c in self.connections if c.connected] or self.connections
+
+        return min(candidates, key=lambda c: c.load)
+
+    async def start_conversation(
+        self, conversation: convo.Conversation
+    ) -> asyncio.Future:
+        connection = self.route(conversation)
+        LOG.debug("Routing %s to connection %d", conversation, connection.index)
+
+        return await connection.dispatcher.start_conversation(conversation)
+
+    async def start(self, target: Optional[NodeService] = None) -> None:
+        # Discover once, so that every connection goes to the same node.
+        self.node = target or await self.discovery.discover()
+        LOG.info("Opening %d connections to %s", self.size, self.node)
+
+        for connection in self.connections:
+            await connection.connector.start(target=self.node)
+
+    async def stop(self, exn=None) -> None:
+        for connection in self.connections:
+            await connection.connector.stop(exn)
+
+
+class ReadPreference(IntEnum):
+    """Where a ClusterRouter sends reads that don't require the master.
+
+    Master sends every read to the master. Follower sends reads to the least
+    busy follower, falling back to the master when no follower is
+    connected. LeastLoaded sends reads to the least busy node, master
+    included.
+    """
+
+    Master = 0
+    Follower = 1
+    LeastLoaded = 2
+
+
+def is_follower_read(conversation: convo.Conversation) -> bool:
+    """True if a conversation may be served by a follower."""
+
+    return not conversation.ordered and (
+        getattr(conversation, "require_master", True) is False
+    )
+
+
+class ClusterRouter:
+    """Sends writes to the master of a cluster and spreads reads over its
+    followers.
+
+    On start we discover the master and connect to it, then connect to up
+    to `max_followers` of the slaves and clones named in the gossip. Writes,
+    subscriptions and anything with `require_master=True` always go to the
+    master. Other reads are routed by `read_preference`. Followers apply
+    writes asynchronously, so a read from a follower may not see a write
+    that the master has just acknowledged.
+
+    The followers are chosen again whenever the master connection
+    reconnects, and whenever `gossip_received` is given fresh gossip, eg. by
+    a GossipMonitor, so that reads follow failovers and membership changes.
+
+    The router has the same `start`, `stop` and `start_conversation` methods
+    as a Connector and MessageDispatcher, so a Client can use it for both.
+
+    Args:
+        discovery: The ClusterDiscovery used to find the master. The
+            master connection keeps using it to follow elections.
+        connection_factory: A callable that builds a PooledConnection from
+            an index and a discovery.
+        read_preference (optional): Where to send reads that don't
+            require the master.
+        max_followers (optional): The most follower connections to open.
+    """
+
+    def __init__(
+        self,
+        discovery,
+        connection_factory: Callable[[int, object], PooledConnection],
+        read_preference: ReadPreference = ReadPreference.Follower,
+        max_followers: int = 2,
+    ):
+        self.discovery = discovery
+        self.connection_factory = connection_factory
+        self.read_preference = read_preference
+        self.max_followers = max_followers
+        self.master = connection_factory(0, discovery)
+        self.followers: List[PooledConnection] = []
+        self._next_index = 1
+        self._refreshing = asyncio.Lock()
+        self.master.connector.connected.append(self._on_master_connected)
+
+    @property
+    def connections(self) -> List[PooledConnection]:
+        return [self.master] + self.followers
+
+    @property
+    def active_conversations(self):
+        active = {}
+
+        for connection in self.connections:
+            active.update(connection.dispatcher.active_conversations)
+
+        return active
+
+    def stats(self) -> List[ConnectionStats]:
+        """Report the health and load of each connection, master first."""
+
+        return [connection.stats() for connection in self.connections]
+
+    def route(self, conversation: convo.Conversation) -> PooledConnection:
+        """Choose the connection for a conversation."""
+
+        if self.read_preference == ReadPreference.Master or not is_follower_read(
+            conversation
+        ):
+            return self.master
+
+        candidates = [c for c in self.followers if c.connected]
+
+        if self.read_preference == ReadPreference.LeastLoaded:
+            candidates.append(self.master)
+
+        if not candidates:
+            return self.master
+
+        return min(candidates, key=lambda c: c.load)
+
+    async def start_conversation(
+        self, conversation: convo.Conversation
+    ) -> asyncio.Future:
+        connection = self.route(conversation)
+        LOG.debug("Routing %s to connection %d", conversation, connection.index)
+
+        return await connection.dispatcher.start_conversation(conversation)
+
+    async def start(self, target: Optional[NodeService] = None) -> None:
+        master_node = target or await self.discovery.discover()
+        await self.master.connector.start(target=master_node)
+        await self.refresh_followers(getattr(self.discovery, "last_gossip", []))
+
+    def gossip_received(self, gossip: List[DiscoveredNode]) -> None:
+        """Choose the followers again from fresh gossip."""
+
+        asyncio.ensure_future(self.refresh_followers(gossip))
+
+    def _on_master_connected(self, *args):
+        # After a failover, discovery has just fetched fresh gossip.
+        self.gossip_received(getattr(self.discovery, "last_gossip", []))
+
+    async def refresh_followers(self, gossip: List[DiscoveredNode]) -> None:
+        """Connect to the followers named in the gossip, and close the
+        connections to nodes that aren't followers any more, because they
+        were elected master or have left the cluster. Reads that were in
+        flight on a closed connection are routed again."""
+
+        if self.read_preference == ReadPreference.Master or not gossip:
+            return
+
+        async with self._refreshing:
+            followers = select_followers(
+                gossip, getattr(self.discovery, "health", None)
+            )
+            wanted = [node.external_tcp for node in followers[: self.max_followers]]
+
+            for follower in list(self.followers):
+                if follower.node not in wanted:
+                    await self._retire(follower)
+
+            current = [follower.node for follower in self.followers]
+
+            for node in followers[: self.max_followers]:
+                if node.external_tcp not in current:
+                    await self._add_follower(node)
+
+    async def _add_follower(self, node: DiscoveredNode) -> None:
+        address = node.external_tcp
+        LOG.info("Connecting to follower %s in state %s", address, node.state)
+        follower = self.connection_factory(
+            self._next_index, SingleNodeDiscovery(address)
+        )
+        follower.node = address
+        self._next_index += 1
+        self.followers.append(follower)
+        await follower.connector.start(target=address)
+
+    async def _retire(self, follower: PooledConnection) -> None:
+        LOG.info("%s is no longer a follower, disconnecting", follower.node)
+        self.followers.remove(follower)
+        await follower.connector.stop()
+
+        for conversation, _ in list(follower.dispatcher.active_conversations.values()):
+            follower.dispatcher.remove(conversation.conversation_id)
+            await self.start_conversation(conversation)
+
+    async def stop(self, exn=None) -> None:
+        for connection in self.connections:
+            await connection.connector.stop(exn)
@@ -0,0 +1,1345 @@
+import asyncio
+import collections
+import logging
+import random
+import socket
+import struct
+import time
+import uuid
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Sequence, Union
+
+from . import messages_pb2 as proto
+from .conversations import _fill_new_event
+from .discovery import NodeService
+from .messages import (
+    HEADER_LENGTH,
+    ExpectedVersion,
+    NewEventData,
+    NotHandledReason,
+    OperationFlags,
+    OperationResult,
+    ReadAllResult,
+    ReadEventResult,
+    ReadStreamResult,
+    SubscriptionDropReason,
+    TcpCommand,
+)
+
+LOG = logging.getLogger("photonpump.testing")
+
+_HEAD = struct.Struct("<IBB")
+_LENGTH = struct.Struct("<I")
+_LINGER = struct.Struct("ii")
+
+#: The stream name that subscribes to every stream, as in EventStore.
+ALL_STREAMS = ""
+
+_CreateResult = proto.CreatePersistentSubscriptionCompleted
+_DeleteResult = proto.DeletePersistentSubscriptionCompleted
+_UpdateResult = proto.UpdatePersistentSubscriptionCompleted
+
+
+def _varint(value: int) -> bytes:
+    data = bytearray()
+
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+
+        if not value:
+            data.append(bits)
+
+            return bytes(data)
+        data.append(bits | 0x80)
+
+
+def _field(number: int, data: bytes) -> bytes:
+    """Encode a length-delimited protobuf field."""
+
+    return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def _int_field(number: int, value: int) -> bytes:
+    """Encode a non-negative varint protobuf field."""
+
+    return _varint(number << 3) + _varint(value)
+
+
+class StoredEvent:
+    """An event in the store, with the protobuf fields that carry it
+    encoded once, when it's written.
+
+    Protobuf messages can be concatenated, so a read reply is built by
+    joining the pre-encoded events and appending the rest of the reply,
+    without encoding any event again.
+    """
+
+    __slots__ = (
+        "stream",
+        "event_number",
+        "event_id",
+        "position",
+        "indexed",
+        "resolved",
+    )
+
+    def __init__(
+        self,
+        stream: str,
+        event_number: int,
+        event: proto.NewEvent,
+        position: int,
+        created_epoch: int,
+    ) -> None:
+        self.stream = stream
+        self.event_number = event_number
+        self.event_id = event.event_id
+        self.position = position
+
+        record = proto.EventRecord()
+        record.event_stream_id = stream
+        record.event_number = event_number
+        record.event_id = event.event_id
+        record.event_type = event.event_type
+        record.data_content_type = event.data_content_type
+        record.metadata_content_type = event.metadata_content_type
+        record.data = event.data
+        record.metadata = event.metadata
+        record.created_epoch = created_epoch
+        encoded = record.SerializeToString()
+
+        #: A ResolvedIndexedEvent as field 1, eg. of ReadStreamEventsCompleted.
+        self.indexed = _field(1, _field(1, encoded))
+        #: The body of a ResolvedEvent.
+        self.resolved = (
+            _field(1, encoded) + _int_field(3, position) + _int_field(4, position)
+        )
+
+
+class _Injection:
+    __slots__ = ("reason", "remaining", "commands", "payload")
+
+    def __init__(self, reason, remaining, commands, payload):
+        self.reason = reason
+        self.remaining = remaining
+        self.commands = commands
+        self.payload = payload
+
+
+class _Subscriber(NamedTuple):
+    connection: "_Connection"
+    conversation_id: bytes
+    capacity: int
+
+
+class _PersistentGroup:
+    """A persistent subscription group, which hands each event to one of its
+    subscribers, round robin, with at most `capacity` unacked events per
+    subscriber."""
+
+    def __init__(self, key: str, stream: str, next_number: int) -> None:
+        self.key = key
+        self.stream = stream
+        self.next_number = next_number
+        self.subscribers: List[_Subscriber] = []
+        self.in_flight: Dict[bytes, tuple] = {}
+        self.counts: Dict[bytes, int] = {}
+        self.retry = collections.deque()
+        self.turn = 0
+
+    def add(self, subscriber: _Subscriber) -> None:
+        self.subscribers.append(subscriber)
+        self.counts[subscriber.conversation_id] = 0
+
+    def remove(self, conversation_id: bytes) -> None:
+        self.subscribers = [
+            s for s in self.subscribers if s.conversation_id != conversation_id
+        ]
+        self.counts.pop(conversation_id, None)
+
+        for event_id, (event, subscriber) in list(self.in_flight.items()):
+            if subscriber.conversation_id == conversation_id:
+                del self.in_flight[event_id]
+                self.retry.appendleft(event)
+
+    def settle(self, event_id: bytes, retry: bool = False) -> None:
+        event, subscriber = self.in_flight.pop(event_id, (None, None))
+
+        if event is None:
+            return
+
+        if subscriber.conversation_id in self.counts:
+            self.counts[subscriber.conversation_id] -= 1
+
+        if retry:
+            self.retry.append(event)
+
+    def _next_subscriber(self) -> Optional[_Subscriber]:
+        for _ in range(len(self.subscribers)):
+            self.turn = (self.turn + 1) % len(self.subscribers)
+            subscriber = self.subscribers[self.turn]
+
+            if self.counts[subscriber.conversation_id] < subscriber.capacity:
+                return subscriber
+
+        return None
+
+    def pump(self, events: Sequence[StoredEvent]) -> None:
+        while self.subscribers:
+            if not self.retry and self.next_number >= len(events):
+                return
+
+            subscriber = self._next_subscriber()
+
+            if subscriber is None:
+                return
+
+            if self.retry:
+                event = self.retry.popleft()
+            else:
+                event = events[self.next_number]
+                self.next_number += 1
+
+            self.in_flight[event.event_id] = (event, subscriber)
+            self.counts[subscriber.conversation_id] += 1
+            subscriber.connection.send(
+                TcpCommand.PersistentSubscriptionStreamEventAppeared,
+                subscriber.conversation_id,
+                event.indexed,
+            )
+
+
+class _Connection(asyncio.Protocol):
+    """One client connection to the EventStoreServer.
+
+    Replies are buffered and written once per batch of requests, so that a
+    pipelining client gets many replies per system call.
+    """
+
+    def __init__(self, server: "EventStoreServer") -> None:
+        self.server = server
+        self.buffer = bytearray()
+        self.pending: List[bytes] = []
+        self.flush_scheduled = False
+        self.transport = None
+        self.heartbeat = None
+        #: The conversation ids of this connection's subscriptions, with the
+        #: stream or persistent group each one belongs to.
+        self.subscriptions: Dict[bytes, tuple] = {}
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        self.server.connections.add(self)
+
+        if self.server.heartbeat_interval:
+            self._schedule_heartbeat()
+
+    def _schedule_heartbeat(self) -> None:
+        self.heartbeat = self.server.loop.call_later(
+            self.server.heartbeat_interval, self._send_heartbeat
+        )
+
+    def _send_heartbeat(self) -> None:
+        self.send(TcpCommand.HeartbeatRequest, uuid.uuid4().bytes_le)
+        self._schedule_heartbeat()
+
+    def data_received(self, data: bytes) -> None:
+        buffer = self.buffer
+        buffer.extend(data)
+        size = len(buffer)
+        offset = 0
+
+        while size - offset >= 4:
+            (length,) = _LENGTH.unpack_from(buffer, offset)
+            end = offset + 4 + length
+
+            if end > size:
+                break
+
+            try:
+                self.server.handle(self, buffer, offset + 4, end)
+            except Exception:
+                LOG.exception("Failed to handle a request")
+            offset = end
+
+        if offset:
+            del buffer[:offset]
+        self.flush()
+
+    def send(self, command: int, conversation_id: bytes, payload: bytes = b"") -> None:
+        self.pending.append(
+            _HEAD.pack(HEADER_LENGTH + len(payload), command, 0)
+            + conversation_id
+            + payload
+        )
+
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.server.loop.call_soon(self.flush)
+
+    def flush(self) -> None:
+        self.flush_scheduled = False
+
+        if self.pending and self.transport and not self.transport.is_closing():
+            self.transport.write(b"".join(self.pending))
+        self.pending = []
+
+    def close(self) -> None:
+        if self.transport:
+            self.transport.close()
+
+    def connection_lost(self, exn) -> None:
+        if self.heartbeat:
+            self.heartbeat.cancel()
+        self.transport = None
+        self.server.disconnected(self)
+
+
+class EventStoreServer:
+    """An in-memory EventStore that speaks the TCP protocol, for testing
+    and benchmarking photonpump without a real server.
+
+    The server supports writes with expected-version checks, transactions,
+    single event, stream and $all reads in both directions, volatile and
+    persistent subscriptions, pings and heartbeats. Credentials are
+    accepted and ignored. Events are encoded once when they're written and
+    replies are written in batches, so that the server is much cheaper than
+    the client it serves.
+
+    Examples:
+        >>> async with EventStoreServer() as server:
+        >>>     async with connect(port=server.port) as client:
+        >>>         await client.publish_event("my-stream", "my-event")
+
+        The next few requests can be refused, to exercise retries.
+
+        >>> server.not_handled(NotHandledReason.TooBusy, count=3)
+
+    Args:
+        host (optional): The address to listen on, defaults to 127.0.0.1.
+        port (optional): The port to listen on, defaults to 0, which
+            chooses a free port. The chosen port is in `port` once the
+            server has started.
+        heartbeat_interval (optional): If set, the server sends a heartbeat
+            request on each connection every `heartbeat_interval` seconds.
+        loop (optional): An asyncio event loop.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        heartbeat_interval: Optional[float] = None,
+        loop=None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.heartbeat_interval = heartbeat_interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.streams: Dict[str, List[StoredEvent]] = {}
+        self.log: List[StoredEvent] = []
+        self.subscribers: Dict[str, Dict[bytes, _Connection]] = {}
+        self.groups: Dict[str, _PersistentGroup] = {}
+        self.transactions: Dict[int, tuple] = {}
+        self.connections = set()
+        #: The number of requests received, by command.
+        self.requests = collections.Counter()
+        self._next_transaction = 1
+        self._injections: List[_Injection] = []
+        self._server = None
+        self._handlers = {
+            TcpCommand.HeartbeatRequest: self._heartbeat,
+            TcpCommand.HeartbeatResponse: self._ignore,
+            TcpCommand.Ping: self._ping,
+            TcpCommand.Authenticate: self._authenticate,
+            TcpCommand.IdentifyClient: self._identify,
+            TcpCommand.WriteEvents: self._write_events,
+            TcpCommand.TransactionStart: self._transaction_start,
+            TcpCommand.TransactionWrite: self._transaction_write,
+            TcpCommand.TransactionCommit: self._transaction_commit,
+            TcpCommand.Read: self._read_event,
+            TcpCommand.ReadStreamEventsForward: self._read_stream_forward,
+            TcpCommand.ReadStreamEventsBackward: self._read_stream_backward,
+            TcpCommand.ReadAllEventsForward: self._read_all_forward,
+            TcpCommand.ReadAllEventsBackward: self._read_all_backward,
+            TcpCommand.SubscribeToStream: self._subscribe,
+            TcpCommand.UnsubscribeFromStream: self._unsubscribe,
+            TcpCommand.CreatePersistentSubscription: self._create_group,
+            TcpCommand.UpdatePersistentSubscription: self._update_group,
+            TcpCommand.DeletePersistentSubscription: self._delete_group,
+            TcpCommand.ConnectToPersistentSubscription: self._connect_group,
+            TcpCommand.PersistentSubscriptionAckEvents: self._ack,
+            TcpCommand.PersistentSubscriptionNakEvents: self._nak,
+        }
+
+    @property
+    def node(self) -> NodeService:
+        return NodeService(self.host, self.port, None)
+
+    async def start(self) -> None:
+        self._server = await self.loop.create_server(
+            lambda: _Connection(self), self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        LOG.info("EventStoreServer is listening on %s:%s", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.close()
+
+        for connection in list(self.connections):
+            connection.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def not_handled(
+        self,
+        reason: NotHandledReason = NotHandledReason.TooBusy,
+        count: int = 1,
+        commands: Optional[Iterable[TcpCommand]] = None,
+        master: Optional[NodeService] = None,
+    ) -> None:
+        """Refuse the next `count` requests with a NotHandled reply.
+
+        Args:
+            reason (optional): The reason given, defaults to TooBusy.
+            count (optional): The number of requests to refuse.
+            commands (optional): Only refuse requests with these commands.
+                Heartbeats, acks and naks are never refused.
+            master (optional): For NotMaster, the node to name as master.
+        """
+
+        body = proto.NotHandled()
+        body.reason = reason
+
+        if master:
+            info = proto.NotHandled.MasterInfo()
+            info.external_tcp_address = master.address
+            info.external_tcp_port = master.port
+            info.external_http_address = master.address
+            info.external_http_port = 2113
+
+            if master.secure_port:
+                info.external_secure_tcp_port = master.secure_port
+            body.additional_info = info.SerializeToString()
+
+        self._injections.append(
+            _Injection(
+                reason,
+                count,
+                frozenset(commands) if commands else None,
+                body.SerializeToString(),
+            )
+        )
+
+    def append(
+        self,
+        stream: str,
+        events: Iterable[Union[NewEventData, proto.NewEvent]],
+        expected_version: int = ExpectedVersion.Any,
+    ) -> proto.WriteEventsCompleted:
+        """Write events directly, as if a client had sent WriteEvents, eg.
+        to seed the store before a test."""
+
+        encoded = []
+
+        for event in events:
+            if not isinstance(event, proto.NewEvent):
+                new_event = proto.NewEvent()
+                _fill_new_event(new_event, event)
+                event = new_event
+            encoded.append(event)
+
+        return self._append(stream, expected_version, encoded)
+
+    def disconnected(self, connection: _Connection) -> None:
+        self.connections.discard(connection)
+
+        for conversation_id, (kind, key) in connection.subscriptions.items():
+            self._drop(kind, key, conversation_id)
+
+    def handle(self, connection: _Connection, frame, start: int, end: int) -> None:
+        command = frame[start]
+        conversation_id = bytes(frame[start + 2 : start + 18])
+        offset = start + 18
+
+        if frame[start + 1] & OperationFlags.Authenticated:
+            offset += 1 + frame[offset]
+            offset += 1 + frame[offset]
+
+        payload = bytes(frame[offset:end])
+        self.requests[command] += 1
+
+        if self._injections and self._inject(connection, command, conversation_id):
+            return
+
+        handler = self._handlers.get(command)
+
+        if handler is None:
+            connection.send(
+                TcpCommand.BadRequest,
+                conversation_id,
+                ("Unsupported command %d" % command).encode("UTF-8"),
+            )
+
+            return
+
+        handler(connection, conversation_id, payload)
+
+    def _inject(self, connection, command: int, conversation_id: bytes) -> bool:
+        if command in (
+            TcpCommand.HeartbeatRequest,
+            TcpCommand.HeartbeatResponse,
+            TcpCommand.PersistentSubscriptionAckEvents,
+            TcpCommand.PersistentSubscriptionNakEvents,
+            TcpCommand.UnsubscribeFromStream,
+        ):
+            return False
+
+        for injection in self._injections:
+            if injection.commands is None or command in injection.commands:
+                injection.remaining -= 1
+
+                if not injection.remaining:
+                    self._injections.remove(injection)
+                connection.send(
+                    TcpCommand.NotHandled, conversation_id, injection.payload
+                )
+
+                return True
+
+        return False
+
+    def _last_position(self) -> int:
+        return len(self.log) - 1
+
+    def _ignore(self, connection, conversation_id, payload):
+        pass
+
+    def _heartbeat(self, connection, conversation_id, payload):
+        connection.send(TcpCommand.HeartbeatResponse, conversation_id)
+
+    def _ping(self, connection, conversation_id, payload):
+        connection.send(TcpCommand.Pong, conversation_id)
+
+    def _authenticate(self, connection, conversation_id, payload):
+        connection.send(TcpCommand.Authenticated, conversation_id)
+
+    def _identify(self, connection, conversation_id, payload):
+        connection.send(TcpCommand.ClientIdentified, conversation_id)
+
+    # Writes
+
+    def _check_version(self, stream: str, expected_version: int) -> Optional[str]:
+        events = self.streams.get(stream)
+        current = -1 if events is None else len(events) - 1
+
+        if expected_version == ExpectedVersion.Any:
+            return None
+
+        if expected_version == ExpectedVersion.StreamMustExist:
+            ok = events is not None
+        elif expected_version == ExpectedVersion.StreamMustNotExist:
+            ok = events is None
+        else:
+            ok = current == expected_version
+
+        if ok:
+            return None
+
+        return "Expected version %d, but the stream is at %d" % (
+            expected_version,
+            current,
+        )
+
+    def _append(
+        self, stream: str, expected_version: int, events: Sequence[proto.NewEvent]
+    ) -> proto.WriteEventsCompleted:
+        result = proto.WriteEventsCompleted()
+        error = self._check_version(stream, expected_version)
+
+        if error:
+            result.result = OperationResult.WrongExpectedVersion
+            result.message = error
+            result.first_event_number = -1
+            result.last_event_number = -1
+
+            return result
+
+        stored = self.streams.setdefault(stream, [])
+        created = int(time.time() * 1000)
+        written = []
+
+        for event in events:
+            written.append(
+                StoredEvent(stream, len(stored), event, len(self.log), created)
+            )
+            stored.append(written[-1])
+            self.log.append(written[-1])
+
+        result.result = OperationResult.Success
+        result.first_event_number = len(stored) - len(written)
+        result.last_event_number = len(stored) - 1
+        result.prepare_position = result.commit_position = self._last_position()
+
+        if written:
+            self._publish(stream, written)
+
+        return result
+
+    def _write_events(self, connection, conversation_id, payload):
+        body = proto.WriteEvents()
+        body.ParseFromString(payload)
+        result = self._append(body.event_stream_id, body.expected_version, body.events)
+        connection.send(
+            TcpCommand.WriteEventsCompleted, conversation_id, result.SerializeToString()
+        )
+
+    def _transaction_start(self, connection, conversation_id, payload):
+        body = proto.TransactionStart()
+        body.ParseFromString(payload)
+
+        transaction_id = self._next_transaction
+        self._next_transaction += 1
+        self.transactions[transaction_id] = (
+            body.event_stream_id,
+            body.expected_version,
+            [],
+        )
+
+        result = proto.TransactionStartCompleted()
+        result.transaction_id = transaction_id
+        result.result = OperationResult.Success
+        connection.send(
+            TcpCommand.TransactionStartCompleted,
+            conversation_id,
+            result.SerializeToString(),
+        )
+
+    def _transaction_write(self, connection, conversation_id, payload):
+        body = proto.TransactionWrite()
+        body.ParseFromString(payload)
+
+        result = proto.TransactionWriteCompleted()
+        result.transaction_id = body.transaction_id
+        transaction = self.transactions.get(body.transaction_id)
+
+        if transaction is None:
+            result.result = OperationResult.InvalidTransaction
+        else:
+            transaction[2].extend(body.events)
+            result.result = OperationResult.Success
+
+        connection.send(
+            TcpCommand.TransactionWriteCompleted,
+            conversation_id,
+            result.SerializeToString(),
+        )
+
+    def _transaction_commit(self, connection, conversation_id, payload):
+        body = proto.TransactionCommit()
+        body.ParseFromString(payload)
+
+        result = proto.TransactionCommitCompleted()
+        result.transaction_id = body.transaction_id
+        transaction = self.transactions.pop(body.transaction_id, None)
+
+        if transaction is None:
+            result.result = OperationResult.InvalidTransaction
+            result.first_event_number = -1
+            result.last_event_number = -1
+        else:
+            written = self._append(*transaction)
+            result.result = written.result
+            result.message = written.message
+            result.first_event_number = written.first_event_number
+            result.last_event_number = written.last_event_number
+
+            if written.HasField("commit_position"):
+                result.prepare_position = written.prepare_position
+                result.commit_position = written.commit_position
+
+        connection.send(
+            TcpCommand.TransactionCommitCompleted,
+            conversation_id,
+            result.SerializeToString(),
+        )
+
+    def _publish(self, stream: str, events: Sequence[StoredEvent]) -> None:
+        for key in (stream, ALL_STREAMS):
+            subscribers = self.subscribers.get(key)
+
+            if not subscribers:
+                continue
+
+            for event in events:
+                appeared = _field(1, event.resolved)
+
+                for conversation_id, connection in subscribers.items():
+                    connection.send(
+                        TcpCommand.StreamEventAppeared, conversation_id, appeared
+                    )
+
+        for group in self.groups.values():
+            if group.stream == stream:
+                group.pump(self.streams[stream])
+
+    # Reads
+
+    def _read_event(self, connection, conversation_id, payload):
+        body = proto.ReadEvent()
+        body.ParseFromString(payload)
+
+        events = self.streams.get(body.event_stream_id)
+        result = proto.ReadEventCompleted()
+        found = None
+
+        if events is None:
+            result.result = ReadEventResult.NoStream
+        else:
+            number = len(events) - 1 if body.event_number == -1 else body.event_number
+
+            if 0 <= number < len(events):
+                result.result = ReadEventResult.Success
+                found = events[number]
+            else:
+                result.result = ReadEventResult.NotFound
+
+        reply = result.SerializePartialToString()
+
+        if found:
+            # ReadEventCompleted carries its event as field 2.
+            reply += b"\x12" + found.indexed[1:]
+
+        connection.send(TcpCommand.ReadEventCompleted, conversation_id, reply)
+
+    def _read_stream(self, body: proto.ReadStreamEvents, forward: bool) -> bytes:
+        events = self.streams.get(body.event_stream_id)
+        result = proto.ReadStreamEventsCompleted()
+        result.last_commit_position = self._last_position()
+
+        if events is None:
+            result.result = ReadStreamResult.NoStream
+            result.next_event_number = -1
+            result.last_event_number = -1
+            result.is_end_of_stream = True
+
+            return result.SerializeToString()
+
+        last = len(events) - 1
+        count = body.max_count
+
+        if forward:
+            first = max(body.from_event_number, 0)
+            page = events[first : first + count]
+            result.next_event_number = min(first + count, last + 1)
+            result.is_end_of_stream = first + count > last
+        else:
+            first = body.from_event_number
+
+            if first < 0 or first > last:
+                first = last
+            lowest = max(first - count + 1, 0)
+            page = events[lowest : first + 1][::-1]
+            result.next_event_number = lowest - 1
+            result.is_end_of_stream = lowest == 0
+
+        result.result = ReadStreamResult.Success
+        result.last_event_number = last
+
+        return b"".join(e.indexed for e in page) + result.SerializeToString()
+
+    def _read_stream_forward(self, connection, conversation_id, payload):
+        body = proto.ReadStreamEvents()
+        body.ParseFromString(payload)
+        connection.send(
+            TcpCommand.ReadStreamEventsForwardCompleted,
+            conversation_id,
+            self._read_stream(body, forward=True),
+        )
+
+    def _read_stream_backward(self, connection, conversation_id, payload):
+        body = proto.ReadStreamEvents()
+        body.ParseFromString(payload)
+        connection.send(
+            TcpCommand.ReadStreamEventsBackwardCompleted,
+            conversation_id,
+            self._read_stream(body, forward=False),
+        )
+
+    def _read_all(self, body: proto.ReadAllEvents, forward: bool) -> bytes:
+        result = proto.ReadAllEventsCompleted()
+        result.result = ReadAllResult.Success
+        result.commit_position = body.commit_position
+        result.prepare_position = body.prepare_position
+
+        if forward:
+            first = max(body.commit_position, 0)
+            page = self.log[first : first + body.max_count]
+            following = page[-1].position + 1 if page else first
+        else:
+            end = body.commit_position
+
+            if end < 0 or end > len(self.log):
+                end = len(self.log)
+            following = max(end - body.max_count, 0)
+            page = self.log[following:end][::-1]
+
+        result.next_commit_position = result.next_prepare_position = following
+
+        # ReadAllEventsCompleted carries its events as field 3.
+        return (
+            b"".join(_field(3, e.resolved) for e in page) + result.SerializeToString()
+        )
+
+    def _read_all_forward(self, connection, conversation_id, payload):
+        body = proto.ReadAllEvents()
+        body.ParseFromString(payload)
+        connection.send(
+            TcpCommand.ReadAllEventsForwardCompleted,
+            conversation_id,
+            self._read_all(body, forward=True),
+        )
+
+    def _read_all_backward(self, connection, conversation_id, payload):
+        body = proto.ReadAllEvents()
+        body.ParseFromString(payload)
+        connection.send(
+            TcpCommand.ReadAllEventsBackwardCompleted,
+            conversation_id,
+            self._read_all(body, forward=False),
+        )
+
+    # Subscriptions
+
+    def _dropped(self, connection, conversation_id, reason) -> None:
+        body = proto.SubscriptionDropped()
+        body.reason = reason
+        connection.send(
+            TcpCommand.SubscriptionDropped, conversation_id, body.SerializeToString()
+        )
+
+    def _drop(self, kind: str, key: str, conversation_id: bytes) -> None:
+        if kind == "stream":
+            self.subscribers.get(key, {}).pop(conversation_id, None)
+
+            return
+
+        group = self.groups.get(key)
+
+        if group:
+            group.remove(conversation_id)
+            group.pump(self.streams.get(group.stream, []))
+
+    def _subscribe(self, connection, conversation_id, payload):
+        body = proto.SubscribeToStream()
+        body.ParseFromString(payload)
+        stream = body.event_stream_id
+
+        self.subscribers.setdefault(stream, {})[conversation_id] = connection
+        connection.subscriptions[conversation_id] = ("stream", stream)
+
+        result = proto.SubscriptionConfirmation()
+        result.last_commit_position = self._last_position()
+
+        if stream in self.streams:
+            result.last_event_number = len(self.streams[stream]) - 1
+
+        connection.send(
+            TcpCommand.SubscriptionConfirmation,
+            conversation_id,
+            result.SerializeToString(),
+        )
+
+    def _unsubscribe(self, connection, conversation_id, payload):
+        subscription = connection.subscriptions.pop(conversation_id, None)
+
+        if subscription is None:
+            return
+
+        self._drop(*subscription, conversation_id)
+        self._dropped(connection, conversation_id, SubscriptionDropReason.Unsubscribed)
+
+    def _group_settings(self, body) -> int:
+        events = self.streams.get(body.event_stream_id, [])
+
+        return len(events) if body.start_from == -1 else body.start_from
+
+    def _create_group(self, connection, conversation_id, payload):
+        body = proto.CreatePersistentSubscription()
+        body.ParseFromString(payload)
+        key = "%s::%s" % (body.event_stream_id, body.subscription_group_name)
+
+        result = proto.CreatePersistentSubscriptionCompleted()
+
+        if key in self.groups:
+            result.result = _CreateResult.AlreadyExists
+        else:
+            self.groups[key] = _PersistentGroup(
+                key, body.event_stream_id, self._group_settings(body)
+            )
+            result.result = _CreateResult.Success
+
+        connection.send(
+            TcpCommand.CreatePersistentSubscriptionCompleted,
+            conversation_id,
+            result.SerializeToString(),
+        )
+
+    def _update_group(self, connection, conversation_id, payload):
+        body = proto.UpdatePersistentSubscription()
+        body.ParseFromString(payload)
+        key = "%s::%s" % (body.event_stream_id, body.subscription_group_name)
+
+        result = proto.UpdatePersistentSubscriptionCompleted()
+
+        if key in self.groups:
+            self.groups[key].next_number = self._group_settings(body)
+            result.result = _UpdateResult.Success
+        else:
+            result.result = _UpdateResult.DoesNotExist
+
+        connection.send(
+            TcpCommand.UpdatePersistentSubscriptionCompleted,
+            conversation_id,
+            result.SerializeToString(),
+        )
+
+    def _delete_group(self, connection, conversation_id, payload):
+        body = proto.DeletePersistentSubscription()
+        body.ParseFromString(payload)
+        key = "%s::%s" % (body.event_stream_id, body.subscription_group_name)
+
+        result = proto.DeletePersistentSubscriptionCompleted()
+        group = self.groups.pop(key, None)
+
+        if group is None:
+            result.result = _DeleteResult.DoesNotExist
+        else:
+            result.result = _DeleteResult.Success
+
+            for subscriber in group.subscribers:
+                subscriber.connection.subscriptions.pop(
+                    subscriber.conversation_id, None
+                )
+                self._dropped(
+                    subscriber.connection,
+                    subscriber.conversation_id,
+                    SubscriptionDropReason.PersistentSubscriptionDeleted,
+                )
+
+        connection.send(
+            TcpCommand.DeletePersistentSubscriptionCompleted,
+            conversation_id,
+            result.SerializeToString(),
+        )
+
+    def _connect_group(self, connection, conversation_id, payload):
+        body = proto.ConnectToPersistentSubscription()
+        body.ParseFromString(payload)
+        key = "%s::%s" % (body.event_stream_id, body.subscription_id)
+        group = self.groups.get(key)
+
+        if group is None:
+            self._dropped(connection, conversation_id, SubscriptionDropReason.NotFound)
+
+            return
+
+        group.add(
+            _Subscriber(connection, conversation_id, body.allowed_in_flight_messages)
+        )
+        connection.subscriptions[conversation_id] = ("group", key)
+
+        result = proto.PersistentSubscriptionConfirmation()
+        result.last_commit_position = self._last_position()
+        result.subscription_id = key
+
+        if group.stream in self.streams:
+            result.last_event_number = len(self.streams[group.stream]) - 1
+
+        connection.send(
+            TcpCommand.PersistentSubscriptionConfirmation,
+            conversation_id,
+            result.SerializeToString(),
+        )
+        group.pump(self.streams.get(group.stream, []))
+
+    def _ack(self, connection, conversation_id, payload):
+        body = proto.PersistentSubscriptionAckEvents()
+        body.ParseFromString(payload)
+        group = self.groups.get(body.subscription_id)
+
+        if group is None:
+            return
+
+        for event_id in body.processed_event_ids:
+            group.settle(event_id)
+        group.pump(self.streams.get(group.stream, []))
+
+    def _nak(self, connection, conversation_id, payload):
+        body = proto.PersistentSubscriptionNakEvents()
+        body.ParseFromString(payload)
+        group = self.groups.get(body.subscription_id)
+
+        if group is None:
+            return
+
+        retry = body.action in (
+            proto.PersistentSubscriptionNakEvents.Unknown,
+            proto.PersistentSubscriptionNakEvents.Retry,
+        )
+
+        for event_id in body.processed_event_ids:
+            group.settle(event_id, retry=retry)
+        group.pump(self.streams.get(group.stream, []))
+
+
+def _reset(transport) -> None:
+    """Close a transport with a TCP reset, rather than a graceful FIN."""
+
+    sock = transport.get_extra_info("socket")
+
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER.pack(1, 0))
+        except OSError:
+            pass
+    transport.abort()
+
+
+class _ProxySide(asyncio.Protocol):
+    """One end of a proxied connection, facing either the client or the
+    server."""
+
+    def __init__(self, link: "_ProxiedConnection") -> None:
+        self.link = link
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def data_received(self, data: bytes) -> None:
+        self.link.forward(self, data)
+
+    def pause_writing(self) -> None:
+        self.link.peer(self).pause_reading()
+
+    def resume_writing(self) -> None:
+        self.link.peer(self).resume_reading()
+
+    def pause_reading(self) -> None:
+        if self.transport and not self.transport.is_closing():
+            self.transport.pause_reading()
+
+    def resume_reading(self) -> None:
+        if self.transport and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def connection_lost(self, exn) -> None:
+        self.transport = None
+        self.link.close()
+
+
+class _ProxiedConnection:
+    """A client connection through a FaultyProxy, and the connection to the
+    server that it's forwarded to.
+
+    Each direction has a queue of pieces waiting for their delivery time, so
+    that latency, jitter, throttling and splitting delay bytes without ever
+    reordering them, as TCP wouldn't.
+    """
+
+    def __init__(self, proxy: "FaultyProxy") -> None:
+        self.proxy = proxy
+        self.client = _ProxySide(self)
+        self.server = _ProxySide(self)
+        self.early = bytearray()
+        self.queues: Dict[_ProxySide, Deque] = {
+            self.client: collections.deque(),
+            self.server: collections.deque(),
+        }
+        self.timers: Dict[_ProxySide, asyncio.TimerHandle] = {}
+        #: When each direction's link will next be free, for throttling.
+        self.free: Dict[_ProxySide, float] = {self.client: 0.0, self.server: 0.0}
+        self.closed = False
+
+    def peer(self, side: _ProxySide) -> _ProxySide:
+        return self.server if side is self.client else self.client
+
+    async def open(self) -> None:
+        upstream = self.proxy.upstream
+
+        try:
+            await self.proxy.loop.create_connection(
+                lambda: self.server, upstream.address, upstream.port
+            )
+        except OSError:
+            LOG.warning("FaultyProxy failed to connect to %s", upstream)
+            self.reset()
+
+            return
+
+        if self.closed:
+            self.server.transport.close()
+
+            return
+
+        if self.early:
+            data, self.early = (bytes(self.early), bytearray())
+            self.forward(self.client, data)
+
+    def forward(self, source: _ProxySide, data: bytes) -> None:
+        proxy = self.proxy
+
+        if proxy.blackholed:
+            proxy.bytes_dropped += len(data)
+
+            return
+
+        target = self.peer(source)
+
+        if target.transport is None:
+            # The client spoke before we finished connecting to the server.
+            self.early.extend(data)
+
+            return
+
+        queue = self.queues[target]
+
+        if not (queue or proxy.latency or proxy.bandwidth or proxy.max_chunk):
+            proxy.bytes_forwarded += len(data)
+            target.transport.write(data)
+
+            return
+
+        now = proxy.loop.time()
+        due = now + proxy.next_delay()
+
+        for piece in proxy.pieces(data):
+            if proxy.bandwidth:
+                start = max(due, self.free[target])
+                due = self.free[target] = start + len(piece) / proxy.bandwidth
+
+            if queue:
+                due = max(due, queue[-1][0])
+            queue.append((due, piece))
+            due += proxy.split_interval
+
+        self._schedule(target)
+
+    def _schedule(self, target: _ProxySide) -> None:
+        queue = self.queues[target]
+
+        if queue and target not in self.timers:
+            self.timers[target] = self.proxy.loop.call_at(
+                queue[0][0], self._deliver, target
+            )
+
+    def _deliver(self, target: _ProxySide) -> None:
+        del self.timers[target]
+        proxy = self.proxy
+        queue = self.queues[target]
+        now = proxy.loop.time()
+
+        # Pieces split apart go in separate writes, one per loop iteration,
+        # so that the receiver reads them separately.
+        while queue and queue[0][0] <= now:
+            _, piece = queue.popleft()
+
+            if proxy.blackholed or target.transport is None:
+                proxy.bytes_dropped += len(piece)
+            else:
+                proxy.bytes_forwarded += len(piece)
+                target.transport.write(piece)
+
+            if proxy.max_chunk:
+                break
+
+        self._schedule(target)
+
+    def reset(self) -> None:
+        for side in (self.client, self.server):
+            if side.transport is not None:
+                _reset(side.transport)
+        self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self.closed = True
+
+        for side in (self.client, self.server):
+            if side.transport is not None and not side.transport.is_closing():
+                side.transport.close()
+
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        self.proxy.connections.discard(self)
+
+
+class FaultyProxy:
+    """A TCP proxy that forwards connections to a server and injects
+    network faults on the way, to measure how quickly photonpump detects
+    and recovers from them.
+
+    Faults apply in both directions, to open connections and new ones,
+    until `heal` is called. They can be combined, eg. a slow link that
+    also splits frames.
+
+    Examples:
+        >>> async with EventStoreServer() as server:
+        >>>     async with FaultyProxy(server.node) as proxy:
+        >>>         async with connect(port=proxy.port) as client:
+        >>>             proxy.delay(0.05, jitter=0.01)
+        >>>             await client.ping()
+
+        A network partition: the connection stays open, but nothing gets
+        through, so only heartbeats can tell that it's dead.
+
+        >>>             proxy.blackhole()
+
+    Args:
+        upstream: The node to forward connections to.
+        host (optional): The address to listen on, defaults to 127.0.0.1.
+        port (optional): The port to listen on, defaults to 0, which
+            chooses a free port. The chosen port is in `port` once the
+            proxy has started.
+        seed (optional): Seeds the random numbers used for jitter and for
+            splitting, so that a run can be repeated.
+        loop (optional): An asyncio event loop.
+
+    Attributes:
+        connections: The open client connections.
+        bytes_forwarded: The number of bytes delivered, in both directions.
+        bytes_dropped: The number of bytes dropped by `blackhole`.
+    """
+
+    def __init__(
+        self,
+        upstream: NodeService,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: Optional[int] = None,
+        loop=None,
+    ) -> None:
+        self.upstream = upstream
+        self.host = host
+        self.port = port
+        self.loop = loop or asyncio.get_event_loop()
+        self.random = random.Random(seed)
+        self.connections = set()
+        self.bytes_forwarded = 0
+        self.bytes_dropped = 0
+        self._server = None
+        self.heal()
+
+    @property
+    def node(self) -> NodeService:
+        return NodeService(self.host, self.port, None)
+
+    async def start(self) -> None:
+        self._server = await self.loop.create_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        LOG.info(
+            "FaultyProxy is forwarding %s:%s to %s", self.host, self.port, self.upstream
+        )
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.close()
+        self.reset()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def _accept(self) -> _ProxySide:
+        connection = _ProxiedConnection(self)
+        self.connections.add(connection)
+        asyncio.ensure_future(connection.open(), loop=self.loop)
+
+        return connection.client
+
+    def next_delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def pieces(self, data: bytes) -> Iterable[bytes]:
+        if not self.max_chunk:
+            yield data
+
+            return
+
+        offset = 0
+
+        while offset < len(data):
+            size = self.random.randint(1, self.max_chunk)
+            yield data[offset : offset + size]
+            offset += size
+
+    def delay(self, latency: float, jitter: float = 0.0) -> None:
+        """Delay every chunk by `latency` seconds, give or take up to
+        `jitter` seconds. Bytes are never reordered, so jitter that would
+        overtake an earlier chunk waits for it instead."""
+
+        self.latency = latency
+        self.jitter = jitter
+
+    def throttle(self, bytes_per_second: float) -> None:
+        """Limit each direction of each connection to a bandwidth."""
+
+        self.bandwidth = bytes_per_second
+
+    def split(self, max_chunk: int, interval: float = 0.001) -> None:
+        """Deliver data in pieces of between 1 and `max_chunk` bytes, with
+        `interval` seconds between them, so that frames arrive split at
+        arbitrary byte boundaries."""
+
+        self.max_chunk = max_chunk
+        self.split_interval = interval
+
+    def blackhole(self) -> None:
+        """Silently drop everything, including bytes already delayed.
+        Connections stay open and new ones are accepted, as in a network
+        partition."""
+
+        self.blackholed = True
+
+    def reset(self) -> None:
+        """Close every open connection with a TCP reset, in both
+        directions."""
+
+        for connection in list(self.connections):
+            connection.reset()
+
+    def heal(self) -> None:
+        """Stop injecting faults. Connections that were reset stay closed."""
+
+        self.latency = 0.0
+        self.jitter = 0.0
+        self.bandwidth = None
+        self.max_chunk = None
+        self.split_interval = 0.0
+        self.blackholed = False
@@ -0,0 +1,178 @@
+import collections
+import enum
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+LOG = logging.getLogger("photonpump.tracing")
+
+
+class Stage(enum.IntEnum):
+    """The points in a conversation's life that a Tracer timestamps.
+
+    The time between one stage and the next is spent on:
+
+     - Encoded: building and queueing the request frame.
+     - Dequeued: waiting in the connection's output queue.
+     - Written: writing the frame and draining the transport.
+     - FirstByte: the network and the server.
+     - Parsed: reading the rest of the reply frame.
+     - Dispatched: waiting for the dispatch loop.
+     - Resolved: handling the reply and resolving the result.
+    """
+
+    Created = 0
+    Encoded = 1
+    Dequeued = 2
+    Written = 3
+    FirstByte = 4
+    Parsed = 5
+    Dispatched = 6
+    Resolved = 7
+
+
+class ConversationTrace:
+    """The timestamps, in seconds from `time.perf_counter`, recorded for one
+    conversation.
+
+    A stage that a conversation never reached, eg. because it failed before
+    it was written, has no timestamp. If a frame is written again, eg. after
+    a reconnect, its stages record the latest attempt.
+    """
+
+    __slots__ = ("conversation_id", "conversation_type", "timestamps")
+
+    def __init__(self, conversation_id: UUID, conversation_type: str) -> None:
+        self.conversation_id = conversation_id
+        self.conversation_type = conversation_type
+        self.timestamps: Dict[Stage, float] = {}
+
+    @property
+    def total(self) -> float:
+        """The time from creation to the latest recorded stage."""
+
+        if not self.timestamps:
+            return 0.0
+
+        return max(self.timestamps.values()) - min(self.timestamps.values())
+
+    def durations(self) -> List[Tuple[Stage, float]]:
+        """The time taken to reach each recorded stage from the one before
+        it, in pipeline order."""
+
+        result = []
+        previous = None
+
+        for stage in sorted(self.timestamps):
+            if previous is not None:
+                result.append((stage, self.timestamps[stage] - previous))
+            previous = self.timestamps[stage]
+
+        return result
+
+    def slowest_stage(self) -> Optional[Stage]:
+        """The stage that took longest to reach, or None if we only know when
+        the conversation was created."""
+
+        durations = self.durations()
+
+        if not durations:
+            return None
+
+        return max(durations, key=lambda d: d[1])[0]
+
+    def __repr__(self):
+        return "<ConversationTrace %s %s %s>" % (
+            self.conversation_type,
+            self.conversation_id,
+            ", ".join("%s=%.6f" % (s.name, d) for (s, d) in self.durations()),
+        )
+
+
+class Tracer:
+    """Timestamps conversations as they move through the client, so that
+    tail latency can be attributed to a stage of the pipeline.
+
+    Finished traces are passed to `hook`, and those that took at least
+    `slow_threshold` seconds are kept in `slow`, a ring buffer of the most
+    recent `capacity` slow conversations.
+
+    Examples:
+        >>> tracer = Tracer(slow_threshold=0.05)
+        >>> client = connect(tracer=tracer)
+        >>> ...
+        >>> for trace in tracer.slow:
+        >>>     print(trace.conversation_type, trace.slowest_stage())
+
+    Args:
+        slow_threshold (optional): The shortest total time, in seconds, for
+            a conversation to be kept in `slow`. Defaults to 0.1.
+        capacity (optional): The number of slow traces to keep.
+        hook (optional): Called with every finished ConversationTrace.
+    """
+
+    enabled = True
+
+    def __init__(
+        self,
+        slow_threshold: float = 0.1,
+        capacity: int = 100,
+        hook: Optional[Callable[[ConversationTrace], None]] = None,
+    ) -> None:
+        self.slow_threshold = slow_threshold
+        self.slow = collections.deque(maxlen=capacity)
+        self.hook = hook
+        self.active: Dict[UUID, ConversationTrace] = {}
+
+    def start(self, conversation) -> None:
+        trace = ConversationTrace(
+            conversation.conversation_id, type(conversation).__name__
+        )
+        trace.timestamps[Stage.Created] = time.perf_counter()
+        self.active[conversation.conversation_id] = trace
+        conversation.result.add_done_callback(
+            lambda _: self.finish(conversation.conversation_id)
+        )
+
+    def mark(
+        self, conversation_id: UUID, stage: Stage, timestamp: Optional[float] = None
+    ) -> None:
+        trace = self.active.get(conversation_id)
+
+        if trace is not None:
+            trace.timestamps[stage] = (
+                time.perf_counter() if timestamp is None else timestamp
+            )
+
+    def finish(self, conversation_id: UUID) -> None:
+        trace = self.active.pop(conversation_id, None)
+
+        if trace is None:
+            return
+
+        trace.timestamps[Stage.Resolved] = time.perf_counter()
+
+        if trace.total >= self.slow_threshold:
+            self.slow.append(trace)
+
+        if self.hook:
+            try:
+                self.hook(trace)
+            except Exception:
+                LOG.exception("Tracing hook failed for %s", trace)
+
+
+class NullTracer(Tracer):
+    """A tracer that records nothing, used unless a Tracer is given."""
+
+    enabled = False
+
+    def __init__(self) -> None:
+        super().__init__(capacity=0)
+
+    def start(self, conversation) -> None:
+        pass
+
+
+NULL_TRACER = NullTracer()
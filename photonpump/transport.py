@@ -0,0 +1,109 @@
+import logging
+import socket
+from typing import NamedTuple, Optional
+
+LOG = logging.getLogger("photonpump.transport")
+
+
+class TransportConfig(NamedTuple):
+    """Socket and transport options, applied every time a connection opens.
+
+    Options left as None keep the operating system's or asyncio's default.
+    Keepalive timings are only applied on platforms that support them.
+
+    Attributes:
+        nodelay: If True, disable Nagle's algorithm so that small requests
+            are sent at once.
+        keepalive: If True, enable TCP keepalive probes.
+        keepalive_idle: Seconds of silence before the first probe.
+        keepalive_interval: Seconds between probes.
+        keepalive_count: Unanswered probes before the connection is dropped.
+        send_buffer: The size, in bytes, of the socket's send buffer.
+        receive_buffer: The size, in bytes, of the socket's receive buffer.
+        write_high_water: The number of buffered bytes at which writers
+            must wait for the transport to drain.
+        write_low_water: The number of buffered bytes at which waiting
+            writers resume.
+        read_chunk_size: The most bytes to read from the socket at once.
+        heartbeat_period: Seconds of silence from the server before we send
+            a heartbeat.
+        heartbeat_timeout: The longest, in seconds, that we wait for a
+            heartbeat response. Three timeouts in a row drop the connection.
+    """
+
+    nodelay: bool = True
+    keepalive: bool = False
+    keepalive_idle: Optional[int] = None
+    keepalive_interval: Optional[int] = None
+    keepalive_count: Optional[int] = None
+    send_buffer: Optional[int] = None
+    receive_buffer: Optional[int] = None
+    write_high_water: Optional[int] = None
+    write_low_water: Optional[int] = None
+    read_chunk_size: int = 8192
+    heartbeat_period: float = 30
+    heartbeat_timeout: float = 10
+
+
+#: The options used when none are given, matching asyncio's defaults.
+DEFAULT = TransportConfig()
+
+#: Small buffers and fast failure detection, for request/response traffic.
+LOW_LATENCY = TransportConfig(
+    nodelay=True,
+    keepalive=True,
+    keepalive_idle=10,
+    keepalive_interval=5,
+    keepalive_count=3,
+    write_high_water=64 * 1024,
+    write_low_water=16 * 1024,
+    read_chunk_size=16 * 1024,
+)
+
+#: Large buffers and reads, for imports, catch-up and other bulk transfers.
+BULK_THROUGHPUT = TransportConfig(
+    nodelay=True,
+    keepalive=True,
+    keepalive_idle=60,
+    keepalive_interval=10,
+    keepalive_count=5,
+    send_buffer=4 * 1024 * 1024,
+    receive_buffer=4 * 1024 * 1024,
+    write_high_water=4 * 1024 * 1024,
+    write_low_water=1024 * 1024,
+    read_chunk_size=256 * 1024,
+)
+
+
+def _set(sock, level, name, value):
+    option = getattr(socket, name, None)
+
+    if value is None or option is None:
+        return
+
+    try:
+        sock.setsockopt(level, option, value)
+    except OSError:
+        LOG.warning("Failed to set socket option %s to %s", name, value, exc_info=True)
+
+
+def apply_transport_config(config: TransportConfig, transport) -> None:
+    """Apply a TransportConfig to a newly connected transport."""
+
+    sock = transport.get_extra_info("socket")
+
+    if sock is not None:
+        _set(sock, socket.IPPROTO_TCP, "TCP_NODELAY", int(config.nodelay))
+        _set(sock, socket.SOL_SOCKET, "SO_KEEPALIVE", int(config.keepalive))
+
+        if config.keepalive:
+            _set(sock, socket.IPPROTO_TCP, "TCP_KEEPIDLE", config.keepalive_idle)
+            _set(sock, socket.IPPROTO_TCP, "TCP_KEEPINTVL", config.keepalive_interval)
+            _set(sock, socket.IPPROTO_TCP, "TCP_KEEPCNT", config.keepalive_count)
+        _set(sock, socket.SOL_SOCKET, "SO_SNDBUF", config.send_buffer)
+        _set(sock, socket.SOL_SOCKET, "SO_RCVBUF", config.receive_buffer)
+
+    if config.write_high_water is not None:
+        transport.set_write_buffer_limits(
+            high=config.write_high_water, low=config.write_low_water
+        )
@@ -0,0 +1,418 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+
+from . import conversations as convo
+from . import exceptions
+from . import messages as msg
+from . import messages_pb2 as proto
+
+LOG = logging.getLogger("photonpump.writers")
+
+
+class PublishProgress(NamedTuple):
+    """Progress of a streaming publish.
+
+    Attributes:
+        events_written: The number of events acknowledged by the server.
+        frames_written: The number of WriteEvents frames acknowledged.
+        last_event_number: The event number of the last event written.
+    """
+
+    events_written: int
+    frames_written: int
+    last_event_number: Optional[int]
+
+
+def next_expected_version(expected_version, count) -> Optional[int]:
+    """Predict the expected version for the write that follows a write of
+    `count` events.
+
+    Returns None if the version can only be learned from the server's
+    reply, as is the case for `ExpectedVersion.StreamMustExist`.
+    """
+
+    if expected_version == msg.ExpectedVersion.Any:
+        return msg.ExpectedVersion.Any
+
+    if expected_version >= msg.ExpectedVersion.StreamMustNotExist:
+        return expected_version + count
+
+    return None
+
+
+def _discard_result(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+def _check_write(conversation_id, result: proto.WriteEventsCompleted):
+    if result.result != msg.OperationResult.Success:
+        raise convo.operation_failed(conversation_id, result.result, result.message)
+
+
+async def publish_stream(
+    dispatcher,
+    stream: str,
+    events,
+    expected_version=msg.ExpectedVersion.Any,
+    require_master: bool = False,
+    chunk_events: int = 500,
+    chunk_bytes: int = 1024 * 1024,
+    max_in_flight: int = 4,
+    credential: Optional[msg.Credential] = None,
+    on_progress: Optional[Callable[[PublishProgress], None]] = None,
+) -> PublishProgress:
+    """Publish events from an iterable or async iterable as a series of
+    WriteEvents frames, keeping up to `max_in_flight` frames outstanding.
+
+    Each frame's expected version is derived from the frames before it,
+    so optimistic concurrency holds across the whole stream of events.
+    When the version can't be predicted (`ExpectedVersion.StreamMustExist`)
+    we wait for the first frame's `last_event_number` before sending more.
+    With `ExpectedVersion.Any`, every frame is written with Any.
+
+    Frames are sent as bulk traffic, so that they give way to interactive
+    requests on the same connection.
+    """
+
+    chunker = convo.EventChunker(events, chunk_events, chunk_bytes)
+    in_flight = deque()
+    next_version = expected_version
+    progress = PublishProgress(0, 0, None)
+
+    async def complete_oldest():
+        nonlocal next_version, progress
+        conversation, future = in_flight.popleft()
+        result = await future
+        _check_write(conversation.conversation_id, result)
+
+        progress = PublishProgress(
+            progress.events_written + len(conversation.events),
+            progress.frames_written + 1,
+            result.last_event_number,
+        )
+
+        if next_version is None:
+            next_version = result.last_event_number
+
+        if on_progress:
+            on_progress(progress)
+
+    try:
+        while True:
+            batch = await chunker.next_batch()
+
+            if not batch:
+                break
+
+            while in_flight and (
+                next_version is None or len(in_flight) >= max_in_flight
+            ):
+                await complete_oldest()
+
+            conversation = convo.WriteEvents(
+                stream,
+                batch,
+                expected_version=next_version,
+                require_master=require_master,
+                credential=credential,
+            )
+            conversation.priority = msg.Priority.Bulk
+            future = await dispatcher.start_conversation(conversation)
+            in_flight.append((conversation, future))
+            next_version = next_expected_version(next_version, len(batch))
+
+        while in_flight:
+            await complete_oldest()
+    finally:
+        for _, future in in_flight:
+            future.add_done_callback(_discard_result)
+
+    LOG.debug("Published %d events to %s", progress.events_written, stream)
+
+    return progress
+
+
+class _OrderedWrite(NamedTuple):
+    conversation: convo.WriteEvents
+    sent: asyncio.Future
+    done: asyncio.Future
+
+
+class OrderedStreamWriter:
+    """Pipelines writes to a single stream while preserving their order and
+    optimistic concurrency.
+
+    Each write is sent with the expected version that the writes before it
+    will leave the stream at, without waiting for them to be acknowledged.
+    Up to `max_in_flight` writes may be awaiting acknowledgement at once.
+
+    If a write with a specific expected version fails, every write queued
+    after it fails with WriteAborted, whatever the server makes of it, and
+    so does every later call to `write` until the writer is `reset`. The
+    server will normally reject those writes anyway, since the chain of
+    versions is broken. Writes sent with `ExpectedVersion.Any` aren't
+    chained, so when one fails, the writes after it still get the server's
+    answer.
+
+    Args:
+        dispatcher: The MessageDispatcher used to send writes.
+        stream: The name of the stream to write to.
+        expected_version (optional): The expected version of the stream
+            for the first write.
+        max_in_flight (optional): The maximum number of unacknowledged
+            writes.
+        require_master (optional): True if writes must be sent direct to
+            the master node, otherwise False.
+    """
+
+    def __init__(
+        self,
+        dispatcher,
+        stream: str,
+        expected_version=msg.ExpectedVersion.Any,
+        max_in_flight: int = 4,
+        require_master: bool = False,
+        credential: Optional[msg.Credential] = None,
+    ):
+        self.dispatcher = dispatcher
+        self.stream = stream
+        self.max_in_flight = max_in_flight
+        self.require_master = require_master
+        self.credential = credential
+        self.next_version = expected_version
+        self.in_flight = deque()
+        self.failure = None
+        self._lock = asyncio.Lock()
+
+    async def write(self, events) -> asyncio.Future:
+        """Send a write once there is room in the window.
+
+        Returns:
+            A future for the write's WriteEventsCompleted message.
+
+        Raises:
+            WriteAborted: if an earlier write has failed.
+        """
+        async with self._lock:
+            while self.in_flight and (
+                self.next_version is None or len(self.in_flight) >= self.max_in_flight
+            ):
+                await asyncio.wait([self.in_flight[0].done])
+
+            if self.failure:
+                raise self.failure
+
+            conversation = convo.WriteEvents(
+                self.stream,
+                events,
+                expected_version=self.next_version,
+                require_master=self.require_master,
+                credential=self.credential,
+            )
+            sent = await self.dispatcher.start_conversation(conversation)
+            write = _OrderedWrite(conversation, sent, asyncio.Future())
+            self.in_flight.append(write)
+            self.next_version = next_expected_version(self.next_version, len(events))
+            sent.add_done_callback(lambda _: self._drain())
+
+            return write.done
+
+    async def flush(self) -> None:
+        """Wait until every write that has been sent is acknowledged or has
+        failed."""
+
+        if self.in_flight:
+            await asyncio.wait([w.done for w in self.in_flight])
+
+    def reset(self, expected_version) -> None:
+        """Clear a failure so that writes can continue from
+        `expected_version`, eg. after reloading the aggregate."""
+
+        if self.in_flight:
+            raise RuntimeError("Can't reset a writer with writes in flight")
+
+        self.failure = None
+        self.next_version = expected_version
+
+    def _drain(self) -> None:
+        # Acknowledgements are handled strictly in the order the writes were
+        # sent, so a failure in a chain aborts exactly the writes queued
+        # after it.
+        while self.in_flight and self.in_flight[0].sent.done():
+            write = self.in_flight.popleft()
+            conversation_id = write.conversation.conversation_id
+
+            chained = write.conversation.expected_version != msg.ExpectedVersion.Any
+
+            if write.sent.cancelled():
+                write.done.cancel()
+
+                if chained:
+                    self._abort(conversation_id, asyncio.CancelledError())
+
+                    return
+                continue
+
+            try:
+                result = write.sent.result()
+                _check_write(conversation_id, result)
+            except Exception as exn:
+                write.done.set_exception(exn)
+
+                if chained:
+                    self._abort(conversation_id, exn)
+
+                    return
+                continue
+
+            if self.next_version is None:
+                self.next_version = result.last_event_number
+
+            write.done.set_result(result)
+
+    def _abort(self, conversation_id, cause: Exception) -> None:
+        self.failure = exceptions.WriteAborted(conversation_id, cause)
+        LOG.debug("Write %s to %s failed: %s", conversation_id, self.stream, cause)
+
+        while self.in_flight:
+            write = self.in_flight.popleft()
+            write.sent.add_done_callback(_discard_result)
+            write.done.set_exception(self.failure)
+
+
+class _PendingWrite:
+    def __init__(self, stream, require_master, credential):
+        self.stream = stream
+        self.require_master = require_master
+        self.credential = credential
+        self.events = []
+        self.callers = []
+        self.timer = None
+
+
+class WriteCoalescer:
+    """Merges concurrent writes to the same stream into a single WriteEvents
+    conversation.
+
+    Writes are held for at most `max_delay` seconds, or until `max_events`
+    events are waiting for the same stream, and are then sent as one frame.
+    Only writes with `ExpectedVersion.Any` can be merged, since a merged
+    frame has a single expected version. Each caller receives a copy of the
+    WriteEventsCompleted message with the event numbers of their own events.
+
+    Args:
+        dispatcher: The MessageDispatcher used to send writes.
+        max_delay (optional): The longest time, in seconds, that a write
+            waits for others to join it.
+        max_events (optional): The number of waiting events that triggers
+            an immediate flush.
+    """
+
+    def __init__(self, dispatcher, max_delay=0.001, max_events=500, loop=None):
+        self.dispatcher = dispatcher
+        self.max_delay = max_delay
+        self.max_events = max_events
+        self.loop = loop or asyncio.get_event_loop()
+        self.pending = {}
+
+    async def write(
+        self,
+        stream: str,
+        events,
+        require_master: bool = False,
+        credential: Optional[msg.Credential] = None,
+    ) -> asyncio.Future:
+        """Queue events to be written with `ExpectedVersion.Any`.
+
+        Returns:
+            A future for this caller's WriteEventsCompleted.
+        """
+        key = (stream, require_master, id(credential))
+        batch = self.pending.get(key)
+
+        if batch is None:
+            batch = self.pending[key] = _PendingWrite(
+                stream, require_master, credential
+            )
+            batch.timer = self.loop.call_later(
+                self.max_delay, lambda: asyncio.ensure_future(self._flush(key, batch))
+            )
+
+        future = self.loop.create_future()
+        batch.callers.append((future, len(batch.events), len(events)))
+        batch.events.extend(events)
+
+        if len(batch.events) >= self.max_events:
+            await self._flush(key, batch)
+
+        return future
+
+    async def flush(self) -> None:
+        """Send every waiting write immediately."""
+
+        for key, batch in list(self.pending.items()):
+            await self._flush(key, batch)
+
+    async def _flush(self, key, batch: _PendingWrite) -> None:
+        if self.pending.get(key) is not batch:
+            return
+
+        del self.pending[key]
+        batch.timer.cancel()
+        LOG.debug(
+            "Coalesced %d writes of %d events to %s",
+            len(batch.callers),
+            len(batch.events),
+            batch.stream,
+        )
+
+        conversation = convo.WriteEvents(
+            batch.stream,
+            batch.events,
+            expected_version=msg.ExpectedVersion.Any,
+            require_master=batch.require_master,
+            credential=batch.credential,
+        )
+
+        try:
+            result = await self.dispatcher.start_conversation(conversation)
+        except Exception as exn:
+            self._fail(batch, exn)
+
+            return
+
+        result.add_done_callback(lambda f: self._fan_out(batch, f))
+
+    def _fail(self, batch: _PendingWrite, exn: Exception) -> None:
+        for future, _, _ in batch.callers:
+            if not future.done():
+                future.set_exception(exn)
+
+    def _fan_out(self, batch: _PendingWrite, result: asyncio.Future) -> None:
+        if result.cancelled():
+            for future, _, _ in batch.callers:
+                future.cancel()
+
+            return
+
+        if result.exception():
+            self._fail(batch, result.exception())
+
+            return
+
+        completed = result.result()
+
+        for future, offset, count in batch.callers:
+            if future.done():
+                continue
+
+            own = proto.WriteEventsCompleted()
+            own.CopyFrom(completed)
+
+            if completed.result == msg.OperationResult.Success:
+                own.first_event_number = completed.first_event_number + offset
+                own.last_event_number = own.first_event_number + count - 1
+            future.set_result(own)
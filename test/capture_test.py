@@ -0,0 +1,204 @@
+import asyncio
+import uuid
+
+import pytest
+
+from photonpump import messages as msg
+from photonpump import messages_pb2 as proto
+from photonpump.capture import (
+    CapturedChunk,
+    CaptureFile,
+    Direction,
+    capture_files,
+    read_capture,
+)
+from photonpump.connection import MessageDispatcher, MessageWriter
+from photonpump.conversations import ReadEvent
+from photonpump.replay import rebuild_conversation, replay
+from photonpump.tracing import Tracer
+
+
+def frame(message: msg.OutboundMessage) -> bytes:
+    return bytes(message.header_bytes) + message.payload
+
+
+def test_chunks_are_read_back_in_order(tmp_path):
+
+    path = str(tmp_path / "traffic.ppcap")
+    capture = CaptureFile(path)
+    capture.record(1, Direction.Outbound, b"request")
+    capture.record(2, Direction.Inbound, b"reply")
+    capture.close()
+
+    chunks = list(read_capture(path))
+
+    assert [(c.connection, c.direction, c.data) for c in chunks] == [
+        (1, Direction.Outbound, b"request"),
+        (2, Direction.Inbound, b"reply"),
+    ]
+    assert chunks[0].timestamp <= chunks[1].timestamp
+
+
+def test_captures_are_rotated(tmp_path):
+
+    path = str(tmp_path / "traffic.ppcap")
+    capture = CaptureFile(path, max_bytes=100, backups=2)
+
+    for i in range(10):
+        capture.record(1, Direction.Inbound, bytes([i]) * 40)
+    capture.close()
+
+    files = capture_files(path)
+    data = [c.data[0] for c in read_capture(*files)]
+
+    assert files == [path + ".2", path + ".1", path]
+    assert data == [6, 7, 8, 9]
+
+
+def test_a_truncated_record_is_skipped(tmp_path):
+
+    path = str(tmp_path / "traffic.ppcap")
+    capture = CaptureFile(path)
+    capture.record(1, Direction.Inbound, b"complete")
+    capture.record(1, Direction.Inbound, b"cut short")
+    capture.close()
+
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 3)
+
+    assert [c.data for c in read_capture(path)] == [b"complete"]
+
+
+def test_a_file_that_is_not_a_capture_is_rejected(tmp_path):
+
+    path = tmp_path / "notes.txt"
+    path.write_bytes(b"hello")
+
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+
+def test_passwords_are_redacted(tmp_path):
+
+    path = str(tmp_path / "traffic.ppcap")
+    request = msg.OutboundMessage(
+        uuid.uuid4(), msg.TcpCommand.Ping, b"", msg.Credential("admin", "changeit")
+    )
+
+    capture = CaptureFile(path)
+    capture.record(1, Direction.Outbound, frame(request))
+    capture.close()
+
+    [chunk] = read_capture(path)
+
+    assert b"admin" in chunk.data
+    assert b"changeit" not in chunk.data
+    assert len(chunk.data) == len(frame(request))
+
+
+def test_requests_are_rebuilt_as_conversations():
+
+    conversation_id = uuid.uuid4()
+    body = proto.ReadStreamEvents()
+    body.event_stream_id = "my-stream"
+    body.from_event_number = 10
+    body.max_count = 50
+    body.resolve_link_tos = True
+    body.require_master = False
+    request = msg.OutboundMessage(
+        conversation_id,
+        msg.TcpCommand.ReadStreamEventsBackward,
+        body.SerializeToString(),
+        msg.Credential("admin", "changeit"),
+    )
+
+    conversation = rebuild_conversation(frame(request))
+
+    assert conversation.conversation_id == conversation_id
+    assert conversation.stream == "my-stream"
+    assert conversation.from_event == 10
+    assert conversation.max_count == 50
+    assert conversation.direction == msg.StreamDirection.Backward
+
+    ack = msg.OutboundMessage(
+        uuid.uuid4(), msg.TcpCommand.PersistentSubscriptionAckEvents, b""
+    )
+    assert rebuild_conversation(frame(ack)) is None
+
+
+@pytest.mark.asyncio
+async def test_a_capture_is_replayed_through_the_dispatcher():
+
+    conversation = ReadEvent("my-stream", 3)
+    output = asyncio.Queue()
+    await conversation.start(output)
+    request = await output.get()
+
+    response = proto.ReadEventCompleted()
+    response.result = msg.ReadEventResult.Success
+    event = response.event.event
+    event.event_stream_id = "my-stream"
+    event.event_number = 3
+    event.event_id = uuid.uuid4().bytes_le
+    event.event_type = "thing_happened"
+    event.data_content_type = msg.ContentType.Json
+    event.metadata_content_type = msg.ContentType.Binary
+    event.data = b"{}"
+    reply = frame(
+        msg.OutboundMessage(
+            conversation.conversation_id,
+            msg.TcpCommand.ReadEventCompleted,
+            response.SerializeToString(),
+        )
+    )
+
+    chunks = [
+        CapturedChunk(1.0, 1, Direction.Outbound, frame(request)),
+        CapturedChunk(1.1, 1, Direction.Inbound, reply[:10]),
+        CapturedChunk(1.2, 1, Direction.Inbound, reply[10:]),
+    ]
+
+    finished = []
+    dispatcher = MessageDispatcher(tracer=Tracer(hook=finished.append))
+    stats = await replay(chunks, speed=10, dispatcher=dispatcher)
+    await asyncio.sleep(0)
+
+    assert (stats.chunks, stats.frames, stats.requests) == (2, 1, 1)
+    assert stats.bytes == len(reply)
+    assert stats.elapsed >= 0.02
+    assert [t.conversation_type for t in finished] == ["ReadEvent"]
+
+
+class Writer:
+    def __init__(self):
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written.extend(data)
+
+    async def drain(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_sent_frames_are_captured(tmp_path):
+
+    path = str(tmp_path / "traffic.ppcap")
+    capture = CaptureFile(path)
+    writer = Writer()
+    queue = asyncio.Queue()
+    message_writer = MessageWriter(
+        writer, 1, queue, capture=capture, capture_id=capture.connection_opened()
+    )
+    request = msg.OutboundMessage(uuid.uuid4(), msg.TcpCommand.Ping, b"")
+
+    await queue.put(request)
+    task = asyncio.ensure_future(message_writer.start())
+    await asyncio.sleep(0)
+    task.cancel()
+    capture.close()
+
+    [chunk] = read_capture(path)
+
+    assert (chunk.connection, chunk.direction) == (1, Direction.Outbound)
+    assert chunk.data == bytes(writer.written) == frame(request)
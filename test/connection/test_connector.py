@@ -69,6 +69,9 @@ async def test_when_a_server_disconnects(event_loop):
     If that happens, we should raise a disconnected event.
 
     We should also place a reconnection message on the control queue.
+
+    A quiet connection sends nothing, not even a heartbeat, so the server
+    has nothing unread when it goes away and the connection closes cleanly.
     """
 
     addr = NodeService("localhost", 8338, None)
@@ -97,7 +100,7 @@ async def test_when_a_server_disconnects(event_loop):
         server.stop()
 
         disconnect = await queue.next_event()
-        assert disconnect.command == ConnectorCommand.HandleConnectionFailed
+        assert disconnect.command == ConnectorCommand.HandleConnectionClosed
 
         reconnect = await queue.next_event()
         assert reconnect.command == ConnectorCommand.Connect
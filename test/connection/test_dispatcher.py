@@ -16,33 +16,42 @@ Right now, it's his job to make sure that the ReplyActions are handled properly.
 This feels totally wrong but it means that the Conversation interface is super
 simple and testable.
 """
+
 import asyncio
 import uuid
 
 import pytest
 
 from photonpump import messages_pb2 as proto
-from photonpump.connection import MessageDispatcher
+from photonpump.connection import Connector, MessageDispatcher, OutboundQueue
 from photonpump.conversations import (
     ConnectPersistentSubscription,
     IterStreamEvents,
     Ping,
+    WriteEvents,
 )
+from photonpump.discovery import NodeService, SingleNodeDiscovery
 from photonpump.exceptions import (
     NotAuthenticated,
+    NotMaster,
     PayloadUnreadable,
     StreamDeleted,
     SubscriptionCreationFailed,
     SubscriptionFailed,
+    TooBusy,
 )
 from photonpump.messages import (
     InboundMessage,
     NewEvent,
+    NotHandledReason,
     OutboundMessage,
+    Priority,
     ReadStreamResult,
     SubscriptionDropReason,
     TcpCommand,
 )
+from photonpump.metrics import Registry
+from photonpump.retry import RetryBudget, RetryPolicy
 
 from ..data import (
     persistent_subscription_confirmed,
@@ -385,3 +394,299 @@ async def test_when_connector_reconnected_retry_active_conversations():
     message = await out_queue.get()
 
     assert message.command == TcpCommand.ConnectToPersistentSubscription
+
+
+@pytest.mark.asyncio
+async def test_when_the_conversation_was_sent_to_a_follower():
+    """
+    If a node tells us it isn't the master, and tells us who is, we keep the
+    conversation so that it's re-sent once we've reconnected to the master.
+    After too many redirects we give up and return NotMaster to the caller.
+    """
+
+    redirects = []
+    dispatcher = MessageDispatcher(max_redirects=1)
+    dispatcher.redirect = lambda node: redirects.append(node) or True
+    conversation = Ping()
+    future = await dispatcher.start_conversation(conversation)
+
+    not_master = InboundMessage(
+        conversation.conversation_id, TcpCommand.NotHandled, _not_master_payload()
+    )
+    await dispatcher.dispatch(not_master, TeeQueue())
+
+    assert redirects == [NodeService("10.0.0.2", 1113, None)]
+    assert dispatcher.has_conversation(conversation.conversation_id)
+    assert not future.done()
+
+    await dispatcher.dispatch(not_master, TeeQueue())
+
+    with pytest.raises(NotMaster):
+        await asyncio.wait_for(future, 1)
+
+    assert len(redirects) == 1
+
+
+@pytest.mark.asyncio
+async def test_when_the_named_master_is_the_node_we_are_talking_to():
+    """
+    If the redirect won't reconnect us anywhere, because we're already
+    connected to the node that was named as master, we mustn't keep the
+    conversation waiting for a reconnect that never comes.
+    """
+
+    dispatcher = MessageDispatcher()
+    dispatcher.redirect = lambda node: False
+    conversation = Ping()
+    future = await dispatcher.start_conversation(conversation)
+
+    not_master = InboundMessage(
+        conversation.conversation_id, TcpCommand.NotHandled, _not_master_payload()
+    )
+    await dispatcher.dispatch(not_master, TeeQueue())
+
+    with pytest.raises(NotMaster) as exn:
+        await asyncio.wait_for(future, 1)
+
+    assert exn.value.master == NodeService("10.0.0.2", 1113, None)
+    assert not dispatcher.has_conversation(conversation.conversation_id)
+
+
+@pytest.mark.asyncio
+async def test_conversations_wait_for_a_pending_redirect():
+    """
+    When several conversations are told about the same new master, the
+    first schedules the move and the rest wait for it, since every active
+    conversation is re-sent once we've reconnected. Only when we're
+    already connected to the named master do we give up.
+    """
+
+    dispatcher = MessageDispatcher()
+    queue = TeeQueue()
+    connector = Connector(
+        SingleNodeDiscovery(NodeService("10.0.0.1", 1113, None)),
+        dispatcher,
+        ctrl_queue=queue,
+    )
+    connector.target_node = NodeService("10.0.0.1", 1113, None)
+    master = NodeService("10.0.0.2", 1113, None)
+
+    async def not_master():
+        conversation = Ping()
+        future = await dispatcher.start_conversation(conversation)
+        await dispatcher.dispatch(
+            InboundMessage(
+                conversation.conversation_id,
+                TcpCommand.NotHandled,
+                _not_master_payload(),
+            ),
+            TeeQueue(),
+        )
+        await asyncio.sleep(0)
+
+        return future
+
+    first = await not_master()
+    connector.redirect_target = master
+    second = await not_master()
+
+    assert not first.done()
+    assert not second.done()
+    assert [i.data for i in queue.items] == [master]
+
+    connector.target_node, connector.redirect_target = (master, None)
+    third = await not_master()
+
+    with pytest.raises(NotMaster):
+        await asyncio.wait_for(third, 1)
+
+
+def _not_master_payload():
+    info = proto.NotHandled.MasterInfo()
+    info.external_tcp_address = "10.0.0.2"
+    info.external_tcp_port = 1113
+    info.external_http_address = "10.0.0.2"
+    info.external_http_port = 2113
+
+    payload = proto.NotHandled()
+    payload.reason = NotHandledReason.NotMaster
+    payload.additional_info = info.SerializeToString()
+
+    return payload.SerializeToString()
+
+
+def _too_busy():
+    payload = proto.NotHandled()
+    payload.reason = NotHandledReason.TooBusy
+
+    return payload.SerializeToString()
+
+
+@pytest.mark.asyncio
+async def test_when_the_server_is_too_busy_for_a_read():
+    """
+    Idempotent conversations that the server was too busy to handle are sent
+    again after a short backoff, instead of failing.
+    """
+
+    output = TeeQueue()
+    dispatcher = MessageDispatcher(
+        retry_policy=RetryPolicy(base_delay=0.001, budget=RetryBudget(ratio=1))
+    )
+    await dispatcher.write_to(output)
+    conversation = Ping()
+    future = await dispatcher.start_conversation(conversation)
+    await output.get()
+
+    await dispatcher.dispatch(
+        InboundMessage(
+            conversation.conversation_id, TcpCommand.NotHandled, _too_busy()
+        ),
+        output,
+    )
+
+    retried = await asyncio.wait_for(output.get(), 1)
+
+    assert retried.command == TcpCommand.Ping
+    assert retried.conversation_id == conversation.conversation_id
+    assert not future.done()
+
+
+@pytest.mark.asyncio
+async def test_when_the_server_is_too_busy_for_a_write():
+
+    dispatcher = MessageDispatcher(
+        retry_policy=RetryPolicy(budget=RetryBudget(ratio=1))
+    )
+    conversation = WriteEvents("my-stream", [NewEvent("pony_jumped")])
+    future = await dispatcher.start_conversation(conversation)
+
+    await dispatcher.dispatch(
+        InboundMessage(
+            conversation.conversation_id, TcpCommand.NotHandled, _too_busy()
+        ),
+        TeeQueue(),
+    )
+
+    with pytest.raises(TooBusy):
+        await asyncio.wait_for(future, 1)
+
+
+@pytest.mark.asyncio
+async def test_the_time_to_the_first_reply_is_observed():
+
+    observed = []
+    output = TeeQueue()
+    dispatcher = MessageDispatcher()
+    dispatcher.observe_latency = observed.append
+    await dispatcher.write_to(output)
+
+    conversation = Ping()
+    await dispatcher.start_conversation(conversation)
+    await asyncio.sleep(0.01)
+    await dispatcher.dispatch(
+        InboundMessage(conversation.conversation_id, TcpCommand.Pong, bytes()), output
+    )
+
+    [latency] = observed
+    assert 0.01 <= latency < 1
+    assert dispatcher.sent_at == {}
+
+
+@pytest.mark.asyncio
+async def test_the_dispatcher_reports_conversations_and_latency():
+
+    metrics = Registry()
+    output = OutboundQueue(metrics=metrics)
+    dispatcher = MessageDispatcher(metrics=metrics)
+    await dispatcher.write_to(output)
+
+    conversation = Ping()
+    await dispatcher.start_conversation(conversation)
+
+    assert metrics.value("active_conversations", (("conversation", "Ping"),)) == 1
+    assert metrics.value("output_queue_depth") == 1
+
+    await output.get()
+    await dispatcher.dispatch(
+        InboundMessage(conversation.conversation_id, TcpCommand.Pong, bytes()), output
+    )
+
+    assert metrics.value("active_conversations", (("conversation", "Ping"),)) == 0
+    assert metrics.value("output_queue_depth") == 0
+    [histogram] = metrics.histograms["request_duration_seconds"].values()
+    assert histogram.count == 1
+    assert list(metrics.histograms["request_duration_seconds"]) == [
+        (("conversation", "Ping"),)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_jump_the_outbound_queue():
+
+    queue = OutboundQueue()
+    write = OutboundMessage(uuid.uuid4(), TcpCommand.WriteEvents, b"")
+    heartbeat = OutboundMessage(uuid.uuid4(), TcpCommand.HeartbeatResponse, b"")
+
+    await queue.put(write)
+    await queue.put(heartbeat)
+
+    assert queue.qsize() == 2
+    assert await queue.get() is heartbeat
+    assert await queue.get() is write
+    assert queue.empty()
+
+
+def _message(command, name, priorities=None):
+    # 82 bytes of payload and 18 of header make a 100 byte message.
+    message = OutboundMessage(uuid.uuid4(), command, b"x" * 82)
+    message.name = name
+
+    if priorities is not None:
+        priorities[message.conversation_id] = Priority.Bulk
+
+    return message
+
+
+@pytest.mark.asyncio
+async def test_bulk_messages_give_way_to_interactive_ones():
+    """
+    Interactive and bulk messages share the connection by deficit round
+    robin, so a backlog of bulk writes delays a read by a bounded amount.
+    """
+
+    queue = OutboundQueue(
+        quantum=100, weights=[(Priority.Interactive, 2), (Priority.Bulk, 1)]
+    )
+    bulk = [
+        _message(TcpCommand.WriteEvents, f"B{i}", queue.priorities) for i in range(3)
+    ]
+    interactive = [_message(TcpCommand.Read, f"I{i}") for i in range(4)]
+    ack = _message(TcpCommand.PersistentSubscriptionAckEvents, "ack")
+
+    for message in bulk + interactive + [ack]:
+        await queue.put(message)
+
+    order = [(await queue.get()).name for _ in range(queue.qsize())]
+
+    assert order == ["ack", "B0", "I0", "I1", "B1", "I2", "I3", "B2"]
+
+
+@pytest.mark.asyncio
+async def test_the_dispatcher_registers_conversation_priorities():
+
+    output = OutboundQueue()
+    dispatcher = MessageDispatcher()
+    await dispatcher.write_to(output)
+
+    conversation = Ping()
+    conversation.priority = Priority.Bulk
+    await dispatcher.start_conversation(conversation)
+
+    assert output.priorities == {conversation.conversation_id: Priority.Bulk}
+
+    await dispatcher.dispatch(
+        InboundMessage(conversation.conversation_id, TcpCommand.Pong, bytes()), output
+    )
+
+    assert output.priorities == {}
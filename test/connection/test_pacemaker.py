@@ -69,6 +69,31 @@ async def test_when_sending_a_heartbeat_request():
     )
 
 
+@pytest.mark.asyncio
+async def test_when_the_heartbeat_round_trip_is_measured():
+    """
+    When the server answers our heartbeat, we should tell the connector how
+    long the round trip took.
+    """
+
+    heartbeat_id = uuid.uuid4()
+    out_queue = TeeQueue()
+    connector = FakeConnector()
+    pace_maker = PaceMaker(out_queue, connector, heartbeat_id=heartbeat_id)
+
+    await pace_maker.send_heartbeat()
+    await asyncio.sleep(0.01)
+    await pace_maker.handle_response(
+        InboundMessage(heartbeat_id, TcpCommand.HeartbeatResponse, bytes())
+    )
+
+    await pace_maker.await_heartbeat_response()
+
+    assert connector.successes == 1
+    [rtt] = connector.rtts
+    assert 0.01 <= rtt < 1
+
+
 @pytest.mark.asyncio
 async def test_when_the_heartbeat_times_out():
     """
@@ -156,3 +181,105 @@ async def test_when_the_heartbeat_succeeds():
 
     assert connector.failures == []
     assert connector.successes == 1
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_are_skipped_while_the_server_is_talking():
+    """
+    Any frame from the server proves that the connection is alive, so we
+    only send a heartbeat once the connection has gone quiet.
+    """
+
+    out_queue = TeeQueue()
+    pace_maker = PaceMaker(out_queue, FakeConnector(), heartbeat_period=0.05)
+    heartbeats = asyncio.ensure_future(pace_maker.send_heartbeats())
+
+    for _ in range(10):
+        pace_maker.record_activity()
+        await asyncio.sleep(0.01)
+
+    assert out_queue.items == []
+
+    await asyncio.sleep(0.1)
+    heartbeats.cancel()
+
+    assert out_queue.items[0].command == TcpCommand.HeartbeatRequest
+
+
+@pytest.mark.asyncio
+async def test_a_late_heartbeat_is_forgiven_while_the_server_is_talking():
+
+    connector = FakeConnector()
+    pace_maker = PaceMaker(TeeQueue(), connector, response_timeout=0.01)
+
+    await pace_maker.send_heartbeat()
+    await asyncio.sleep(0)
+    pace_maker.record_activity()
+
+    await pace_maker.await_heartbeat_response()
+
+    assert connector.failures == []
+    assert connector.successes == 1
+
+
+def test_the_response_timeout_adapts_to_the_round_trip_time():
+
+    pace_maker = PaceMaker(TeeQueue(), None, min_response_timeout=0.1)
+
+    assert pace_maker.timeout == 10
+
+    for _ in range(20):
+        pace_maker.record_rtt(0.01)
+
+    assert pace_maker.timeout == 0.1
+    assert pace_maker.rtt_histogram.count == 20
+
+    for _ in range(20):
+        pace_maker.record_rtt(1)
+
+    assert 1 < pace_maker.timeout < 10
+
+
+@pytest.mark.asyncio
+async def test_a_response_after_the_timeout_is_ignored():
+    """
+    If the response turns up after we stopped waiting for it, the read loop
+    mustn't fall over trying to resolve a future that was cancelled.
+    """
+
+    heartbeat_id = uuid.uuid4()
+    connector = FakeConnector()
+    pace_maker = PaceMaker(
+        TeeQueue(), connector, heartbeat_id=heartbeat_id, response_timeout=0.01
+    )
+
+    await pace_maker.send_heartbeat()
+    await pace_maker.await_heartbeat_response()
+
+    await pace_maker.handle_response(
+        InboundMessage(heartbeat_id, TcpCommand.HeartbeatResponse, bytes())
+    )
+
+    assert len(connector.failures) == 1
+    assert connector.successes == 0
+
+
+def test_the_adaptive_timeout_has_a_realistic_floor():
+    """
+    However fast the round trips, we don't give up on a heartbeat so soon
+    that a brief stall on the server counts as a failure.
+    """
+
+    pace_maker = PaceMaker(TeeQueue(), None)
+
+    for _ in range(20):
+        pace_maker.record_rtt(0.001)
+
+    assert pace_maker.timeout == 5
+
+    pace_maker = PaceMaker(TeeQueue(), None, response_timeout=2)
+
+    for _ in range(20):
+        pace_maker.record_rtt(0.001)
+
+    assert pace_maker.timeout == 2
@@ -0,0 +1,198 @@
+"""
+When the node we were connected to dies, the connector can race connections
+to every node in the gossip, starting with the node that discovery chose.
+Each node gets a head start over the next, so the preferred node wins unless
+it's slow or down, and we never wait out a full connect timeout on a dead
+node while a healthy one is available.
+"""
+
+import asyncio
+
+import pytest
+
+import photonpump.connection
+from photonpump.connection import staggered_connect
+from photonpump.discovery import NodeService
+
+MASTER = NodeService("10.0.0.1", 1113, None)
+SLAVE = NodeService("10.0.0.2", 1113, None)
+CLONE = NodeService("10.0.0.3", 1113, None)
+
+
+class FakeSocket:
+    def __init__(self, node):
+        self.node = node
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeNetwork:
+    """Connects to each node after a scripted delay, or fails if the delay
+    is None. Nodes without a delay never answer, and stubborn nodes finish
+    connecting even if the attempt is cancelled."""
+
+    def __init__(self, delays, stubborn=()):
+        self.delays = delays
+        self.stubborn = stubborn
+        self.started = []
+        self.cancelled = []
+        self.sockets = []
+
+    async def open_socket(self, node, loop):
+        self.started.append(node)
+
+        if node not in self.delays:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.cancelled.append(node)
+                raise
+
+        if self.delays[node] is None:
+            raise ConnectionRefusedError()
+
+        try:
+            await asyncio.sleep(self.delays[node])
+        except asyncio.CancelledError:
+            if node not in self.stubborn:
+                raise
+
+        sock = FakeSocket(node)
+        self.sockets.append(sock)
+
+        return sock
+
+
+@pytest.fixture
+def network(monkeypatch):
+    def make_network(delays, stubborn=()):
+        fake = FakeNetwork(delays, stubborn)
+        monkeypatch.setattr(photonpump.connection, "_open_socket", fake.open_socket)
+
+        return fake
+
+    return make_network
+
+
+@pytest.mark.asyncio
+async def test_a_healthy_first_node_wins(network):
+
+    fake = network({MASTER: 0, SLAVE: 0})
+
+    node, sock = await staggered_connect([MASTER, SLAVE], 0.1)
+
+    assert node == MASTER
+    assert sock.node == MASTER
+    assert fake.started == [MASTER]
+
+
+@pytest.mark.asyncio
+async def test_a_stalled_node_loses_to_the_next(network):
+
+    fake = network({SLAVE: 0})
+
+    node, _ = await asyncio.wait_for(staggered_connect([MASTER, SLAVE], 0.01), 1)
+    await asyncio.sleep(0)
+
+    assert node == SLAVE
+    assert fake.cancelled == [MASTER]
+
+
+@pytest.mark.asyncio
+async def test_a_failure_starts_the_next_attempt_immediately(network):
+
+    fake = network({MASTER: None, SLAVE: None, CLONE: 0})
+
+    node, _ = await asyncio.wait_for(staggered_connect([MASTER, SLAVE, CLONE], 60), 1)
+
+    assert node == CLONE
+    assert fake.started == [MASTER, SLAVE, CLONE]
+
+
+@pytest.mark.asyncio
+async def test_when_every_node_fails(network):
+
+    network({MASTER: None, SLAVE: None})
+
+    with pytest.raises(ConnectionError):
+        await staggered_connect([MASTER, SLAVE], 0.01)
+
+
+@pytest.mark.asyncio
+async def test_losers_that_connect_anyway_are_closed(network):
+
+    fake = network({MASTER: 0.2, SLAVE: 0}, stubborn=[MASTER])
+
+    node, sock = await staggered_connect([MASTER, SLAVE], 0.01)
+    await asyncio.sleep(0.3)
+
+    assert node == SLAVE
+    assert not sock.closed
+    assert [(s.node, s.closed) for s in fake.sockets] == [
+        (SLAVE, False),
+        (MASTER, True),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_when_no_node_answers_before_the_deadline(network):
+
+    fake = network({MASTER: 0.05}, stubborn=[MASTER])
+
+    with pytest.raises(asyncio.TimeoutError):
+        await staggered_connect([MASTER, SLAVE], 0.01, timeout=0.02)
+    await asyncio.sleep(0.1)
+
+    [sock] = fake.sockets
+    assert sock.closed
+    assert fake.cancelled == [SLAVE]
+
+
+@pytest.mark.asyncio
+async def test_connecting_to_a_real_listener():
+
+    server = await asyncio.start_server(lambda r, w: w.close(), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    listener = NodeService("127.0.0.1", port, None)
+
+    node, sock = await staggered_connect([listener], 0.1)
+    sock.close()
+    server.close()
+    await server.wait_closed()
+
+    assert node == listener
+
+
+@pytest.mark.asyncio
+async def test_a_slow_first_node_is_preferred(network):
+
+    fake = network({MASTER: 0.05, SLAVE: 0, CLONE: 0})
+
+    node, sock = await staggered_connect(
+        [MASTER, SLAVE, CLONE], 0.01, timeout=1, prefer_first=True
+    )
+    await asyncio.sleep(0)
+
+    assert node == MASTER
+    assert [(s.node, s.closed) for s in fake.sockets] == [
+        (SLAVE, True),
+        (MASTER, False),
+    ]
+    assert fake.started == [MASTER, SLAVE]
+
+
+@pytest.mark.asyncio
+async def test_a_stalled_first_node_is_given_up_at_the_deadline(network):
+
+    fake = network({SLAVE: 0})
+
+    node, sock = await staggered_connect(
+        [MASTER, SLAVE], 0.01, timeout=0.05, prefer_first=True
+    )
+    await asyncio.sleep(0)
+
+    assert node == SLAVE
+    assert not sock.closed
+    assert fake.cancelled == [MASTER]
@@ -1,8 +1,11 @@
+import asyncio
 import uuid
 
 import pytest
 
-from photonpump import connect
+from photonpump import Client, connect
+
+from .fakes import SpyDispatcher
 
 
 @pytest.mark.asyncio
@@ -27,3 +30,20 @@ async def test_connect_subscription(event_loop):
 
         event = await subscription.events.anext()
         assert event.original_event_id == event_id
+
+
+@pytest.mark.asyncio
+async def test_get_event_reads_the_requested_event_number():
+
+    dispatcher = SpyDispatcher()
+    client = Client(None, dispatcher)
+
+    read = asyncio.ensure_future(client.get_event("my-stream", 7))
+    await asyncio.sleep(0)
+
+    [(conversation, _)] = dispatcher.active_conversations.values()
+    assert conversation.stream == "my-stream"
+    assert conversation.event_number == 7
+    assert conversation.resolve_link_tos is True
+
+    read.cancel()
@@ -0,0 +1,274 @@
+"""
+A catch-up subscription reads a stream's history in pages, then subscribes
+to the stream and reads whatever was written between the end of the history
+and the subscription's confirmation. Live events received in the meantime
+are buffered and de-duplicated by event number.
+"""
+
+from uuid import uuid4
+
+import pytest
+
+from photonpump import exceptions as exn
+from photonpump import messages as msg
+from photonpump import messages_pb2 as proto
+from photonpump.conversations import CatchupSubscription
+
+from ..fakes import TeeQueue
+from .test_volatile_subscription import confirm_subscription, event_appeared
+
+
+async def read_page(convo, output, numbers, end_of_stream, result=None, last=None):
+    """Answer a read with the events in `numbers`. Like the server, we report
+    the last event in the stream, `last`, which is only the last event on
+    the page if the page is the end of the stream."""
+
+    if last is None and not numbers:
+        last = -1
+    elif last is None:
+        last = numbers[-1] if end_of_stream else numbers[-1] + 1
+
+    response = proto.ReadStreamEventsCompleted()
+    response.result = result or msg.ReadStreamResult.Success
+    response.is_end_of_stream = end_of_stream
+    response.last_commit_position = 0
+    response.last_event_number = last
+    response.next_event_number = numbers[-1] + 1 if numbers else -1
+
+    for number in numbers:
+        e = response.events.add()
+        e.event.event_stream_id = "my-stream"
+        e.event.event_number = number
+        e.event.event_id = uuid4().bytes_le
+        e.event.event_type = "pony_jumped"
+        e.event.data_content_type = msg.ContentType.Json
+        e.event.metadata_content_type = msg.ContentType.Binary
+        e.event.data = b"{}"
+
+    await convo.respond_to(
+        msg.InboundMessage(
+            convo.conversation_id,
+            msg.TcpCommand.ReadStreamEventsForwardCompleted,
+            response.SerializeToString(),
+        ),
+        output,
+    )
+
+
+def read_request(message):
+    payload = proto.ReadStreamEvents()
+    payload.ParseFromString(message.payload)
+
+    return payload
+
+
+async def take(subscription, count):
+    return [
+        (await subscription.events.anext()).event.event_number for _ in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_reads_from_the_event_after_the_checkpoint():
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", start_from=9, batch_size=3)
+    await convo.start(output)
+
+    [request] = output.items
+
+    assert request.command == msg.TcpCommand.ReadStreamEventsForward
+    assert read_request(request).from_event_number == 10
+    assert read_request(request).max_count == 3
+
+
+@pytest.mark.asyncio
+async def test_pages_through_history_then_subscribes():
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", batch_size=2)
+    await convo.start(output)
+
+    await read_page(convo, output, [0, 1], end_of_stream=False)
+    await read_page(convo, output, [2], end_of_stream=True)
+
+    [_, second_page, subscribe] = output.items
+    assert read_request(second_page).from_event_number == 2
+    assert subscribe.command == msg.TcpCommand.SubscribeToStream
+
+    subscription = await convo.result
+    assert await take(subscription, 3) == [0, 1, 2]
+    assert subscription.checkpoint == 2
+
+
+@pytest.mark.asyncio
+async def test_overlap_is_read_and_buffered_events_are_deduplicated():
+    """
+    If events 3 and 4 are written after our last historical read but
+    before the subscription is confirmed, we need to read them before
+    draining the live buffer, and must not deliver them twice.
+    """
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", batch_size=10)
+    await convo.start(output)
+
+    await read_page(convo, output, [0, 1, 2], end_of_stream=True)
+    await confirm_subscription(convo, output, event_number=4)
+    await event_appeared(convo, output, 4)
+    await event_appeared(convo, output, 5)
+
+    catch_up_request = output.items[-1]
+    assert read_request(catch_up_request).from_event_number == 3
+
+    await read_page(convo, output, [3, 4], end_of_stream=True)
+    await event_appeared(convo, output, 6)
+
+    subscription = await convo.result
+    assert await take(subscription, 7) == [0, 1, 2, 3, 4, 5, 6]
+    assert convo.phase == CatchupSubscription.Phase.LIVE
+
+
+@pytest.mark.asyncio
+async def test_catching_up_reads_every_page_before_going_live():
+    """
+    If more than a page of events was written between our last historical
+    read and the subscription, we keep reading until we reach the event
+    the subscription was confirmed at, not just the first page.
+    """
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", batch_size=3)
+    await convo.start(output)
+
+    await read_page(convo, output, [0, 1, 2], end_of_stream=True)
+    subscription = await convo.result
+    assert await take(subscription, 3) == [0, 1, 2]
+
+    await confirm_subscription(convo, output, event_number=10)
+    await event_appeared(convo, output, 11)
+    await read_page(convo, output, [3, 4, 5], end_of_stream=False, last=11)
+
+    assert convo.phase == CatchupSubscription.Phase.CATCHING_UP
+    assert read_request(output.items[-1]).from_event_number == 6
+    assert await take(subscription, 3) == [3, 4, 5]
+
+    await read_page(convo, output, [6, 7, 8], end_of_stream=False, last=11)
+    assert await take(subscription, 3) == [6, 7, 8]
+
+    await read_page(convo, output, [9, 10, 11], end_of_stream=False, last=11)
+    await event_appeared(convo, output, 12)
+
+    assert await take(subscription, 4) == [9, 10, 11, 12]
+    assert convo.phase == CatchupSubscription.Phase.LIVE
+
+
+@pytest.mark.asyncio
+async def test_missing_stream_goes_straight_to_live():
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream")
+    await convo.start(output)
+
+    await read_page(
+        convo, output, [], end_of_stream=False, result=msg.ReadStreamResult.NoStream
+    )
+    await confirm_subscription(convo, output, event_number=-1)
+    await event_appeared(convo, output, 0)
+
+    subscription = await convo.result
+    assert await take(subscription, 1) == [0]
+
+
+@pytest.mark.asyncio
+async def test_restart_resumes_from_last_delivered_event():
+    """
+    When the connection drops, the dispatcher calls start again. We should
+    carry on from the last event we delivered rather than the original
+    checkpoint.
+    """
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", batch_size=10)
+    await convo.start(output)
+    await read_page(convo, output, [0, 1, 2], end_of_stream=True)
+
+    await convo.start(output)
+
+    assert read_request(output.items[-1]).from_event_number == 3
+
+
+@pytest.mark.asyncio
+async def test_paging_waits_for_a_slow_consumer():
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", batch_size=2)
+    await convo.start(output)
+
+    await read_page(convo, output, [0, 1], end_of_stream=False)
+    await read_page(convo, output, [2, 3], end_of_stream=False)
+
+    assert len(output.items) == 2
+    assert convo.deferred_page == 4
+
+    subscription = await convo.result
+    await take(subscription, 2)
+    assert len(output.items) == 2
+
+    await take(subscription, 1)
+    assert read_request(output.items[-1]).from_event_number == 4
+
+
+@pytest.mark.asyncio
+async def test_unsubscribe_while_reading_history():
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", batch_size=2)
+    await convo.start(output)
+    await read_page(convo, output, [0, 1], end_of_stream=False)
+
+    subscription = await convo.result
+    await subscription.unsubscribe()
+
+    assert convo.is_complete
+    assert [m.command for m in output.items] == [
+        msg.TcpCommand.ReadStreamEventsForward,
+        msg.TcpCommand.ReadStreamEventsForward,
+    ]
+
+    await read_page(convo, output, [2, 3], end_of_stream=False)
+
+    assert [e.event.event_number async for e in subscription.events] == [0, 1]
+    assert len(output.items) == 2
+
+
+@pytest.mark.asyncio
+async def test_unsubscribe_while_catching_up():
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream", batch_size=10)
+    await convo.start(output)
+    await read_page(convo, output, [0, 1, 2], end_of_stream=True)
+    await confirm_subscription(convo, output, event_number=4)
+
+    subscription = await convo.result
+    await subscription.unsubscribe()
+
+    assert convo.is_complete
+    assert output.items[-1].command == msg.TcpCommand.UnsubscribeFromStream
+    assert [e.event.event_number async for e in subscription.events] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_access_denied():
+
+    output = TeeQueue()
+    convo = CatchupSubscription("my-stream")
+    await convo.start(output)
+
+    await read_page(
+        convo, output, [], end_of_stream=False, result=msg.ReadStreamResult.AccessDenied
+    )
+
+    with pytest.raises(exn.AccessDenied):
+        await convo.result
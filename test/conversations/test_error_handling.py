@@ -6,6 +6,7 @@ import photonpump.exceptions as exn
 import photonpump.messages as msg
 import photonpump.messages_pb2 as proto
 from photonpump.conversations import Ping, WriteEvents
+from photonpump.discovery import NodeService
 
 from ..fakes import TeeQueue
 
@@ -134,6 +135,35 @@ async def test_not_master():
         assert exc.conversation_id == conversation.conversation_id
 
 
+def not_master(address="10.0.0.2", port=1113):
+    info = proto.NotHandled.MasterInfo()
+    info.external_tcp_address = address
+    info.external_tcp_port = port
+    info.external_http_address = address
+    info.external_http_port = 2113
+
+    payload = proto.NotHandled()
+    payload.reason = msg.NotHandledReason.NotMaster
+    payload.additional_info = info.SerializeToString()
+
+    return payload.SerializeToString()
+
+
+@pytest.mark.asyncio
+async def test_not_master_carries_the_master_address():
+
+    output = TeeQueue()
+    conversation = Ping()
+    await conversation.respond_to(
+        msg.InboundMessage(uuid4(), msg.TcpCommand.NotHandled, not_master()), output
+    )
+
+    with pytest.raises(exn.NotMaster) as exc:
+        await conversation.result
+
+    assert exc.value.master == NodeService("10.0.0.2", 1113, None)
+
+
 @pytest.mark.asyncio
 async def test_decode_error():
     """
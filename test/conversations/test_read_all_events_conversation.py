@@ -0,0 +1,231 @@
+from uuid import uuid4
+
+import pytest
+
+from photonpump import exceptions
+from photonpump import messages as msg
+from photonpump import messages_pb2 as proto
+from photonpump.conversations import IterAllEvents, ReadAllEvents
+
+from ..fakes import TeeQueue
+
+
+async def reply_to(convo, output, positions, next_position, result=None):
+    response = proto.ReadAllEventsCompleted()
+    response.result = result or msg.ReadAllResult.Success
+    response.commit_position = positions[0] if positions else 0
+    response.prepare_position = positions[0] if positions else 0
+    response.next_commit_position = next_position
+    response.next_prepare_position = next_position
+
+    for idx, position in enumerate(positions):
+        e = response.events.add()
+        e.event.event_stream_id = "stream-%d" % idx
+        e.event.event_number = idx
+        e.event.event_id = uuid4().bytes_le
+        e.event.event_type = "pony_jumped"
+        e.event.data_content_type = msg.ContentType.Json
+        e.event.metadata_content_type = msg.ContentType.Binary
+        e.event.data = b"{}"
+        e.commit_position = position
+        e.prepare_position = position
+
+    await convo.respond_to(
+        msg.InboundMessage(
+            convo.conversation_id,
+            msg.TcpCommand.ReadAllEventsForwardCompleted,
+            response.SerializeToString(),
+        ),
+        output,
+    )
+
+
+def read_request(message):
+    body = proto.ReadAllEvents()
+    body.ParseFromString(message.payload)
+
+    return body
+
+
+@pytest.mark.asyncio
+async def test_read_all_request():
+
+    output = TeeQueue()
+    convo = ReadAllEvents(msg.Position(10, 9), max_count=20)
+    await convo.start(output)
+    request = await output.get()
+
+    body = read_request(request)
+
+    assert request.command is msg.TcpCommand.ReadAllEventsForward
+    assert body.commit_position == 10
+    assert body.prepare_position == 9
+    assert body.max_count == 20
+    assert body.resolve_link_tos is True
+    assert body.require_master is False
+
+
+@pytest.mark.asyncio
+async def test_read_all_backward_starts_at_the_end():
+
+    output = TeeQueue()
+    convo = ReadAllEvents(direction=msg.StreamDirection.Backward)
+    await convo.start(output)
+    request = await output.get()
+
+    body = read_request(request)
+
+    assert request.command is msg.TcpCommand.ReadAllEventsBackward
+    assert (body.commit_position, body.prepare_position) == (-1, -1)
+
+
+@pytest.mark.asyncio
+async def test_read_all_success():
+
+    output = TeeQueue()
+    convo = ReadAllEvents(max_count=2)
+    await convo.start(output)
+    await reply_to(convo, output, [100, 200], next_position=300)
+
+    result = await convo.result
+
+    assert isinstance(result, msg.AllStreamSlice)
+    assert [e.position for e in result] == [
+        msg.Position(100, 100),
+        msg.Position(200, 200),
+    ]
+    assert result.next_position == msg.Position(300, 300)
+    assert not result.is_end_of_stream
+    assert convo.is_complete
+
+
+@pytest.mark.asyncio
+async def test_read_all_access_denied():
+
+    output = TeeQueue()
+    convo = ReadAllEvents()
+    await convo.start(output)
+    await reply_to(convo, output, [], 0, result=msg.ReadAllResult.AccessDenied)
+
+    with pytest.raises(exceptions.AccessDenied):
+        await convo.result
+
+
+@pytest.mark.asyncio
+async def test_iter_all_pages_by_position():
+
+    output = TeeQueue()
+    convo = IterAllEvents(batch_size=2)
+    await convo.start(output)
+
+    await reply_to(convo, output, [100, 200], next_position=300)
+
+    [_, second_request] = output.items
+    assert read_request(second_request).commit_position == 300
+
+    await reply_to(convo, output, [300], next_position=400)
+    await reply_to(convo, output, [], next_position=400)
+
+    iterator = await convo.result
+    events = [e async for e in iterator]
+
+    assert [e.position.commit for e in events] == [100, 200, 300]
+    assert iterator.checkpoint == msg.Position(300, 300)
+    assert convo.is_complete
+
+
+@pytest.mark.asyncio
+async def test_iter_all_restarts_from_the_next_position():
+
+    output = TeeQueue()
+    convo = IterAllEvents(batch_size=2)
+    await convo.start(output)
+    await reply_to(convo, output, [100, 200], next_position=300)
+
+    await convo.start(output)
+
+    assert read_request(output.items[-1]).commit_position == 300
+
+
+@pytest.mark.asyncio
+async def test_iter_all_error_after_first_page():
+
+    output = TeeQueue()
+    convo = IterAllEvents(batch_size=2)
+    await convo.start(output)
+    await reply_to(convo, output, [100, 200], next_position=300)
+    await reply_to(convo, output, [], 0, result=msg.ReadAllResult.Error)
+
+    iterator = await convo.result
+
+    with pytest.raises(exceptions.ReadError):
+        [e async for e in iterator]
+
+
+@pytest.mark.asyncio
+async def test_iter_all_resumes_after_the_given_position():
+
+    output = TeeQueue()
+    convo = IterAllEvents(msg.Position(200, 200), batch_size=3)
+    await convo.start(output)
+
+    assert read_request(output.items[0]).commit_position == 200
+
+    await reply_to(convo, output, [200, 300], next_position=400)
+    await reply_to(convo, output, [], next_position=400)
+
+    iterator = await convo.result
+    events = [e async for e in iterator]
+
+    assert [e.position.commit for e in events] == [300]
+
+
+@pytest.mark.asyncio
+async def test_iter_all_continues_after_a_short_page():
+
+    output = TeeQueue()
+    convo = IterAllEvents(batch_size=3)
+    await convo.start(output)
+
+    await reply_to(convo, output, [100], next_position=400)
+
+    assert not convo.is_complete
+    assert read_request(output.items[-1]).commit_position == 400
+
+    await reply_to(convo, output, [400, 500], next_position=600)
+    await reply_to(convo, output, [], next_position=600)
+
+    iterator = await convo.result
+    events = [e async for e in iterator]
+
+    assert [e.position.commit for e in events] == [100, 400, 500]
+    assert convo.is_complete
+
+
+@pytest.mark.asyncio
+async def test_iter_all_stops_when_the_position_does_not_move():
+
+    output = TeeQueue()
+    convo = IterAllEvents(msg.Position(300, 300), batch_size=3)
+    await convo.start(output)
+
+    await reply_to(convo, output, [300], next_position=300)
+
+    iterator = await convo.result
+    events = [e async for e in iterator]
+
+    assert events == []
+    assert len(output.items) == 1
+
+
+@pytest.mark.asyncio
+async def test_read_all_short_page_is_not_the_end():
+
+    output = TeeQueue()
+    convo = ReadAllEvents(max_count=10)
+    await convo.start(output)
+    await reply_to(convo, output, [100, 200], next_position=300)
+
+    result = await convo.result
+
+    assert not result.is_end_of_stream
@@ -69,6 +69,31 @@ async def test_read_single_event_success():
     assert result.link is None
 
 
+@pytest.mark.asyncio
+async def test_a_successful_read_is_not_logged(caplog):
+
+    convo = ReadEvent("my-stream", 23)
+    response = proto.ReadEventCompleted()
+    response.result = msg.ReadEventResult.Success
+    response.event.event.event_stream_id = "my-stream"
+    response.event.event.event_number = 23
+    response.event.event.event_id = uuid4().bytes_le
+    response.event.event.event_type = "event-type"
+    response.event.event.data_content_type = msg.ContentType.Json
+    response.event.event.metadata_content_type = msg.ContentType.Binary
+    response.event.event.data = b"{}"
+
+    await convo.respond_to(
+        msg.InboundMessage(
+            uuid4(), msg.TcpCommand.ReadEventCompleted, response.SerializeToString()
+        ),
+        None,
+    )
+    await convo.result
+
+    assert caplog.records == []
+
+
 def error_result(error_code):
     data = bytearray(b"\x08\x00\x12\x00")
     data[1] = error_code
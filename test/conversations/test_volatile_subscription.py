@@ -0,0 +1,127 @@
+from uuid import uuid4
+
+import pytest
+
+from photonpump import exceptions as exn
+from photonpump import messages as msg
+from photonpump import messages_pb2 as proto
+from photonpump.conversations import SubscribeToStream
+
+from ..fakes import TeeQueue
+
+
+async def confirm_subscription(convo, output, event_number=10, commit=23):
+    response = proto.SubscriptionConfirmation()
+    response.last_event_number = event_number
+    response.last_commit_position = commit
+
+    await convo.respond_to(
+        msg.InboundMessage(
+            convo.conversation_id,
+            msg.TcpCommand.SubscriptionConfirmation,
+            response.SerializeToString(),
+        ),
+        output,
+    )
+
+
+async def event_appeared(convo, output, event_number, stream="my-stream"):
+    response = proto.StreamEventAppeared()
+    response.event.event.event_stream_id = stream
+    response.event.event.event_number = event_number
+    response.event.event.event_id = uuid4().bytes_le
+    response.event.event.event_type = "pony_jumped"
+    response.event.event.data_content_type = msg.ContentType.Json
+    response.event.event.metadata_content_type = msg.ContentType.Binary
+    response.event.event.data = b"{}"
+    response.event.commit_position = event_number
+    response.event.prepare_position = event_number
+
+    await convo.respond_to(
+        msg.InboundMessage(
+            convo.conversation_id,
+            msg.TcpCommand.StreamEventAppeared,
+            response.SerializeToString(),
+        ),
+        output,
+    )
+
+
+async def drop_subscription(convo, output, reason):
+    response = proto.SubscriptionDropped()
+    response.reason = reason
+
+    await convo.respond_to(
+        msg.InboundMessage(
+            convo.conversation_id,
+            msg.TcpCommand.SubscriptionDropped,
+            response.SerializeToString(),
+        ),
+        output,
+    )
+
+
+@pytest.mark.asyncio
+async def test_subscribe_request():
+
+    output = TeeQueue()
+    convo = SubscribeToStream("my-stream", resolve_links=False)
+    await convo.start(output)
+    [request] = output.items
+
+    payload = proto.SubscribeToStream()
+    payload.ParseFromString(request.payload)
+
+    assert request.command == msg.TcpCommand.SubscribeToStream
+    assert payload.event_stream_id == "my-stream"
+    assert payload.resolve_link_tos is False
+
+
+@pytest.mark.asyncio
+async def test_events_are_streamed_after_confirmation():
+
+    output = TeeQueue()
+    convo = SubscribeToStream("my-stream")
+    await convo.start(output)
+    await confirm_subscription(convo, output, event_number=10)
+
+    subscription = await convo.result
+    assert subscription.first_event_number == 10
+
+    await event_appeared(convo, output, 11)
+    await event_appeared(convo, output, 12)
+    await drop_subscription(convo, output, msg.SubscriptionDropReason.Unsubscribed)
+
+    events = [e async for e in subscription.events]
+
+    assert [e.event.event_number for e in events] == [11, 12]
+    assert subscription.checkpoint == 12
+    assert convo.is_complete
+
+
+@pytest.mark.asyncio
+async def test_unsubscribe():
+
+    output = TeeQueue()
+    convo = SubscribeToStream("my-stream")
+    await convo.start(output)
+    await confirm_subscription(convo, output)
+    subscription = await convo.result
+
+    await subscription.unsubscribe()
+
+    [_, request] = output.items
+    assert request.command == msg.TcpCommand.UnsubscribeFromStream
+    assert request.conversation_id == convo.conversation_id
+
+
+@pytest.mark.asyncio
+async def test_subscription_dropped_before_confirmation():
+
+    output = TeeQueue()
+    convo = SubscribeToStream("my-stream")
+    await convo.start(output)
+    await drop_subscription(convo, output, msg.SubscriptionDropReason.AccessDenied)
+
+    with pytest.raises(exn.SubscriptionCreationFailed):
+        await convo.result
@@ -0,0 +1,253 @@
+"""
+A WriteTransaction starts a transaction, streams events to it in chunks with
+a bounded number of chunks awaiting acknowledgement, and then commits.
+"""
+
+import asyncio
+
+import pytest
+
+import photonpump.exceptions as exn
+import photonpump.messages as msg
+import photonpump.messages_pb2 as proto
+from photonpump.conversations import EventChunker, WriteTransaction
+
+from ..fakes import TeeQueue
+
+
+def events(count, size=10):
+    return (
+        msg.NewEvent("pony_jumped", data={"n": n, "padding": "x" * size})
+        for n in range(count)
+    )
+
+
+async def reply(convo, output, command, response, result=msg.OperationResult.Success):
+    response.result = result
+
+    await convo.respond_to(
+        msg.InboundMessage(
+            convo.conversation_id, command, response.SerializeToString()
+        ),
+        output,
+    )
+
+
+async def start_completed(convo, output, transaction_id=57, **kwargs):
+    response = proto.TransactionStartCompleted()
+    response.transaction_id = transaction_id
+    await reply(
+        convo, output, msg.TcpCommand.TransactionStartCompleted, response, **kwargs
+    )
+
+
+async def write_completed(convo, output, transaction_id=57, **kwargs):
+    response = proto.TransactionWriteCompleted()
+    response.transaction_id = transaction_id
+    await reply(
+        convo, output, msg.TcpCommand.TransactionWriteCompleted, response, **kwargs
+    )
+
+
+async def commit_completed(convo, output, transaction_id=57):
+    response = proto.TransactionCommitCompleted()
+    response.transaction_id = transaction_id
+    response.first_event_number = 0
+    response.last_event_number = 9
+    await reply(convo, output, msg.TcpCommand.TransactionCommitCompleted, response)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def commands(output):
+    return [m.command for m in output.items]
+
+
+@pytest.mark.asyncio
+async def test_chunker_respects_count_and_size():
+
+    chunker = EventChunker(events(5, size=100), max_count=3, max_bytes=400)
+    sizes = []
+
+    while not chunker.exhausted:
+        batch = proto.TransactionWrite()
+        count = await chunker.fill(batch.events)
+
+        if count:
+            sizes.append(count)
+
+    assert sizes == [2, 2, 1]
+    assert chunker.events_read == 5
+
+
+@pytest.mark.asyncio
+async def test_chunker_accepts_async_iterables():
+    async def source():
+        for event in events(3):
+            yield event
+
+    chunker = EventChunker(source(), max_count=2)
+    batch = proto.TransactionWrite()
+
+    assert await chunker.fill(batch.events) == 2
+    assert await chunker.fill(batch.events) == 1
+    assert await chunker.fill(batch.events) == 0
+    assert chunker.exhausted
+
+
+@pytest.mark.asyncio
+async def test_start_transaction():
+
+    output = TeeQueue()
+    convo = WriteTransaction("my-stream", events(10), expected_version=4)
+    await convo.start(output)
+
+    [request] = output.items
+    body = proto.TransactionStart()
+    body.ParseFromString(request.payload)
+
+    assert request.command == msg.TcpCommand.TransactionStart
+    assert body.event_stream_id == "my-stream"
+    assert body.expected_version == 4
+
+
+@pytest.mark.asyncio
+async def test_chunks_are_windowed_and_committed():
+
+    output = TeeQueue()
+    convo = WriteTransaction("my-stream", events(10), chunk_events=3, window=2)
+    await convo.start(output)
+    await start_completed(convo, output)
+    await settle()
+
+    assert commands(output) == [
+        msg.TcpCommand.TransactionStart,
+        msg.TcpCommand.TransactionWrite,
+        msg.TcpCommand.TransactionWrite,
+    ]
+
+    body = proto.TransactionWrite()
+    body.ParseFromString(output.items[1].payload)
+    assert body.transaction_id == 57
+    assert len(body.events) == 3
+
+    for _ in range(4):
+        await write_completed(convo, output)
+        await settle()
+
+    assert commands(output)[-1] == msg.TcpCommand.TransactionCommit
+    assert commands(output).count(msg.TcpCommand.TransactionWrite) == 4
+    assert convo.events_written == 10
+
+    await commit_completed(convo, output)
+
+    result = await convo.result
+    assert result.last_event_number == 9
+    assert convo.is_complete
+
+
+@pytest.mark.asyncio
+async def test_empty_transaction_commits_immediately():
+
+    output = TeeQueue()
+    convo = WriteTransaction("my-stream", [])
+    await convo.start(output)
+    await start_completed(convo, output)
+    await settle()
+
+    assert commands(output) == [
+        msg.TcpCommand.TransactionStart,
+        msg.TcpCommand.TransactionCommit,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_unacknowledged_chunks_are_resent_on_restart():
+
+    output = TeeQueue()
+    convo = WriteTransaction("my-stream", events(10), chunk_events=3, window=2)
+    await convo.start(output)
+    await start_completed(convo, output)
+    await settle()
+    await write_completed(convo, output)
+    await settle()
+
+    output.items.clear()
+    await convo.start(output)
+
+    assert commands(output) == [
+        msg.TcpCommand.TransactionWrite,
+        msg.TcpCommand.TransactionWrite,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_restart_before_transaction_started_fails():
+
+    output = TeeQueue()
+    convo = WriteTransaction("my-stream", events(10))
+    await convo.start(output)
+    await convo.start(output)
+
+    assert commands(output) == [msg.TcpCommand.TransactionStart]
+
+    with pytest.raises(exn.ConnectionClosed):
+        await convo.result
+
+
+@pytest.mark.asyncio
+async def test_source_is_not_read_by_the_dispatcher():
+
+    output = TeeQueue()
+    release = asyncio.Event()
+
+    async def source():
+        await release.wait()
+
+        for event in events(2):
+            yield event
+
+    convo = WriteTransaction("my-stream", source())
+    await convo.start(output)
+    await start_completed(convo, output)
+    await settle()
+
+    assert commands(output) == [msg.TcpCommand.TransactionStart]
+
+    release.set()
+    await settle()
+
+    assert commands(output)[1:] == [msg.TcpCommand.TransactionWrite]
+
+
+@pytest.mark.asyncio
+async def test_failing_source_fails_the_transaction():
+    def source():
+        yield from events(1)
+        raise ValueError("boom")
+
+    output = TeeQueue()
+    convo = WriteTransaction("my-stream", source())
+    await convo.start(output)
+    await start_completed(convo, output)
+    await settle()
+
+    with pytest.raises(ValueError):
+        await convo.result
+
+
+@pytest.mark.asyncio
+async def test_wrong_expected_version():
+
+    output = TeeQueue()
+    convo = WriteTransaction("my-stream", events(10), expected_version=4)
+    await convo.start(output)
+    await start_completed(
+        convo, output, result=msg.OperationResult.WrongExpectedVersion
+    )
+
+    with pytest.raises(exn.WrongExpectedVersion):
+        await convo.result
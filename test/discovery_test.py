@@ -1,5 +1,8 @@
-from typing import List
+import asyncio
+import time
+from typing import List, NamedTuple
 
+import aiodns
 import aiohttp
 import pytest
 from aioresponses import aioresponses
@@ -9,6 +12,9 @@ from photonpump.discovery import (
     DiscoveredNode,
     DiscoveryFailed,
     DiscoveryRetryPolicy,
+    DnsSeedFinder,
+    GossipMonitor,
+    HealthTracker,
     NodeService,
     NodeState,
     SingleNodeDiscovery,
@@ -16,8 +22,10 @@ from photonpump.discovery import (
     Stats,
     fetch_new_gossip,
     get_discoverer,
+    gossip_freshness,
     read_gossip,
     select,
+    select_followers,
 )
 
 from . import data
@@ -307,3 +315,428 @@ async def test_cluster_discovery_mark_failed():
     discoverer.mark_failed(node)
 
     assert finder == [node]
+
+
+def test_followers_exclude_master_and_dead_nodes():
+
+    slave = GOOD_NODE._replace(state=NodeState.Slave)
+    clone = GOOD_NODE._replace(state=NodeState.Clone)
+    dead = GOOD_NODE._replace(state=NodeState.Slave, is_alive=False)
+
+    assert select_followers([clone, GOOD_NODE, dead, slave]) == [slave, clone]
+
+
+class ScriptedDiscovery:
+    """Returns a different gossip on each refresh."""
+
+    def __init__(self, *gossips):
+        self.gossips = list(gossips)
+        self.best_node = None
+
+    async def get_gossip(self):
+        gossip = self.gossips.pop(0)
+
+        if gossip is None:
+            raise DiscoveryFailed()
+        self.best_node = select(gossip)
+
+        return gossip
+
+
+@pytest.mark.asyncio
+async def test_gossip_monitor_reports_master_changes():
+
+    new_master = GOOD_NODE._replace(external_tcp=NodeService("10.0.0.9", 1113, None))
+    demoted = GOOD_NODE._replace(state=NodeState.Slave)
+    reported = []
+
+    monitor = GossipMonitor(
+        ScriptedDiscovery([GOOD_NODE], [GOOD_NODE], None, [demoted, new_master]),
+        on_master_changed=reported.append,
+    )
+
+    for _ in range(4):
+        await monitor.refresh()
+
+    assert reported == [GOOD_NODE.external_tcp, new_master.external_tcp]
+
+
+@pytest.mark.asyncio
+async def test_gossip_monitor_ignores_clusters_without_a_master():
+
+    reported = []
+    monitor = GossipMonitor(
+        ScriptedDiscovery([GOOD_NODE._replace(state=NodeState.PreMaster)]),
+        on_master_changed=reported.append,
+    )
+
+    await monitor.refresh()
+
+    assert reported == []
+
+
+@pytest.mark.asyncio
+async def test_gossip_monitor_passes_on_each_gossip():
+
+    received = []
+    slave = GOOD_NODE._replace(state=NodeState.Slave)
+    monitor = GossipMonitor(
+        ScriptedDiscovery([GOOD_NODE], None, [slave]), on_gossip=received.append
+    )
+
+    for _ in range(3):
+        await monitor.refresh()
+
+    assert received == [[GOOD_NODE], [slave]]
+
+
+def with_epoch(gossip, epoch_number):
+    for member in gossip["members"]:
+        member["epochNumber"] = epoch_number
+        member["writerCheckpoint"] = 100
+
+    return gossip
+
+
+def test_gossip_freshness_uses_epoch_then_checkpoint():
+
+    old = read_gossip(with_epoch(data.make_gossip("1.1.1.1"), 3))
+    new = read_gossip(with_epoch(data.make_gossip("2.2.2.2"), 4))
+
+    assert gossip_freshness(new) > gossip_freshness(old)
+    assert gossip_freshness([]) == (-1, -1)
+
+
+class no_wait(DiscoveryRetryPolicy):
+    async def wait(self, seed):
+        pass
+
+
+class ScriptedSession:
+    """Answers gossip requests from a list of payloads per seed.
+
+    A payload of None fails the request, and a seed without payloads never
+    answers.
+    """
+
+    def __init__(self, responses):
+        self.responses = {
+            f"http://{seed.address}:{seed.port}/gossip": list(payloads)
+            for (seed, payloads) in responses.items()
+        }
+        self.cancelled = []
+
+    async def get(self, url):
+        if not self.responses.get(url):
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.cancelled.append(url)
+                raise
+
+        payload = self.responses[url].pop(0)
+
+        if payload is None:
+            raise aiohttp.ClientError()
+
+        return ScriptedResponse(payload)
+
+
+class ScriptedResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def json(self):
+        return self.payload
+
+
+SEED_A = NodeService("1.2.3.4", 2113, None)
+SEED_B = NodeService("1.2.3.5", 2113, None)
+
+
+@pytest.mark.asyncio
+async def test_discovery_prefers_the_freshest_gossip():
+    """
+    When several seeds answer, we should use the gossip from the most
+    recent epoch, since a partitioned seed may still name an old master.
+    """
+
+    session = ScriptedSession(
+        {
+            SEED_A: [with_epoch(data.make_gossip("2.3.4.5"), 3)],
+            SEED_B: [with_epoch(data.make_gossip("2.3.4.6"), 4)],
+        }
+    )
+    discoverer = ClusterDiscovery(
+        StaticSeedFinder([SEED_A, SEED_B]), session, no_wait()
+    )
+
+    assert await discoverer.discover() == NodeService("2.3.4.6", 1113, None)
+
+
+@pytest.mark.asyncio
+async def test_discovery_uses_another_seed_when_one_fails():
+
+    retry = no_wait()
+    session = ScriptedSession(
+        {SEED_A: [None, None], SEED_B: [None, data.make_gossip("2.3.4.5")]}
+    )
+    discoverer = ClusterDiscovery(StaticSeedFinder([SEED_A, SEED_B]), session, retry)
+
+    assert await discoverer.discover() == NodeService("2.3.4.5", 1113, None)
+    assert retry.stats[SEED_A].consecutive_failures == 2
+    assert retry.stats[SEED_B].successes == 1
+
+
+@pytest.mark.asyncio
+async def test_discovery_does_not_wait_for_a_stalled_seed():
+
+    session = ScriptedSession({SEED_B: [data.make_gossip("2.3.4.5")]})
+    discoverer = ClusterDiscovery(
+        StaticSeedFinder([SEED_A, SEED_B]), session, no_wait(), freshness_window=0
+    )
+
+    node = await asyncio.wait_for(discoverer.discover(), 1)
+    await asyncio.sleep(0)
+
+    assert node == NodeService("2.3.4.5", 1113, None)
+    assert session.cancelled == ["http://1.2.3.4:2113/gossip"]
+
+
+class ARecord(NamedTuple):
+    host: str
+    ttl: int
+
+
+class ScriptedResolver:
+    """Answers each query with the next result, raising it if it's an
+    exception."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.queries = 0
+
+    async def query(self, name, qtype):
+        self.queries += 1
+        result = self.results.pop(0)
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+
+@pytest.mark.asyncio
+async def test_dns_answers_are_cached_for_their_ttl():
+
+    resolver = ScriptedResolver([ARecord("10.0.0.1", 60), ARecord("10.0.0.2", 30)])
+    finder = DnsSeedFinder("eventstore.test", resolver)
+
+    for _ in range(3):
+        finder.seeds = []
+        assert await finder.next()
+
+    assert resolver.queries == 1
+    assert 29 < finder.expires - time.monotonic() <= 30
+
+
+@pytest.mark.asyncio
+async def test_expired_dns_answers_are_served_while_refreshing():
+
+    resolver = ScriptedResolver(
+        [ARecord("10.0.0.1", 60)], aiodns.error.DNSError(), [ARecord("10.0.0.2", 60)]
+    )
+    finder = DnsSeedFinder("eventstore.test", resolver)
+    await finder.next()
+
+    finder.expires = 0
+    finder.seeds = []
+
+    assert await finder.next() == NodeService("10.0.0.1", 2113, None)
+    await asyncio.sleep(0)
+
+    assert resolver.queries == 2
+    assert not finder.expired
+
+    finder.expires = 0
+    finder.seeds = []
+    await finder.next()
+    await asyncio.sleep(0)
+    finder.seeds = []
+
+    assert await finder.next() == NodeService("10.0.0.2", 2113, None)
+
+
+@pytest.mark.asyncio
+async def test_failing_dns_seeds_are_tried_last():
+
+    resolver = ScriptedResolver(
+        [ARecord("10.0.0.1", 60), ARecord("10.0.0.2", 60), ARecord("10.0.0.3", 60)]
+    )
+    finder = DnsSeedFinder("eventstore.test", resolver)
+    await finder.reset_to_dns()
+
+    finder.mark_failed(NodeService("10.0.0.1", 2113, None))
+    finder.mark_failed(NodeService("10.0.0.1", 2113, None))
+    finder.mark_failed(NodeService("10.0.0.2", 2113, None))
+    await finder.reset_to_dns()
+
+    assert [seed.address for seed in finder.seeds] == [
+        "10.0.0.3",
+        "10.0.0.2",
+        "10.0.0.1",
+    ]
+
+
+def test_node_health_is_smoothed():
+
+    node = NodeService("10.0.0.1", 1113, None)
+    health = HealthTracker(alpha=0.5)
+    health.record_latency(node, 0.1)
+    health.record_latency(node, 0.3)
+
+    assert health[node].latency == pytest.approx(0.2)
+    assert health[NodeService("10.0.0.2", 1113, None)].score == 0
+
+
+def test_nodes_that_keep_failing_are_sick():
+
+    node = NodeService("10.0.0.1", 1113, None)
+    health = HealthTracker()
+    health.record_latency(node, 0.01)
+    health.record_failure(node)
+
+    assert health[node].healthy
+
+    health.record_failure(node)
+
+    assert not health[node].healthy
+
+
+def test_followers_are_ranked_by_health():
+
+    slow = GOOD_NODE._replace(
+        state=NodeState.Slave, external_tcp=NodeService("10.0.0.1", 1113, None)
+    )
+    fast = GOOD_NODE._replace(
+        state=NodeState.Clone, external_tcp=NodeService("10.0.0.2", 1113, None)
+    )
+    sick = GOOD_NODE._replace(
+        state=NodeState.Slave, external_tcp=NodeService("10.0.0.3", 1113, None)
+    )
+
+    health = HealthTracker()
+    health.record_heartbeat(slow.external_tcp, 0.2)
+    health.record_heartbeat(fast.external_tcp, 0.01)
+    health.record_failure(sick.external_tcp)
+    health.record_failure(sick.external_tcp)
+
+    assert select_followers([slow, sick, fast]) == [slow, sick, fast]
+    assert select_followers([slow, sick, fast], health) == [fast, slow, sick]
+
+
+@pytest.mark.asyncio
+async def test_seeds_are_ranked_by_health():
+
+    seeds = [NodeService(f"10.0.0.{i}", 2113, None) for i in range(1, 4)]
+    health = HealthTracker()
+    health.record_latency(seeds[0], 0.3)
+    health.record_latency(seeds[1], 0.1)
+    health.record_latency(seeds[2], 0.2)
+    finder = StaticSeedFinder(seeds, health=health)
+
+    assert await finder.sample(3) == [seeds[1], seeds[2], seeds[0]]
+
+
+def test_sick_nodes_are_not_retried():
+
+    node = NodeService("10.0.0.1", 2113, None)
+    health = HealthTracker()
+    retry = DiscoveryRetryPolicy(retries_per_node=3, health=health)
+
+    for _ in range(2):
+        health.record_failure(node)
+        retry.record_failure(node)
+
+    assert retry.stats[node].consecutive_failures == 2
+    assert not retry.should_retry(node)
+
+
+@pytest.mark.asyncio
+async def test_tcp_failures_do_not_count_against_the_seed():
+    """
+    A node's gossip seed and its TCP endpoint share an address, but a
+    connector that can't reach the TCP port mustn't make us give up on the
+    seed, which may be the only one we were given.
+    """
+
+    seed = NodeService("10.0.0.1", 2113, None)
+    tcp = NodeService("10.0.0.1", 1113, None)
+    health = HealthTracker()
+    finder = StaticSeedFinder([seed], health=health)
+    retry = DiscoveryRetryPolicy(retries_per_node=3, health=health)
+    discoverer = ClusterDiscovery(finder, None, retry, health=health)
+
+    health.record_failure(tcp)
+    health.record_failure(tcp)
+    discoverer.record_failure(seed)
+
+    assert not retry.should_retry(tcp)
+    assert health[seed].healthy
+    assert await finder.next() == seed
+
+
+@pytest.mark.asyncio
+async def test_sick_seeds_are_kept_until_their_retries_run_out():
+
+    seed = NodeService("10.0.0.1", 2113, None)
+    health = HealthTracker()
+    finder = StaticSeedFinder([seed], health=health)
+    retry = DiscoveryRetryPolicy(retries_per_node=3, health=health)
+    discoverer = ClusterDiscovery(finder, None, retry, health=health)
+
+    discoverer.record_failure(seed)
+    discoverer.record_failure(seed)
+
+    assert not health[seed].healthy
+    assert await finder.next() == seed
+
+    discoverer.record_failure(seed)
+
+    assert await finder.next() is None
+
+
+def cluster_gossip(size):
+    return [
+        GOOD_NODE._replace(external_http=NodeService(f"10.0.0.{i}", 2113, None))
+        for i in range(1, size + 1)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_gossip_does_not_grow_the_static_seeds():
+
+    finder = StaticSeedFinder([NodeService("10.0.0.1", 2113, None)])
+    discoverer = ClusterDiscovery(finder, None, no_wait())
+    gossip = cluster_gossip(5)
+
+    for _ in range(1000):
+        discoverer.record_gossip(await finder.next(), gossip)
+        await finder.sample(1)
+
+    assert len(finder.candidates) <= 5
+
+
+@pytest.mark.asyncio
+async def test_gossip_does_not_grow_the_dns_seeds():
+
+    resolver = ScriptedResolver([ARecord("10.0.0.1", 60)])
+    finder = DnsSeedFinder("eventstore.test", resolver)
+    discoverer = ClusterDiscovery(finder, None, no_wait())
+    gossip = cluster_gossip(5)
+
+    for _ in range(1000):
+        discoverer.record_gossip(await finder.next(), gossip)
+        await finder.sample(1)
+
+    assert len(finder.seeds) == 5
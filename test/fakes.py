@@ -126,9 +126,11 @@ class FakeConnector:
         self.stopped = Event()
         self.failures = []
         self.successes = 0
+        self.rtts = []
 
-    def heartbeat_received(self, conversation_id):
+    def heartbeat_received(self, conversation_id, rtt=None):
         self.successes += 1
+        self.rtts.append(rtt)
 
     def heartbeat_failed(self, exn):
         self.failures.append(exn)
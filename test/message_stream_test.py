@@ -1,11 +1,14 @@
 import asyncio
 import binascii
+import logging
 import uuid
 
 import pytest
 
+from photonpump import messages
 from photonpump import messages_pb2 as proto
 from photonpump.connection import MessageReader
+from photonpump.instrumentation import LogLevels
 from photonpump.messages import TcpCommand
 from .fakes import TeeQueue
 
@@ -78,6 +81,9 @@ class FakePacemaker(TeeQueue):
     async def handle_request(self, request):
         await self.put(request)
 
+    def record_activity(self):
+        pass
+
 
 class message_reader:
     async def __aenter__(self):
@@ -222,3 +228,31 @@ async def test_two_messages_three_calls():
 
         assert len(messages.items) == 1
         assert len(pacemaker.items) == 1
+
+
+@pytest.mark.asyncio
+async def test_reading_at_the_default_log_level_formats_nothing(monkeypatch, caplog):
+    def fail(*args):
+        raise AssertionError("The payload was dumped")
+
+    monkeypatch.setattr(messages, "dump", fail)
+
+    async with message_reader() as (stream, received, _):
+        stream.feed_data(ReadEventResult + persistent_stream_event_appeared)
+        await received.next_event(2)
+
+    assert caplog.records == []
+
+
+def test_log_levels_are_read_from_the_logger():
+
+    logger = logging.getLogger("photonpump.test.levels")
+    logger.setLevel(logging.WARNING)
+    levels = LogLevels(logger)
+
+    assert not (levels.debug or levels.trace or levels.insane)
+
+    logger.setLevel(logging.TRACE)
+    levels.refresh()
+
+    assert levels.debug and levels.trace and not levels.insane
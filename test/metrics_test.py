@@ -0,0 +1,71 @@
+import math
+
+from photonpump.metrics import NULL_METRICS, Histogram, Registry
+
+
+def test_an_empty_histogram_has_no_quantiles():
+
+    assert math.isnan(Histogram().quantile(0.5))
+
+
+def test_quantiles_are_interpolated_within_buckets():
+
+    histogram = Histogram(buckets=[1, 2, 4])
+
+    for value in [0.5, 1.5, 1.5, 3]:
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.count == 4
+    assert histogram.sum == 6.5
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1) == 4
+
+
+def test_values_beyond_the_last_bucket():
+
+    histogram = Histogram(buckets=[1])
+    histogram.observe(5)
+
+    assert histogram.counts == [0, 1]
+    assert histogram.quantile(0.99) == 1
+
+
+def test_the_null_metrics_are_disabled():
+
+    assert not NULL_METRICS.enabled
+    NULL_METRICS.inc("frames_sent_total")
+
+
+def test_counters_and_gauges_accumulate():
+
+    metrics = Registry()
+    metrics.inc("frames_sent_total")
+    metrics.inc("frames_sent_total", 2)
+    metrics.add("output_queue_depth", 3)
+    metrics.add("output_queue_depth", -1)
+
+    assert metrics.value("frames_sent_total") == 3
+    assert metrics.value("output_queue_depth") == 2
+    assert metrics.value("reconnects_total") == 0
+
+
+def test_rendering_in_the_prometheus_text_format():
+
+    metrics = Registry(buckets=[0.1, 1])
+    metrics.inc("reconnects_total")
+    metrics.add("active_conversations", 2, (("conversation", "ReadEvent"),))
+    metrics.observe("request_duration_seconds", 0.5, (("command", 'a"b'),))
+
+    assert metrics.render().splitlines() == [
+        "# TYPE photonpump_reconnects_total counter",
+        "photonpump_reconnects_total 1",
+        "# TYPE photonpump_active_conversations gauge",
+        'photonpump_active_conversations{conversation="ReadEvent"} 2',
+        "# TYPE photonpump_request_duration_seconds histogram",
+        'photonpump_request_duration_seconds_bucket{command="a\\"b",le="0.1"} 0',
+        'photonpump_request_duration_seconds_bucket{command="a\\"b",le="1"} 1',
+        'photonpump_request_duration_seconds_bucket{command="a\\"b",le="+Inf"} 1',
+        'photonpump_request_duration_seconds_sum{command="a\\"b"} 0.5',
+        'photonpump_request_duration_seconds_count{command="a\\"b"} 1',
+    ]
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from photonpump.retry import AimdLimiter, RetryBudget, RetryPolicy, backoff_delay
+
+
+def test_backoff_is_jittered_below_an_exponential_ceiling():
+
+    delays = [backoff_delay(3, base=0.1, maximum=10) for _ in range(100)]
+
+    assert all(0 <= d <= 0.8 for d in delays)
+    assert len(set(delays)) > 1
+    assert backoff_delay(30, base=0.1, maximum=2) <= 2
+
+
+def test_budget_allows_a_fraction_of_requests():
+
+    budget = RetryBudget(ratio=0.5, min_per_second=0)
+
+    for _ in range(4):
+        budget.deposit()
+
+    assert [budget.withdraw() for _ in range(3)] == [True, True, False]
+
+
+def test_policy_stops_after_max_attempts():
+
+    policy = RetryPolicy(max_attempts=2, budget=RetryBudget(ratio=1))
+
+    for _ in range(3):
+        policy.record_request()
+
+    assert policy.next_delay(0) is not None
+    assert policy.next_delay(1) is not None
+    assert policy.next_delay(2) is None
+
+
+def test_limiter_backs_off_multiplicatively_and_grows_additively():
+
+    limiter = AimdLimiter(initial=8, cooldown=60)
+
+    limiter.record_overload()
+    limiter.record_overload()
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        limiter.record_success()
+
+    assert 4.9 < limiter.limit < 5
+
+
+@pytest.mark.asyncio
+async def test_limiter_blocks_beyond_the_limit():
+
+    limiter = AimdLimiter(initial=1)
+    await limiter.acquire()
+
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    limiter.release()
+    await asyncio.wait_for(waiter, 1)
+    assert limiter.in_flight == 1
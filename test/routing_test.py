@@ -0,0 +1,285 @@
+import asyncio
+import uuid
+
+import pytest
+
+import photonpump.messages as msg
+from photonpump.connection import Client, Event, MessageDispatcher
+from photonpump.conversations import ReadEvent, WriteEvents
+from photonpump.discovery import (
+    DiscoveredNode,
+    NodeService,
+    NodeState,
+    SingleNodeDiscovery,
+)
+from photonpump.routing import (
+    ClusterRouter,
+    ConnectionPool,
+    ConnectionStats,
+    PooledConnection,
+    ReadPreference,
+    stream_affinity,
+)
+
+NODE = NodeService("10.0.0.1", 1113, None)
+
+
+class FakeConnector:
+    def __init__(self):
+        self.connected = Event()
+        self.disconnected = Event()
+        self.targets = []
+        self.stopped = False
+
+    async def start(self, target=None):
+        self.targets.append(target)
+
+    async def stop(self, exn=None):
+        self.stopped = True
+
+
+def make_pool(size=3):
+    connections = [
+        PooledConnection(i, FakeConnector(), MessageDispatcher()) for i in range(size)
+    ]
+
+    for connection in connections:
+        connection.connector.connected(NODE)
+
+    return ConnectionPool(SingleNodeDiscovery(NODE), connections)
+
+
+def write(stream):
+    return WriteEvents(stream, [msg.NewEvent("pony_jumped")])
+
+
+@pytest.mark.asyncio
+async def test_writes_to_a_stream_share_a_connection():
+
+    pool = make_pool()
+
+    for _ in range(3):
+        await pool.start_conversation(write("my-stream"))
+
+    expected = stream_affinity("my-stream", 3)
+    stats = pool.stats()
+
+    assert stats[expected].active_conversations == 3
+    assert sum(s.active_conversations for s in stats) == 3
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_the_least_loaded_connection():
+
+    pool = make_pool()
+    busy = pool.connections[stream_affinity("my-stream", 3)]
+    await pool.start_conversation(write("my-stream"))
+
+    for _ in range(2):
+        await pool.start_conversation(ReadEvent("some-stream", 0))
+
+    assert len(busy.dispatcher.active_conversations) == 1
+    assert [s.active_conversations for s in pool.stats()] == [1, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_reads_avoid_disconnected_connections():
+
+    pool = make_pool(2)
+    pool.connections[0].connector.disconnected()
+
+    await pool.start_conversation(ReadEvent("some-stream", 0))
+    await pool.start_conversation(ReadEvent("some-stream", 0))
+
+    assert pool.stats() == [
+        ConnectionStats(0, False, 0, 0),
+        ConnectionStats(1, True, 2, 0),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_every_connection_targets_the_discovered_node():
+
+    pool = make_pool()
+    await pool.start()
+
+    assert [c.connector.targets for c in pool.connections] == [[NODE]] * 3
+
+    await pool.stop()
+
+    assert all(c.connector.stopped for c in pool.connections)
+
+
+@pytest.mark.asyncio
+async def test_queue_depth_is_reported():
+
+    pool = make_pool(1)
+    output = asyncio.Queue()
+    await pool.connections[0].dispatcher.write_to(output)
+
+    await pool.start_conversation(ReadEvent("some-stream", 0))
+
+    assert pool.stats()[0].queue_depth == 1
+
+
+def member(state, address):
+    return DiscoveredNode(
+        state=state,
+        is_alive=True,
+        internal_tcp=None,
+        internal_http=None,
+        external_http=None,
+        external_tcp=NodeService(address, 1113, None),
+    )
+
+
+class FakeClusterDiscovery:
+    def __init__(self):
+        self.last_gossip = [
+            member(NodeState.Master, "10.0.0.1"),
+            member(NodeState.Clone, "10.0.0.2"),
+            member(NodeState.Slave, "10.0.0.3"),
+        ]
+
+    async def discover(self):
+        return NODE
+
+
+async def make_router(read_preference=ReadPreference.Follower, max_followers=2):
+    def connection_factory(index, discovery):
+        return PooledConnection(index, FakeConnector(), MessageDispatcher())
+
+    router = ClusterRouter(
+        FakeClusterDiscovery(),
+        connection_factory,
+        read_preference=read_preference,
+        max_followers=max_followers,
+    )
+    await router.start()
+
+    for connection in router.connections:
+        connection.connector.connected(None)
+
+    return router
+
+
+@pytest.mark.asyncio
+async def test_router_connects_to_master_then_followers():
+
+    router = await make_router(max_followers=1)
+
+    assert router.master.connector.targets == [NODE]
+    assert [f.connector.targets for f in router.followers] == [
+        [NodeService("10.0.0.3", 1113, None)]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_followers_and_writes_to_master():
+
+    router = await make_router()
+
+    await router.start_conversation(write("my-stream"))
+    await router.start_conversation(ReadEvent("my-stream", 0))
+    await router.start_conversation(ReadEvent("my-stream", 0))
+    await router.start_conversation(ReadEvent("my-stream", 0, require_master=True))
+
+    assert [s.active_conversations for s in router.stats()] == [2, 1, 1]
+
+
+async def start_iterating(client, **kwargs):
+    """Start Client.iter, which won't get past its first page here, and
+    return the task so that it can be cancelled."""
+
+    task = asyncio.ensure_future(client.iter("my-stream", **kwargs).__anext__())
+    await asyncio.sleep(0)
+
+    return task
+
+
+@pytest.mark.asyncio
+async def test_iter_honours_require_master():
+
+    router = await make_router()
+    client = Client(router, router)
+    correlation_id = uuid.uuid4()
+
+    tasks = [
+        await start_iterating(client),
+        await start_iterating(
+            client, require_master=True, correlation_id=correlation_id
+        ),
+    ]
+
+    assert [s.active_conversations for s in router.stats()] == [1, 1, 0]
+    assert correlation_id in router.master.dispatcher.active_conversations
+
+    for task in tasks:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_reads_fall_back_to_master_without_followers():
+
+    router = await make_router()
+
+    for follower in router.followers:
+        follower.connector.disconnected()
+
+    await router.start_conversation(ReadEvent("my-stream", 0))
+
+    assert len(router.master.dispatcher.active_conversations) == 1
+
+
+@pytest.mark.asyncio
+async def test_master_preference_opens_no_followers():
+
+    router = await make_router(ReadPreference.Master)
+    await router.start_conversation(ReadEvent("my-stream", 0))
+
+    assert router.followers == []
+    assert len(router.master.dispatcher.active_conversations) == 1
+
+
+@pytest.mark.asyncio
+async def test_followers_are_chosen_again_from_fresh_gossip():
+    """
+    After a failover the old follower may be the master, and a new node may
+    have joined. Reads should follow the cluster rather than the nodes we
+    saw at start, and reads in flight on a retired follower are re-routed.
+    """
+
+    router = await make_router()
+    [slave, clone] = router.followers
+    await router.start_conversation(ReadEvent("my-stream", 0))
+    await router.start_conversation(ReadEvent("my-stream", 0))
+
+    await router.refresh_followers(
+        [
+            member(NodeState.Slave, "10.0.0.1"),
+            member(NodeState.Master, "10.0.0.2"),
+            member(NodeState.Slave, "10.0.0.3"),
+            member(NodeState.Slave, "10.0.0.4"),
+        ]
+    )
+
+    assert clone.connector.stopped
+    assert not slave.connector.stopped
+    assert [f.node.address for f in router.followers] == ["10.0.0.3", "10.0.0.1"]
+    assert clone.dispatcher.active_conversations == {}
+    assert len(router.active_conversations) == 2
+
+
+@pytest.mark.asyncio
+async def test_followers_are_chosen_again_when_the_master_reconnects():
+
+    router = await make_router(max_followers=1)
+    router.discovery.last_gossip = [
+        member(NodeState.Master, "10.0.0.3"),
+        member(NodeState.Slave, "10.0.0.1"),
+    ]
+
+    router.master.connector.connected(NodeService("10.0.0.3", 1113, None))
+    await asyncio.sleep(0)
+
+    assert [f.node.address for f in router.followers] == ["10.0.0.1"]
@@ -0,0 +1,409 @@
+import asyncio
+import struct
+import uuid
+
+import pytest
+
+from photonpump import exceptions
+from photonpump import messages as msg
+from photonpump import messages_pb2 as proto
+from photonpump.conversations import (
+    ConnectPersistentSubscription,
+    CreatePersistentSubscription,
+    Ping,
+    ReadAllEvents,
+    ReadEvent,
+    ReadStreamEvents,
+    SubscribeToStream,
+    WriteEvents,
+)
+from photonpump.testing import EventStoreServer, FaultyProxy
+
+
+class Client:
+    """Drives conversations against a server over a raw socket, without the
+    rest of the client."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.output = asyncio.Queue()
+
+    @classmethod
+    async def connect(cls, server):
+        return cls(*await asyncio.open_connection(server.host, server.port))
+
+    def close(self):
+        self.writer.close()
+
+    def send(self, message: msg.OutboundMessage):
+        self.writer.write(bytes(message.header_bytes) + message.payload)
+
+    async def receive(self) -> msg.InboundMessage:
+        (length,) = struct.unpack("<I", await self.reader.readexactly(4))
+        frame = await self.reader.readexactly(length)
+
+        return msg.InboundMessage(
+            uuid.UUID(bytes_le=frame[2:18]), msg.TcpCommand(frame[0]), frame[18:]
+        )
+
+    async def flush(self):
+        while not self.output.empty():
+            self.send(self.output.get_nowait())
+
+    async def converse(self, conversation):
+        await conversation.start(self.output)
+
+        while not conversation.result.done():
+            await self.flush()
+            reply = await self.receive()
+
+            if reply.conversation_id == conversation.conversation_id:
+                await conversation.respond_to(reply, self.output)
+
+        return conversation.result.result()
+
+
+def events(count, type="thing_happened"):
+    return [msg.NewEvent(type, data={"n": i}) for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_writes_check_the_expected_version():
+
+    async with EventStoreServer() as server:
+        client = await Client.connect(server)
+
+        first = await client.converse(
+            WriteEvents("stream", events(2), msg.ExpectedVersion.StreamMustNotExist)
+        )
+        assert first.result == msg.OperationResult.Success
+        assert (first.first_event_number, first.last_event_number) == (0, 1)
+
+        second = await client.converse(WriteEvents("stream", events(1), 1))
+        assert second.result == msg.OperationResult.Success
+        assert second.last_event_number == 2
+
+        stale = await client.converse(WriteEvents("stream", events(1), 1))
+        assert stale.result == msg.OperationResult.WrongExpectedVersion
+
+        missing = await client.converse(
+            WriteEvents("other", events(1), msg.ExpectedVersion.StreamMustExist)
+        )
+        assert missing.result == msg.OperationResult.WrongExpectedVersion
+
+        assert len(server.streams["stream"]) == 3
+        assert "other" not in server.streams
+
+
+@pytest.mark.asyncio
+async def test_reading_a_single_event():
+
+    async with EventStoreServer() as server:
+        client = await Client.connect(server)
+
+        server.append("stream", events(3))
+
+        event = await client.converse(ReadEvent("stream", 1))
+        assert event.event.event_number == 1
+        assert event.event.json() == {"n": 1}
+
+        last = await client.converse(ReadEvent("stream", -1))
+        assert last.event.event_number == 2
+
+        with pytest.raises(exceptions.EventNotFound):
+            await client.converse(ReadEvent("stream", 3))
+
+        with pytest.raises(exceptions.StreamNotFound):
+            await client.converse(ReadEvent("missing", 0))
+
+
+@pytest.mark.asyncio
+async def test_reading_a_stream_in_both_directions():
+
+    async with EventStoreServer() as server:
+        client = await Client.connect(server)
+
+        server.append("stream", events(5))
+
+        forward = await client.converse(ReadStreamEvents("stream", 1, max_count=3))
+        assert [e.event.event_number for e in forward.events] == [1, 2, 3]
+        assert forward.next_event_number == 4
+        assert not forward.is_end_of_stream
+
+        backward = await client.converse(
+            ReadStreamEvents(
+                "stream", -1, max_count=3, direction=msg.StreamDirection.Backward
+            )
+        )
+        assert [e.event.event_number for e in backward.events] == [4, 3, 2]
+        assert backward.next_event_number == 1
+        assert not backward.is_end_of_stream
+
+        rest = await client.converse(
+            ReadStreamEvents(
+                "stream", 1, max_count=3, direction=msg.StreamDirection.Backward
+            )
+        )
+        assert [e.event.event_number for e in rest.events] == [1, 0]
+        assert rest.is_end_of_stream
+
+
+@pytest.mark.asyncio
+async def test_reading_all_in_both_directions():
+
+    async with EventStoreServer() as server:
+        client = await Client.connect(server)
+
+        server.append("a", events(2))
+        server.append("b", events(2))
+
+        forward = await client.converse(ReadAllEvents(max_count=3))
+        assert [(e.event.stream, e.event.event_number) for e in forward.events] == [
+            ("a", 0),
+            ("a", 1),
+            ("b", 0),
+        ]
+
+        rest = await client.converse(ReadAllEvents(forward.next_position, max_count=3))
+        assert [(e.event.stream, e.event.event_number) for e in rest.events] == [
+            ("b", 1)
+        ]
+        assert not rest.is_end_of_stream
+
+        end = await client.converse(ReadAllEvents(rest.next_position, max_count=3))
+        assert end.events == []
+        assert end.is_end_of_stream
+
+        backward = await client.converse(
+            ReadAllEvents(max_count=3, direction=msg.StreamDirection.Backward)
+        )
+        assert [(e.event.stream, e.event.event_number) for e in backward.events] == [
+            ("b", 1),
+            ("b", 0),
+            ("a", 1),
+        ]
+
+
+@pytest.mark.asyncio
+async def test_volatile_subscriptions_receive_new_events():
+
+    async with EventStoreServer() as server:
+        client = await Client.connect(server)
+
+        server.append("stream", events(1))
+        subscription = await client.converse(SubscribeToStream("stream"))
+        assert subscription.first_event_number == 0
+
+        everything = SubscribeToStream("")
+        await client.converse(everything)
+
+        server.append("other", events(1))
+        server.append("stream", events(1))
+
+        for _ in range(3):
+            message = await client.receive()
+            assert message.command == msg.TcpCommand.StreamEventAppeared
+
+            if message.conversation_id == subscription.conversation_id:
+                appeared = proto.StreamEventAppeared()
+                appeared.ParseFromString(message.payload)
+                assert appeared.event.event.event_number == 1
+
+        await subscription.unsubscribe()
+        await client.flush()
+        dropped = await client.receive()
+
+        assert dropped.command == msg.TcpCommand.SubscriptionDropped
+        assert server.subscribers["stream"] == {}
+
+
+@pytest.mark.asyncio
+async def test_persistent_subscriptions_respect_max_in_flight():
+
+    async with EventStoreServer() as server:
+        client = await Client.connect(server)
+
+        server.append("stream", events(3))
+        await client.converse(
+            CreatePersistentSubscription("group", "stream", start_from=0)
+        )
+
+        subscription = await client.converse(
+            ConnectPersistentSubscription("group", "stream", max_in_flight=2)
+        )
+        assert subscription.name == "stream::group"
+
+        first = await client.receive()
+        second = await client.receive()
+        assert server.groups["stream::group"].next_number == 2
+
+        appeared = proto.StreamEventAppeared()
+        appeared.ParseFromString(first.payload)
+        event = msg._make_event(appeared.event)
+        assert event.event.event_number == 0
+
+        await subscription.ack(event)
+        await client.flush()
+
+        third = await client.receive()
+        appeared.ParseFromString(third.payload)
+        assert appeared.event.event.event_number == 2
+        assert (
+            second.command == msg.TcpCommand.PersistentSubscriptionStreamEventAppeared
+        )
+
+
+@pytest.mark.asyncio
+async def test_unacked_events_are_redelivered_when_a_subscriber_leaves():
+
+    async with EventStoreServer() as server:
+
+        server.append("stream", events(2))
+        first = await Client.connect(server)
+        await first.converse(
+            CreatePersistentSubscription("group", "stream", start_from=0)
+        )
+        await first.converse(ConnectPersistentSubscription("group", "stream"))
+        await first.receive()
+        await first.receive()
+        first.close()
+
+        second = await Client.connect(server)
+        await second.converse(ConnectPersistentSubscription("group", "stream"))
+        redelivered = [await second.receive(), await second.receive()]
+
+        assert [m.command for m in redelivered] == [
+            msg.TcpCommand.PersistentSubscriptionStreamEventAppeared
+        ] * 2
+
+
+@pytest.mark.asyncio
+async def test_requests_can_be_refused():
+
+    async with EventStoreServer() as server:
+        client = await Client.connect(server)
+
+        master = server.node._replace(port=1234)
+        server.not_handled(
+            msg.NotHandledReason.NotMaster,
+            count=1,
+            commands=[msg.TcpCommand.WriteEvents],
+            master=master,
+        )
+
+        await client.converse(Ping())
+
+        await WriteEvents("stream", events(1)).start(client.output)
+        await client.flush()
+        refused = await client.receive()
+
+        body = proto.NotHandled()
+        body.ParseFromString(refused.payload)
+        info = proto.NotHandled.MasterInfo()
+        info.ParseFromString(body.additional_info)
+
+        assert refused.command == msg.TcpCommand.NotHandled
+        assert body.reason == msg.NotHandledReason.NotMaster
+        assert info.external_tcp_port == 1234
+
+        retried = await client.converse(WriteEvents("stream", events(1)))
+        assert retried.result == msg.OperationResult.Success
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_are_sent_and_credentials_accepted():
+
+    async with EventStoreServer(heartbeat_interval=0.01) as server:
+        client = await Client.connect(server)
+
+        heartbeat = await client.receive()
+        assert heartbeat.command == msg.TcpCommand.HeartbeatRequest
+
+        write = WriteEvents(
+            "stream", events(1), credential=msg.Credential("admin", "changeit")
+        )
+        result = await client.converse(write)
+
+        assert result.result == msg.OperationResult.Success
+
+
+@pytest.mark.asyncio
+async def test_the_proxy_forwards_frames_split_at_arbitrary_boundaries():
+
+    async with EventStoreServer() as server:
+        async with FaultyProxy(server.node, seed=1) as proxy:
+            proxy.split(3, interval=0)
+            client = await Client.connect(proxy)
+
+            written = await client.converse(WriteEvents("stream", events(3)))
+            read = await client.converse(ReadStreamEvents("stream"))
+
+            assert written.result == msg.OperationResult.Success
+            assert [e.event.json()["n"] for e in read.events] == [0, 1, 2]
+            assert proxy.bytes_forwarded > 0
+            assert proxy.bytes_dropped == 0
+            client.close()
+
+
+@pytest.mark.asyncio
+async def test_the_proxy_delays_and_throttles_traffic():
+
+    async with EventStoreServer() as server:
+        async with FaultyProxy(server.node) as proxy:
+            client = await Client.connect(proxy)
+            loop = asyncio.get_event_loop()
+
+            proxy.delay(0.05, jitter=0.01)
+            started = loop.time()
+            await client.converse(Ping())
+            assert loop.time() - started >= 0.08
+
+            proxy.heal()
+            proxy.throttle(20000)
+            started = loop.time()
+            await client.converse(
+                WriteEvents("stream", [msg.NewEvent("big", data={"x": "x" * 4000})])
+            )
+            assert loop.time() - started >= 0.2
+            client.close()
+
+
+@pytest.mark.asyncio
+async def test_a_blackholed_connection_stays_open_but_silent():
+
+    async with EventStoreServer() as server:
+        async with FaultyProxy(server.node) as proxy:
+            client = await Client.connect(proxy)
+            await client.converse(Ping())
+
+            proxy.blackhole()
+            client.send(msg.OutboundMessage(uuid.uuid4(), msg.TcpCommand.Ping, b""))
+
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.receive(), 0.1)
+
+            assert proxy.bytes_dropped > 0
+            assert len(proxy.connections) == 1
+
+            proxy.heal()
+            await client.converse(Ping())
+            client.close()
+
+
+@pytest.mark.asyncio
+async def test_the_proxy_resets_connections():
+
+    async with EventStoreServer() as server:
+        async with FaultyProxy(server.node) as proxy:
+            client = await Client.connect(proxy)
+            await client.converse(Ping())
+
+            proxy.reset()
+
+            with pytest.raises((ConnectionResetError, asyncio.IncompleteReadError)):
+                await client.receive()
+
+            assert not proxy.connections
+            await asyncio.sleep(0.01)
+            assert not server.connections
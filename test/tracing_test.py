@@ -0,0 +1,81 @@
+import asyncio
+import uuid
+
+import pytest
+
+from photonpump.connection import MessageDispatcher, MessageReader, OutboundQueue
+from photonpump.conversations import Ping
+from photonpump.messages import OutboundMessage, TcpCommand
+from photonpump.tracing import ConversationTrace, Stage, Tracer
+
+from .fakes import TeeQueue
+
+
+def test_durations_are_measured_from_the_previous_stage():
+
+    trace = ConversationTrace(uuid.uuid4(), "Ping")
+    trace.timestamps[Stage.Written] = 1.5
+    trace.timestamps[Stage.Created] = 1.0
+    trace.timestamps[Stage.Resolved] = 4.0
+    trace.timestamps[Stage.Encoded] = 1.25
+
+    assert trace.durations() == [
+        (Stage.Encoded, 0.25),
+        (Stage.Written, 0.25),
+        (Stage.Resolved, 2.5),
+    ]
+    assert trace.total == 3.0
+    assert trace.slowest_stage() == Stage.Resolved
+
+
+@pytest.mark.asyncio
+async def test_slow_conversations_are_kept():
+
+    finished = []
+    tracer = Tracer(slow_threshold=0.01, capacity=1, hook=finished.append)
+
+    fast, slow, slower = Ping(), Ping(), Ping()
+
+    for conversation in (fast, slow, slower):
+        tracer.start(conversation)
+
+    fast.result.set_result(None)
+    await asyncio.sleep(0.02)
+    slow.result.set_result(None)
+    slower.result.set_result(None)
+    await asyncio.sleep(0)
+
+    assert [t.conversation_id for t in finished] == [
+        fast.conversation_id,
+        slow.conversation_id,
+        slower.conversation_id,
+    ]
+    assert [t.conversation_id for t in tracer.slow] == [slower.conversation_id]
+    assert tracer.active == {}
+
+
+@pytest.mark.asyncio
+async def test_a_conversation_is_traced_through_the_pipeline():
+
+    tracer = Tracer(slow_threshold=0)
+    output = OutboundQueue()
+    dispatcher = MessageDispatcher(tracer=tracer)
+    await dispatcher.write_to(output)
+
+    conversation = Ping()
+    await dispatcher.start_conversation(conversation)
+    request = await output.get()
+    tracer.mark(request.conversation_id, Stage.Dequeued)
+    tracer.mark(request.conversation_id, Stage.Written)
+
+    inbound = TeeQueue()
+    reader = MessageReader(asyncio.StreamReader(), 1, inbound, None, tracer=tracer)
+    reply = OutboundMessage(conversation.conversation_id, TcpCommand.Pong, b"")
+    await reader.process(bytes(reply.header_bytes))
+
+    await dispatcher.dispatch(await inbound.get(), output)
+    await asyncio.sleep(0)
+
+    [trace] = tracer.slow
+    assert sorted(trace.timestamps) == list(Stage)
+    assert all(duration >= 0 for (_, duration) in trace.durations())
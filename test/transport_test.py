@@ -0,0 +1,71 @@
+import socket
+
+import pytest
+
+from photonpump.transport import (
+    BULK_THROUGHPUT,
+    DEFAULT,
+    LOW_LATENCY,
+    apply_transport_config,
+)
+
+
+class FakeTransport:
+    def __init__(self, sock):
+        self.sock = sock
+        self.limits = None
+
+    def get_extra_info(self, name):
+        return self.sock if name == "socket" else None
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.limits = (high, low)
+
+
+@pytest.fixture
+def tcp_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    yield sock
+    sock.close()
+
+
+def option(sock, level, name):
+    return sock.getsockopt(level, getattr(socket, name))
+
+
+def test_the_default_config_leaves_buffers_alone(tcp_socket):
+
+    transport = FakeTransport(tcp_socket)
+    apply_transport_config(DEFAULT, transport)
+
+    assert option(tcp_socket, socket.IPPROTO_TCP, "TCP_NODELAY")
+    assert not option(tcp_socket, socket.SOL_SOCKET, "SO_KEEPALIVE")
+    assert transport.limits is None
+
+
+def test_low_latency_enables_keepalive(tcp_socket):
+
+    transport = FakeTransport(tcp_socket)
+    apply_transport_config(LOW_LATENCY, transport)
+
+    assert option(tcp_socket, socket.SOL_SOCKET, "SO_KEEPALIVE")
+
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        assert option(tcp_socket, socket.IPPROTO_TCP, "TCP_KEEPIDLE") == 10
+    assert transport.limits == (64 * 1024, 16 * 1024)
+
+
+def test_bulk_throughput_grows_the_buffers(tcp_socket):
+
+    before = option(tcp_socket, socket.SOL_SOCKET, "SO_RCVBUF")
+    apply_transport_config(BULK_THROUGHPUT, FakeTransport(tcp_socket))
+
+    assert option(tcp_socket, socket.SOL_SOCKET, "SO_RCVBUF") > before
+
+
+def test_transports_without_a_socket_only_get_watermarks():
+
+    transport = FakeTransport(None)
+    apply_transport_config(BULK_THROUGHPUT, transport)
+
+    assert transport.limits == (4 * 1024 * 1024, 1024 * 1024)
@@ -0,0 +1,333 @@
+import asyncio
+
+import pytest
+
+import photonpump.exceptions as exn
+import photonpump.messages as msg
+import photonpump.messages_pb2 as proto
+from photonpump.writers import (
+    OrderedStreamWriter,
+    PublishProgress,
+    WriteCoalescer,
+    publish_stream,
+)
+
+from .fakes import TeeQueue
+
+
+class RecordingDispatcher:
+    """
+    Starts conversations against a TeeQueue and remembers them so that the
+    test can decide when, and how, each write completes.
+    """
+
+    def __init__(self):
+        self.output = TeeQueue()
+        self.conversations = asyncio.Queue()
+
+    async def start_conversation(self, conversation):
+        await conversation.start(self.output)
+        await self.conversations.put(conversation)
+
+        return conversation.result
+
+
+async def complete(
+    conversation, first_event_number, result=msg.OperationResult.Success
+):
+    response = proto.WriteEventsCompleted()
+    response.result = result
+    response.first_event_number = first_event_number
+    response.last_event_number = first_event_number + len(conversation.events) - 1
+
+    await conversation.respond_to(
+        msg.InboundMessage(
+            conversation.conversation_id,
+            msg.TcpCommand.WriteEventsCompleted,
+            response.SerializeToString(),
+        ),
+        None,
+    )
+
+
+async def events(count):
+    for i in range(count):
+        yield msg.NewEvent("pony_jumped", data={"n": i})
+
+
+@pytest.mark.asyncio
+async def test_events_are_chunked_and_versions_chained():
+
+    dispatcher = RecordingDispatcher()
+    progress = []
+
+    publish = asyncio.ensure_future(
+        publish_stream(
+            dispatcher,
+            "my-stream",
+            events(7),
+            expected_version=9,
+            chunk_events=3,
+            max_in_flight=3,
+            on_progress=progress.append,
+        )
+    )
+
+    first = await dispatcher.conversations.get()
+    second = await dispatcher.conversations.get()
+    third = await dispatcher.conversations.get()
+
+    assert [len(c.events) for c in (first, second, third)] == [3, 3, 1]
+    assert [c.expected_version for c in (first, second, third)] == [9, 12, 15]
+
+    await complete(first, 10)
+    await complete(second, 13)
+    await complete(third, 16)
+
+    assert await publish == PublishProgress(7, 3, 16)
+    assert progress == [
+        PublishProgress(3, 1, 12),
+        PublishProgress(6, 2, 15),
+        PublishProgress(7, 3, 16),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_in_flight_frames_are_bounded():
+
+    dispatcher = RecordingDispatcher()
+
+    publish = asyncio.ensure_future(
+        publish_stream(
+            dispatcher, "my-stream", events(6), chunk_events=2, max_in_flight=2
+        )
+    )
+
+    first = await dispatcher.conversations.get()
+    await dispatcher.conversations.get()
+    await asyncio.sleep(0)
+
+    assert dispatcher.conversations.empty()
+
+    await complete(first, 0)
+    third = await dispatcher.conversations.get()
+
+    assert third.expected_version == msg.ExpectedVersion.Any
+    publish.cancel()
+
+
+@pytest.mark.asyncio
+async def test_stream_must_exist_waits_for_the_first_reply():
+
+    dispatcher = RecordingDispatcher()
+
+    publish = asyncio.ensure_future(
+        publish_stream(
+            dispatcher,
+            "my-stream",
+            events(4),
+            expected_version=msg.ExpectedVersion.StreamMustExist,
+            chunk_events=2,
+        )
+    )
+
+    first = await dispatcher.conversations.get()
+    await asyncio.sleep(0)
+    assert dispatcher.conversations.empty()
+
+    await complete(first, 20)
+    second = await dispatcher.conversations.get()
+
+    assert second.expected_version == 21
+    await complete(second, 22)
+
+    assert (await publish).last_event_number == 23
+
+
+@pytest.mark.asyncio
+async def test_failed_write_raises():
+
+    dispatcher = RecordingDispatcher()
+
+    publish = asyncio.ensure_future(
+        publish_stream(
+            dispatcher, "my-stream", events(4), expected_version=1, chunk_events=2
+        )
+    )
+
+    first = await dispatcher.conversations.get()
+    await dispatcher.conversations.get()
+    await complete(first, 0, result=msg.OperationResult.WrongExpectedVersion)
+
+    with pytest.raises(exn.WrongExpectedVersion):
+        await publish
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_coalesced():
+
+    dispatcher = RecordingDispatcher()
+    coalescer = WriteCoalescer(dispatcher, max_delay=0.01)
+
+    first = await coalescer.write("my-stream", [msg.NewEvent("a"), msg.NewEvent("b")])
+    second = await coalescer.write("my-stream", [msg.NewEvent("c")])
+    other = await coalescer.write("other-stream", [msg.NewEvent("d")])
+
+    merged = await dispatcher.conversations.get()
+    separate = await dispatcher.conversations.get()
+
+    assert merged.stream == "my-stream"
+    assert [e.type for e in merged.events] == ["a", "b", "c"]
+    assert separate.stream == "other-stream"
+
+    await complete(merged, 10)
+
+    first_result = await first
+    second_result = await second
+
+    assert (first_result.first_event_number, first_result.last_event_number) == (10, 11)
+    assert (second_result.first_event_number, second_result.last_event_number) == (
+        12,
+        12,
+    )
+    assert not other.done()
+
+
+@pytest.mark.asyncio
+async def test_coalescer_flushes_when_the_batch_is_full():
+
+    dispatcher = RecordingDispatcher()
+    coalescer = WriteCoalescer(dispatcher, max_delay=60, max_events=2)
+
+    await coalescer.write("my-stream", [msg.NewEvent("a")])
+    assert dispatcher.conversations.empty()
+
+    await coalescer.write("my-stream", [msg.NewEvent("b")])
+    conversation = dispatcher.conversations.get_nowait()
+
+    assert len(conversation.events) == 2
+    assert not coalescer.pending
+
+
+@pytest.mark.asyncio
+async def test_coalesced_failures_reach_every_caller():
+
+    dispatcher = RecordingDispatcher()
+    coalescer = WriteCoalescer(dispatcher, max_delay=60)
+
+    first = await coalescer.write("my-stream", [msg.NewEvent("a")])
+    second = await coalescer.write("my-stream", [msg.NewEvent("b")])
+    await coalescer.flush()
+
+    conversation = dispatcher.conversations.get_nowait()
+    await conversation.error(exn.NotReady(conversation.conversation_id))
+
+    for future in (first, second):
+        with pytest.raises(exn.NotReady):
+            await future
+
+
+def pony(n):
+    return [msg.NewEvent("pony_jumped", data={"n": n})]
+
+
+@pytest.mark.asyncio
+async def test_ordered_writes_are_pipelined_with_chained_versions():
+
+    dispatcher = RecordingDispatcher()
+    writer = OrderedStreamWriter(dispatcher, "my-stream", expected_version=4)
+
+    first = await writer.write(pony(1) * 2)
+    second = await writer.write(pony(2))
+
+    convos = [await dispatcher.conversations.get() for _ in range(2)]
+    assert [c.expected_version for c in convos] == [4, 6]
+
+    await complete(convos[0], 5)
+    await complete(convos[1], 7)
+
+    assert (await first).last_event_number == 6
+    assert (await second).last_event_number == 7
+
+
+@pytest.mark.asyncio
+async def test_ordered_writes_wait_for_a_free_slot():
+
+    dispatcher = RecordingDispatcher()
+    writer = OrderedStreamWriter(
+        dispatcher, "my-stream", expected_version=0, max_in_flight=1
+    )
+
+    await writer.write(pony(1))
+    third = asyncio.ensure_future(writer.write(pony(2)))
+    first = await dispatcher.conversations.get()
+    await asyncio.sleep(0)
+
+    assert dispatcher.conversations.empty()
+
+    await complete(first, 1)
+    second = await dispatcher.conversations.get()
+
+    assert second.expected_version == 1
+    third.cancel()
+
+
+@pytest.mark.asyncio
+async def test_a_failed_write_aborts_its_dependents():
+
+    dispatcher = RecordingDispatcher()
+    writer = OrderedStreamWriter(dispatcher, "my-stream", expected_version=0)
+
+    first = await writer.write(pony(1))
+    second = await writer.write(pony(2))
+    convo = await dispatcher.conversations.get()
+
+    await complete(convo, 0, result=msg.OperationResult.WrongExpectedVersion)
+
+    with pytest.raises(exn.WrongExpectedVersion):
+        await first
+
+    with pytest.raises(exn.WriteAborted) as aborted:
+        await second
+
+    assert aborted.value.conversation_id == convo.conversation_id
+
+    with pytest.raises(exn.WriteAborted):
+        await writer.write(pony(3))
+
+    writer.reset(7)
+    await writer.write(pony(3))
+
+    await dispatcher.conversations.get()
+    retry = await dispatcher.conversations.get()
+
+    assert retry.expected_version == 7
+
+
+@pytest.mark.asyncio
+async def test_a_failed_write_with_any_version_aborts_nothing():
+    """
+    Writes sent with ExpectedVersion.Any don't depend on each other, so the
+    server may well have applied the writes after a failed one. Their
+    callers should get the server's answer, not WriteAborted.
+    """
+
+    dispatcher = RecordingDispatcher()
+    writer = OrderedStreamWriter(dispatcher, "my-stream")
+
+    first = await writer.write(pony(1))
+    second = await writer.write(pony(2))
+    convos = [await dispatcher.conversations.get() for _ in range(2)]
+
+    assert [c.expected_version for c in convos] == [msg.ExpectedVersion.Any] * 2
+
+    await complete(convos[0], 0, result=msg.OperationResult.PrepareTimeout)
+    await complete(convos[1], 5)
+
+    with pytest.raises(exn.OperationFailed):
+        await first
+
+    assert (await second).last_event_number == 5
+
+    await writer.write(pony(3))
+    assert (await dispatcher.conversations.get()).expected_version == -2